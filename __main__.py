@@ -10,6 +10,7 @@ dotenv.load_dotenv()
 from server.app import app
 from server.configmanager import config
 from server.database_connect import get_db_session
+from server.logsetup import setup_logging
 
 logger = logging.getLogger(__name__)
 
@@ -26,37 +27,11 @@ def check_required_env_vars(required_vars):
 
 
 def initialize_logger():
-    log_file = "server/logs/server.log"
-
-    # Ensure the logs directory exists
-    os.makedirs(os.path.dirname(log_file), exist_ok=True)
-
-    logger = logging.getLogger()  # Root logger
-    # Set debug or info level based on config
-    if config.get("ENVIRONMENT") == "development":
-        logger.setLevel(logging.INFO)
-    else:
-        logger.setLevel(logging.INFO)
-
-    # Remove existing handlers to avoid duplicates
-    while logger.hasHandlers():
-        logger.removeHandler(logger.handlers[0])
-
-    # File Handler
-    file_handler = logging.FileHandler(log_file, mode="a")  # Append
-    file_handler.setFormatter(
-        logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    )
-
-    # Console Handler
-    stream_handler = logging.StreamHandler()
-    stream_handler.setFormatter(
-        logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    )
-
-    # Attach handlers
-    logger.addHandler(file_handler)
-    logger.addHandler(stream_handler)
+    """
+    Route all logging (uvicorn's included) through the queue pipeline in
+    logsetup: rotated JSON file + console, written by a background thread.
+    """
+    setup_logging()
 
 
 def main():
@@ -180,6 +155,7 @@ def main():
         ssl_certfile=config.get("ssl_certfile"),
         ssl_keyfile=config.get("ssl_keyfile"),
         timeout_keep_alive=config.get("timeout_keep_alive"),
+        log_config=None,  # keep uvicorn's loggers on the root queue handler
     )
 
 
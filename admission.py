@@ -0,0 +1,172 @@
+# admission.py
+# Admission control: bounded concurrency and bounded queueing per upstream,
+# so overload turns into fast 503s instead of everything timing out together.
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+
+from server.configmanager import config
+from server.tracing import span
+
+logger = logging.getLogger(__name__)
+
+GATE_NAMES = ("api", "openai", "vector")
+
+_DEFAULT_LIMITS = {
+    # name: (max_concurrency, max_queue, max_wait seconds)
+    "api": (32, 64, 5.0),
+    "openai": (16, 64, 10.0),
+    "vector": (16, 64, 2.0),
+}
+
+
+class Overloaded(Exception):
+    """
+    Raised when a gate's queue is full or a caller waited longer than max_wait.
+    """
+
+    def __init__(self, gate: str, reason: str, retry_after: int):
+        super().__init__(f"{gate} overloaded ({reason})")
+        self.gate = gate
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Gate:
+    """
+    At most `max_concurrency` holders at once, at most `max_queue` waiting behind
+    them, and no one waits longer than `max_wait` seconds. Waiters are admitted in
+    arrival order (asyncio.Semaphore is FIFO).
+    """
+
+    def __init__(
+        self, name: str, max_concurrency: int, max_queue: int, max_wait: float
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self._waits = deque(maxlen=1024)  # recent queue waits (s)
+        self._hold_ewma = 0.0  # smoothed time a slot is held (s)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        await self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    async def acquire(self) -> None:
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+            self._admit(0.0)
+            return
+
+        if self.waiting >= self.max_queue:
+            self.rejected_full += 1
+            raise Overloaded(self.name, "queue full", self.retry_after())
+
+        self.waiting += 1
+        start = time.monotonic()
+        try:
+            with span("admission_wait", gate=self.name):
+                await asyncio.wait_for(
+                    self._semaphore.acquire(), timeout=self.max_wait
+                )
+        except asyncio.TimeoutError:
+            self.rejected_timeout += 1
+            raise Overloaded(self.name, "queue wait exceeded", self.retry_after())
+        finally:
+            self.waiting -= 1
+        self._admit(time.monotonic() - start)
+
+    def release(self, held: float = 0.0) -> None:
+        self.active -= 1
+        self._hold_ewma = (
+            0.9 * self._hold_ewma + 0.1 * held if self._hold_ewma else held
+        )
+        self._semaphore.release()
+
+    def _admit(self, waited: float) -> None:
+        self.active += 1
+        self.admitted += 1
+        self._waits.append(waited)
+
+    def retry_after(self) -> int:
+        """
+        Seconds until the current backlog has likely drained.
+        """
+        backlog = (self.waiting + 1) / self.max_concurrency
+        return max(1, math.ceil(backlog * (self._hold_ewma or self.max_wait)))
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+
+        def pct(p: float) -> float:
+            if not waits:
+                return 0.0
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))], 4)
+
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected_full": self.rejected_full,
+            "rejected_timeout": self.rejected_timeout,
+            "wait_p50": pct(0.5),
+            "wait_p95": pct(0.95),
+            "wait_max": round(waits[-1], 4) if waits else 0.0,
+        }
+
+
+class AdmissionController:
+    """
+    One Gate per upstream: "api" for whole requests, "openai" for model and
+    embedding calls, "vector" for index queries.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, tuple]] = None):
+        limits = limits or _DEFAULT_LIMITS
+        self.gates: Dict[str, Gate] = {
+            name: Gate(name, *limits[name]) for name in limits
+        }
+
+    def slot(self, name: str):
+        return self.gates[name].slot()
+
+    def stats(self) -> dict:
+        return {name: gate.stats() for name, gate in self.gates.items()}
+
+
+_admission_instance: Optional[AdmissionController] = None
+
+
+def get_admission() -> AdmissionController:
+    global _admission_instance
+    if _admission_instance is None:
+        limits = {}
+        for name in GATE_NAMES:
+            concurrency, queue, wait = _DEFAULT_LIMITS[name]
+            limits[name] = (
+                config.get(f"admission_{name}_concurrency", concurrency),
+                config.get(f"admission_{name}_queue", queue),
+                config.get(f"admission_{name}_max_wait", wait),
+            )
+        _admission_instance = AdmissionController(limits)
+    return _admission_instance
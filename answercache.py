@@ -0,0 +1,197 @@
+# answercache.py
+# Semantic answer cache: serve a stored answer for near-duplicate questions.
+
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional
+
+import numpy as np
+
+from server.configmanager import config
+
+logger = logging.getLogger(__name__)
+
+
+def make_context_key(*parts: Any) -> str:
+    """
+    Hash everything besides the question itself that shapes the answer
+    (model, prior turns, ...). Only entries with the same context can match.
+    """
+    raw = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CachedAnswer:
+    answer: str
+    similarity: float
+
+
+@dataclass
+class _Entry:
+    slot: int
+    reference_ids: frozenset
+    context_key: str
+    answer: str
+    expires_at: float
+
+
+class AnswerCache:
+    """
+    Stores answers keyed on the (unit-normalized) query embedding.
+
+    Vectors live in one preallocated float32 matrix, so a lookup is a single
+    matrix-vector product over at most `max_entries` rows. A stored answer is
+    served when its cosine similarity clears `min_similarity`, the retrieved
+    reference set is identical, the context matches and the entry hasn't expired.
+    Everything is dropped when the index version changes. `max_entries <= 0`
+    stores nothing, so every lookup misses.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 512,
+        ttl: float = 3600,
+        min_similarity: float = 0.97,
+    ):
+        self.max_entries = max(max_entries, 0)
+        self.ttl = ttl
+        self.min_similarity = min_similarity
+        self.index_version: Optional[str] = None
+
+        self._matrix: Optional[np.ndarray] = None  # allocated on first put
+        self._valid = np.zeros(self.max_entries, dtype=bool)
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()  # LRU order
+        self._free_slots = list(range(self.max_entries - 1, -1, -1))
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(vector: Iterable[float]) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def sync_index_version(self, version: str) -> None:
+        """
+        Invalidate everything if the index was re-ingested since the last call.
+        """
+        if self.index_version is not None and version != self.index_version:
+            logger.info(
+                f"[AnswerCache] Index version {self.index_version} -> {version}, clearing"
+            )
+            self.clear()
+        self.index_version = version
+
+    def get(
+        self,
+        query_vector: Iterable[float],
+        reference_ids: Iterable[str],
+        context_key: str,
+    ) -> Optional[CachedAnswer]:
+        if not self._entries or self._matrix is None:
+            self.misses += 1
+            return None
+
+        q = self._normalize(query_vector)
+        if q.shape[0] != self._matrix.shape[1]:
+            self.misses += 1
+            return None
+
+        scores = self._matrix @ q
+        scores[~self._valid] = -1.0
+        refs = frozenset(reference_ids)
+        now = time.time()
+
+        # Only rows above the threshold are candidates; check the best first
+        candidates = np.flatnonzero(scores >= self.min_similarity)
+        for slot in candidates[np.argsort(scores[candidates])[::-1]]:
+            score = float(scores[slot])
+            entry = self._entries.get(int(slot))
+            if entry is None:
+                continue
+            if entry.expires_at <= now:
+                self._evict(entry.slot)
+                continue
+            if entry.reference_ids == refs and entry.context_key == context_key:
+                self._entries.move_to_end(entry.slot)
+                self.hits += 1
+                return CachedAnswer(answer=entry.answer, similarity=score)
+
+        self.misses += 1
+        return None
+
+    def put(
+        self,
+        query_vector: Iterable[float],
+        reference_ids: Iterable[str],
+        context_key: str,
+        answer: str,
+        ttl: Optional[float] = None,
+    ) -> None:
+        if self.max_entries <= 0:
+            return
+        q = self._normalize(query_vector)
+        if self._matrix is None:
+            self._matrix = np.zeros((self.max_entries, q.shape[0]), dtype=np.float32)
+        elif q.shape[0] != self._matrix.shape[1]:
+            # Embedding model changed; old vectors are not comparable.
+            self.clear()
+            self._matrix = np.zeros((self.max_entries, q.shape[0]), dtype=np.float32)
+
+        if not self._free_slots:
+            oldest = next(iter(self._entries))
+            self._evict(oldest)
+            self.evictions += 1
+
+        slot = self._free_slots.pop()
+        self._matrix[slot] = q
+        self._valid[slot] = True
+        self._entries[slot] = _Entry(
+            slot=slot,
+            reference_ids=frozenset(reference_ids),
+            context_key=context_key,
+            answer=answer,
+            expires_at=time.time() + (ttl if ttl is not None else self.ttl),
+        )
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._valid[:] = False
+        self._free_slots = list(range(self.max_entries - 1, -1, -1))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "index_version": self.index_version,
+        }
+
+    def _evict(self, slot: int) -> None:
+        self._entries.pop(slot, None)
+        self._valid[slot] = False
+        self._free_slots.append(slot)
+
+
+_answer_cache_instance = None
+
+
+def get_answer_cache() -> AnswerCache:
+    global _answer_cache_instance
+    if _answer_cache_instance is None:
+        _answer_cache_instance = AnswerCache(
+            max_entries=config.get("answer_cache_max_entries", 512),
+            ttl=config.get("answer_cache_ttl", 3600),
+            min_similarity=config.get("answer_cache_min_similarity", 0.97),
+        )
+    return _answer_cache_instance
@@ -2,37 +2,197 @@ import asyncio
 import json
 import logging
 import time
-from typing import List, Union
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional, Tuple, Union
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from openai import AsyncOpenAI, RateLimitError
-from pinecone import Pinecone
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 
+from server.admission import Overloaded, get_admission
+from server.answercache import get_answer_cache, make_context_key
+from server.chunker import get_tokenizer
+from server.clientlimits import get_client_limiter
 from server.configmanager import config
-from server.ratelimiter import get_ratelimiter
+from server.embeddingcache import get_embedding_cache
+from server.indexversion import DEFAULT_INDEX_VERSION_PATH, read_index_version
+from server.logsetup import log_stats, setup_logging
+from server.metrics import (
+    CLIENT_REJECTIONS,
+    CONTENT_TYPE,
+    RATE_LIMITER_WAIT,
+    REGISTRY,
+    REQUEST_SECONDS,
+    STAGE_SECONDS,
+    TIME_TO_FIRST_TOKEN,
+    observe_usage,
+)
+from server.lexicalindex import exact_terms, get_lexical_store, reciprocal_rank_fusion
+from server.openaiclient import close_openai_client, get_openai_client
+from server.prefetch import get_prefetch_cache
+from server.promptbudget import PromptPlan, get_prompt_budget
+from server.retrievalcache import get_retrieval_cache
+from server.ratelimiter import estimate_request_tokens, get_ratelimiter
+from server.reranker import get_reranker
+from server.settings import Settings
+from server.tracing import (
+    TracingMiddleware,
+    annotate,
+    get_tracer,
+    span,
+    start_span,
+    traced,
+    use_span,
+)
+from server.retrypolicy import (
+    FATAL,
+    RATE_LIMIT,
+    Hedger,
+    classify,
+    get_retry_policy,
+    retry_stats,
+)
+from server.vectorstore import get_vector_store
 
-logging.basicConfig(level=logging.DEBUG)
+# Level and handlers come from logsetup (log_level, sampled debug); debug
+# calls below pass %-style args so nothing is formatted unless the record is kept
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 rate_limiter = get_ratelimiter()
+embedding_cache = get_embedding_cache()
+answer_cache = get_answer_cache()
+retrieval_cache = get_retrieval_cache()
+admission = get_admission()
+client_limiter = get_client_limiter()
+embedding_hedger = Hedger("embedding")
+prefetch_cache = get_prefetch_cache()
+prompt_budget = get_prompt_budget()
+tracer = get_tracer()
+
+#####################
+# Setup Retrieval Backend
+#####################
+# Pinecone (hosted) or a local in-process index, per config "vector_backend"
+vector_store = get_vector_store()
+# In-memory BM25 over the same chunks, fused with the vector matches
+lexical_store = get_lexical_store()
+# Optional CPU rerank of the candidates before they reach the prompt
+reranker = get_reranker()
 
 #####################
-# Setup Keys & Pinecone
+# Metrics read at scrape time from the components' own counters
 #####################
-# Retrieve Pinecone key from config (instead of os.getenv)
-PINECONE_KEY = config.get_or_error("PINECONE_API_KEY")
-pc = Pinecone(api_key=PINECONE_KEY)
+def cache_stats() -> dict:
+    return {
+        "embedding": embedding_cache.stats(),
+        "answer": answer_cache.stats(),
+        "retrieval": retrieval_cache.stats(),
+        "prefetch": prefetch_cache.stats(),
+    }
 
-INDEX_NAME = config.get("INDEX_NAME", "mauibuildingcode")
-index = pc.Index(INDEX_NAME)
+
+REGISTRY.callback(
+    "rag_cache_hits_total",
+    "Cache hits (embedding cache: memory and disk).",
+    lambda: [
+        ({"cache": name}, s["hits"] + s.get("disk_hits", 0))
+        for name, s in cache_stats().items()
+    ],
+    kind="counter",
+)
+REGISTRY.callback(
+    "rag_cache_misses_total",
+    "Cache misses.",
+    lambda: [({"cache": name}, s["misses"]) for name, s in cache_stats().items()],
+    kind="counter",
+)
+REGISTRY.callback(
+    "rag_cache_hit_ratio",
+    "Hit ratio since start.",
+    lambda: [({"cache": name}, s["hit_ratio"]) for name, s in cache_stats().items()],
+)
+REGISTRY.callback(
+    "rag_rate_limiter_wait_seconds_total",
+    "Total time model calls spent waiting on the proactive rate limiter.",
+    lambda: [({}, rate_limiter.stats()["wait_seconds"])],
+    kind="counter",
+)
+REGISTRY.callback(
+    "rag_upstream_rate_limited_total",
+    "HTTP 429 responses from the model API.",
+    lambda: [({}, rate_limiter.stats()["rate_limited"])],
+    kind="counter",
+)
+REGISTRY.callback(
+    "rag_upstream_failures_total",
+    "Failed upstream attempts by call and error class.",
+    lambda: [
+        ({"call": call, "kind": kind}, n)
+        for call, s in retry_stats().items()
+        for kind, n in s["failures"].items()
+    ],
+    kind="counter",
+)
+REGISTRY.callback(
+    "rag_admission_waiting",
+    "Requests queued at each admission gate.",
+    lambda: [({"gate": g}, s["waiting"]) for g, s in admission.stats().items()],
+)
+REGISTRY.callback(
+    "rag_admission_active",
+    "Requests holding a slot at each admission gate.",
+    lambda: [({"gate": g}, s["active"]) for g, s in admission.stats().items()],
+)
+REGISTRY.callback(
+    "rag_admission_rejected_total",
+    "Requests turned away with 503 by an admission gate.",
+    lambda: [
+        ({"gate": g, "reason": reason}, s[f"rejected_{reason}"])
+        for g, s in admission.stats().items()
+        for reason in ("full", "timeout")
+    ],
+    kind="counter",
+)
+REGISTRY.callback(
+    "rag_config_version",
+    "Active config snapshot version in this worker.",
+    lambda: [({}, config.version)],
+)
 
 #####################
 # Create the FastAPI App
 #####################
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Create the pooled OpenAI client once at startup and close it on shutdown,
+    so requests reuse warm connections instead of a new client per call.
+    """
+    setup_logging()  # no-op if __main__ already did
+    get_openai_client()
+    warmup_task = asyncio.create_task(warm_embedding_cache())
+    settings = config.snapshot()
+    reload_interval = settings.config_reload_interval
+    config_watch_task = (
+        asyncio.create_task(config.watch(reload_interval)) if reload_interval else None
+    )
+    if settings.hybrid_retrieval:
+        await asyncio.to_thread(lexical_store.build)
+    yield
+    warmup_task.cancel()
+    if config_watch_task is not None:
+        config_watch_task.cancel()
+    logger.info(f"[lifespan] Embedding cache stats: {embedding_cache.stats()}")
+    await asyncio.to_thread(embedding_cache.close)  # flushes queued disk writes
+    await close_openai_client()
+    vector_store.close()
+    client_limiter.close()
+    rate_limiter.close()
+    reranker.close()
+    tracer.close()
+
+
 app = FastAPI(
     title="Maui Building Code Assistant (FastAPI)",
     description=(
@@ -40,6 +200,7 @@ app = FastAPI(
         "maintaining conversation history."
     ),
     version="2.0.0",
+    lifespan=lifespan,
 )
 app.add_middleware(
     CORSMiddleware,
@@ -47,7 +208,58 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
+# Added last so it is outermost: one trace (and X-Request-ID) per request
+app.add_middleware(TracingMiddleware, tracer=tracer)
+
+
+@app.exception_handler(Overloaded)
+async def handle_overloaded(request: Request, exc: Overloaded):
+    """
+    Shed load quickly when a gate is saturated instead of queueing without bound.
+    """
+    logger.warning(f"[admission] {exc} on {request.url.path}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy, please retry shortly."},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+def client_limit(rule: str):
+    """
+    Route dependency enforcing the per-client limit `rule` (429 + Retry-After).
+    Clients are identified by an issued X-API-Key, else by IP.
+    """
+
+    async def check(request: Request, response: Response) -> None:
+        ip = request.client.host if request.client else None
+        if config.snapshot().client_limit_trust_forwarded:
+            forwarded = request.headers.get("x-forwarded-for")
+            if forwarded:
+                ip = forwarded.split(",")[0].strip()
+        client = client_limiter.client_key(request.headers.get("x-api-key"), ip)
+
+        result = client_limiter.hit(rule, client)
+        client_limiter.schedule_sync(asyncio.get_running_loop())
+        if not result.allowed:
+            CLIENT_REJECTIONS.inc(1, rule)
+            logger.warning(f"[client_limit] {rule} limit exceeded for {client}")
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests, please slow down.",
+                headers={
+                    "Retry-After": str(result.retry_after),
+                    "X-RateLimit-Limit": str(result.limit),
+                    "X-RateLimit-Remaining": "0",
+                },
+            )
+        response.headers["X-RateLimit-Limit"] = str(result.limit)
+        response.headers["X-RateLimit-Remaining"] = str(result.remaining)
+
+    return check
+
+
 #####################
 # Prompt / System Directives
 #####################
@@ -61,6 +273,15 @@ Use these steps:
 4) Ask if the user needs further clarification.
 """
 
+DEVELOPER_PROMPT = [
+    {
+        "role": "developer",
+        "content": "Be precise and concise, use Maui building code references.",
+    }
+]
+
+FALLBACK_ANSWER = "Sorry, we could not process this request at the moment."
+
 
 #####################
 # Request Models
@@ -69,9 +290,16 @@ class ConversationRequest(BaseModel):
     """
     The incoming request includes:
       - messages: A list of dicts with 'role' and 'content' keys
+      - session_id: Optional client session, to pick up /api/prefetch results
     """
 
     messages: List[dict]
+    session_id: Optional[str] = None
+
+
+class PrefetchRequest(BaseModel):
+    session_id: str
+    text: str
 
 
 class FeedbackRequest(BaseModel):
@@ -82,59 +310,107 @@ class FeedbackRequest(BaseModel):
 #####################
 # Utility Functions
 #####################
-async def get_embedding(text: str) -> List[float]:
+@traced("get_embedding")
+async def get_embedding(text: str, settings: Optional[Settings] = None) -> List[float]:
     """
     Obtain embeddings for the given text using OpenAI's embedding model.
     """
+    settings = settings or config.snapshot()
     logger.debug(
-        f"[get_embedding] Received text for embedding: {text[:60]}..."
+        "[get_embedding] Received text for embedding: %.60s...", text
     )  # Truncate for logs
     text = text.replace("\n", " ")
-    client = AsyncOpenAI(api_key=config.get_or_error("OPENAI_API_KEY"))
-    response = await client.embeddings.create(
-        model="text-embedding-ada-002", input=[text]
-    )
-    embedding = response.data[0].embedding
-    logger.debug(f"[get_embedding] Embedding length: {len(embedding)}")
+    model = settings.embedding_model
+
+    cached = await embedding_cache.aget(model, text)
+    if cached is not None:
+        logger.debug("[get_embedding] Embedding cache hit")
+        annotate(cache="hit")
+        return cached
+
+    client = get_openai_client()
+
+    async def request() -> List[float]:
+        response = await client.embeddings.create(model=model, input=[text])
+        return response.data[0].embedding
+
+    async def hedged_request() -> List[float]:
+        return await embedding_hedger.run(request)
+
+    use_hedge = settings.embedding_hedge
+    async with admission.slot("openai"):
+        embedding = await get_retry_policy("embedding").run(
+            hedged_request if use_hedge else request
+        )
+    embedding_cache.put(model, text, embedding)
+    logger.debug("[get_embedding] Embedding length: %d", len(embedding))
     return embedding
 
+
+async def warm_embedding_cache() -> None:
+    """
+    Pre-embed the configured warm-up prompts (e.g. the UI's example questions)
+    in a single batched request, skipping any already cached on disk.
+    """
+    settings = config.snapshot()
+    model = settings.embedding_model
+    texts = [t.replace("\n", " ") for t in settings.embedding_cache_warmup]
+    missing = await embedding_cache.amissing(model, texts)
+    if not missing:
+        return
+    try:
+        response = await get_openai_client().embeddings.create(
+            model=model, input=missing
+        )
+    except Exception as e:
+        logger.warning(f"[warm_embedding_cache] Warm-up failed: {e}")
+        return
+    for text, item in zip(missing, response.data):
+        embedding_cache.put(model, text, item.embedding)
+    logger.info(f"[warm_embedding_cache] Pre-embedded {len(missing)} prompts")
+
+
+@traced("find_similar_texts")
+async def find_similar_texts(
+    latest_query: str,
+    top_k: int = None,
+    query_vector: Optional[List[float]] = None,
+    min_score: Optional[float] = None,
+    settings: Optional[Settings] = None,
+):
     """
     Query Pinecone for the user’s latest question to find relevant references.
     Uses the config pinecone_top_k if provided, otherwise defaults to 3.
     Applies a score threshold to filter out low-relevance results.
     """
+    settings = settings or config.snapshot()
     if not top_k:
-        top_k = config.get("pinecone_top_k", 3)
-    MIN_SCORE_THRESHOLD = config.get("MIN_SCORE_THRESHOLD", 0.3)
-
-
-async def find_similar_texts(latest_query: str, top_k: int = None):
-    if not top_k:
-        top_k = config.get("pinecone_top_k", 3)
-    MIN_SCORE_THRESHOLD = config.get("MIN_SCORE_THRESHOLD", 0.8)
+        top_k = settings.pinecone_top_k
+    MIN_SCORE_THRESHOLD = (
+        min_score if min_score is not None else settings.MIN_SCORE_THRESHOLD
+    )
 
-    logger.debug(f"[find_similar_texts] Query: {latest_query}")
+    logger.debug("[find_similar_texts] Query: %s", latest_query)
     logger.debug(
-        f"[find_similar_texts] top_k: {top_k}, MIN_SCORE_THRESHOLD: {MIN_SCORE_THRESHOLD}"
+        "[find_similar_texts] top_k: %s, MIN_SCORE_THRESHOLD: %s",
+        top_k,
+        MIN_SCORE_THRESHOLD,
     )
 
-    query_vector = await get_embedding(latest_query)
-
-    # Run the Pinecone query
-    search_results = index.query(
-        vector=query_vector, top_k=top_k, include_values=False, include_metadata=True
-    )
+    if query_vector is None:
+        query_vector = await get_embedding(latest_query, settings)
 
-    # Log the response properly
-    if hasattr(search_results, "to_dict"):
-        raw_dict = search_results.to_dict()
-        logger.debug(
-            f"[find_similar_texts] Pinecone raw response (dict): {json.dumps(raw_dict, indent=2)}"
-        )
-    else:
-        logger.debug(
-            f"[find_similar_texts] Pinecone raw response (as-is): {search_results}"
+    # Run the Pinecone query off the event loop
+    try:
+        async with admission.slot("vector"):
+            with STAGE_SECONDS.time("vector_query"), span("vector_query", top_k=top_k):
+                search_results = await vector_store.query(query_vector, top_k)
+    except asyncio.TimeoutError:
+        annotate(timed_out=True)
+        logger.warning(
+            f"[find_similar_texts] Vector query timed out after {vector_store.timeout}s"
         )
+        return []
 
     # Filter matches by a score threshold
     filtered_matches = []
@@ -159,25 +435,198 @@ async def find_similar_texts(latest_query: str, top_k: int = None):
             )
         else:
             logger.debug(
-                f"[find_similar_texts] Excluding match with score={score:.2f} (below threshold)"
+                "[find_similar_texts] Excluding match with score=%.2f (below threshold)",
+                score,
             )
 
     logger.debug(
-        f"[find_similar_texts] Number of filtered matches: {len(filtered_matches)}"
+        "[find_similar_texts] %d of %d matches above threshold",
+        len(filtered_matches),
+        len(matches or []),
     )
+    annotate(matches=len(matches or []), kept=len(filtered_matches))
     return filtered_matches
 
 
-def build_reference_block(references: List[dict]) -> str:
+# (query vector, filtered references, rendered reference block)
+Retrieval = Tuple[List[float], List[dict], str]
+
+
+async def find_hybrid_texts(
+    latest_query: str,
+    top_k: int,
+    query_vector: List[float],
+    min_score: float,
+    settings: Settings,
+) -> List[dict]:
+    """
+    Vector matches (above the threshold) and BM25 matches, `hybrid_candidates`
+    of each, merged by reciprocal rank fusion. Exact terms such as "R602.10" or
+    "U-factor" rank through the lexical side even when their embedding
+    similarity is low.
+    """
+    candidates = max(top_k, settings.hybrid_candidates)
+    vector_matches = await find_similar_texts(
+        latest_query,
+        candidates,
+        query_vector=query_vector,
+        min_score=min_score,
+        settings=settings,
+    )
+    with STAGE_SECONDS.time("lexical_query"), span("lexical_query"):
+        lexical_matches = lexical_store.search(latest_query, candidates)
+    fused = reciprocal_rank_fusion(
+        [vector_matches, lexical_matches], k=settings.hybrid_rrf_k
+    )
+    logger.debug(
+        "[find_hybrid_texts] %d vector + %d lexical -> %d fused",
+        len(vector_matches),
+        len(lexical_matches),
+        len(fused),
+    )
+    return fused[:top_k]
+
+
+def retrieve_options(settings: Settings, hybrid: bool) -> tuple:
+    """
+    The settings besides top_k and the threshold that change what retrieve()
+    returns, for the retrieval cache key: a config reload that turns reranking
+    or hybrid retrieval on, or changes snippet length or the repo URL, misses
+    instead of serving references built the old way.
+    """
+    return (
+        settings.rerank_enabled,
+        settings.rerank_candidates if settings.rerank_enabled else None,
+        hybrid,
+        (settings.hybrid_candidates, settings.hybrid_rrf_k) if hybrid else None,
+        settings.MAX_SNIPPET_LEN,
+        settings.repo_url,
+    )
+
+
+@traced("retrieve")
+async def retrieve(text: str, settings: Optional[Settings] = None) -> Retrieval:
+    """
+    Query vector, filtered references and reference block for `text`. A recent
+    query with a nearly identical vector (and the same top_k, threshold, exact
+    terms and retrieve_options) answers from the retrieval cache without
+    touching the index.
+
+    With reranking on, `rerank_candidates` candidates are fetched and the
+    reranker keeps at most `pinecone_top_k` of them.
+    """
+    settings = settings or config.snapshot()
+    with STAGE_SECONDS.time("embedding"):
+        query_vector = await get_embedding(text, settings)
+    top_k = settings.pinecone_top_k
+    min_score = settings.MIN_SCORE_THRESHOLD
+    rerank = settings.rerank_enabled
+    fetch_k = max(top_k, settings.rerank_candidates) if rerank else top_k
+    hybrid = settings.hybrid_retrieval and lexical_store.ready()
+    variant = exact_terms(text) if hybrid else ""
+    options = retrieve_options(settings, hybrid)
+
+    use_cache = settings.retrieval_cache_enabled
+    if use_cache:
+        retrieval_cache.sync_index_version(current_index_version(settings))
+        cached = retrieval_cache.get(
+            query_vector, top_k, min_score, variant, options
+        )
+        if cached is not None:
+            logger.debug(
+                "[retrieve] Retrieval cache hit (similarity=%.4f)", cached.similarity
+            )
+            annotate(retrieval_cache="hit")
+            return query_vector, cached.references, cached.references_block
+
+    if hybrid:
+        references = await find_hybrid_texts(
+            text, fetch_k, query_vector, min_score, settings
+        )
+    else:
+        references = await find_similar_texts(
+            text,
+            fetch_k,
+            query_vector=query_vector,
+            min_score=min_score,
+            settings=settings,
+        )
+    if rerank:
+        with STAGE_SECONDS.time("rerank"), span("rerank", candidates=len(references)):
+            references = await reranker.rerank(text, references, top_k)
+    with STAGE_SECONDS.time("reference_build"), span("reference_build"):
+        references_block = build_reference_block(references, settings=settings)
+    # Empty results aren't cached: they may come from a timed-out query
+    if use_cache and references:
+        retrieval_cache.put(
+            query_vector,
+            top_k,
+            min_score,
+            references,
+            references_block,
+            variant,
+            options,
+        )
+    return query_vector, references, references_block
+
+
+async def retrieve_for_session(
+    text: str, session_id: Optional[str], settings: Settings
+) -> Retrieval:
+    """
+    Reuse the session's prefetch for this exact text if there is one (waiting
+    for it if it is still running), else retrieve now.
+    """
+    if session_id and settings.prefetch_enabled:
+        prefetched = prefetch_cache.get(session_id, text)
+        if prefetched is not None and not prefetched.cancelled():
+            try:
+                # shield: a cancelled request must not cancel the shared prefetch
+                # (its spans aren't part of this request's trace)
+                annotate(prefetch="hit")
+                return await asyncio.shield(prefetched)
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    raise  # this request itself is being cancelled
+                # only the prefetch was cancelled: retrieve below instead
+                logger.debug("[retrieve_for_session] Prefetch was cancelled")
+            except Exception as e:
+                logger.debug(f"[retrieve_for_session] Prefetch failed: {e!r}")
+    return await retrieve(text, settings)
+
+
+def start_retrieval(
+    text: str, session_id: Optional[str], settings: Settings
+) -> asyncio.Future:
+    """
+    Start retrieval as a task so the embedding request is in flight while the
+    caller prepares the rest of the request.
+    """
+    return asyncio.ensure_future(retrieve_for_session(text, session_id, settings))
+
+
+def log_prefetch_failure(task: asyncio.Future) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.debug(f"[prefetch] Background retrieval failed: {task.exception()!r}")
+
+
+def build_reference_block(
+    references: List[dict],
+    snippet_tokens: Optional[int] = None,
+    settings: Optional[Settings] = None,
+) -> str:
     """
     Turns a list of references into a readable block for the system prompt or assistant.
-    Includes snippet trimming to keep token usage in check.
+    Includes snippet trimming to keep token usage in check; `snippet_tokens`
+    trims further when the prompt budget is tight.
     """
     logger.debug(
-        f"[build_reference_block] Building reference block for {len(references)} references"
+        "[build_reference_block] Building reference block for %d references",
+        len(references),
     )
-    REPO_URL = config.get("repo_url", "https://github.com/username/repo/blob/main/")
-    MAX_SNIPPET_LEN = config.get("MAX_SNIPPET_LEN", 300)
+    settings = settings or config.snapshot()
+    REPO_URL = settings.repo_url
+    MAX_SNIPPET_LEN = settings.MAX_SNIPPET_LEN
 
     if not references:
         logger.debug("[build_reference_block] No references found above threshold.")
@@ -201,146 +650,258 @@ def build_reference_block(references: List[dict]) -> str:
         snippet = meta.get("text", "").strip().replace("\n", " ")
         if len(snippet) > MAX_SNIPPET_LEN:
             snippet = snippet[:MAX_SNIPPET_LEN] + "..."
+        if snippet_tokens is not None:
+            pieces = get_tokenizer().split(snippet, snippet_tokens)
+            if len(pieces) > 1:
+                snippet = pieces[0] + "..."
 
         score_str = f"(score={ref['score']:.2f})"
         lines.append(f'[{idx}] "{snippet}" {score_str} ({link})')
 
     references_block = "\n".join(lines)
-    logger.debug(f"[build_reference_block] Final reference block:\n{references_block}")
+    logger.debug("[build_reference_block] Final reference block:\n%s", references_block)
     return references_block
 
 
-async def generate_response(messages: List[dict]) -> str:
+async def record_upstream_error(exc: BaseException, kind: str, attempt: int) -> None:
     """
-    Calls the 'oai.responses' or chat completion API with the desired model (gpt-4.1-mini).
-    We handle potential rate-limiting via multiple attempts if configured (MAX_ATTEMPTS).
+    Retry hook: a 429 pauses every caller of the model API, not just this request.
     """
-    logger.debug("[generate_response] Invoked with messages:")
-    for m in messages:
-        logger.debug(
-            f"  Role: {m['role']}, Content (truncated): {m['content'][:80]}..."
+    if kind == RATE_LIMIT:
+        await rate_limiter.limit(
+            "openai_requests", getattr(exc, "response", None), attempt=attempt
         )
 
-    openai_key = config.get_or_error("OPENAI_API_KEY")
-    model_name = config.get("model_name", "gpt-4.1-mini")
-    max_tokens = config.get("max_tokens", 500)
-    temperature = config.get("temperature", 0.7)
-    MAX_ATTEMPTS = config.get("MAX_ATTEMPTS", 3)
-    use_responses_api = config.get("use_responses_api", True)
 
-    developer_prompt = [
-        {
-            "role": "developer",
-            "content": "Be precise and concise, use Maui building code references.",
-        }
-    ]
-    sequence = developer_prompt + messages
+@traced("generate_response")
+async def generate_response(
+    messages: List[dict], settings: Optional[Settings] = None
+) -> str:
+    """
+    Calls the 'oai.responses' or chat completion API with the desired model (gpt-4.1-mini).
+    Rate limits, timeouts, 5xx and connection errors are retried with jittered
+    backoff, up to MAX_ATTEMPTS within generate_deadline (see retrypolicy).
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[generate_response] Invoked with messages:")
+        for m in messages:
+            logger.debug(
+                "  Role: %s, Content (truncated): %.80s...", m["role"], m["content"]
+            )
 
-    logger.debug("[generate_response] Combined developer + user messages:")
-    for i, s in enumerate(sequence):
-        logger.debug(f"  [{i}] {s}")
+    settings = settings or config.snapshot()
+    model_name = settings.model_name
+    max_tokens = settings.max_tokens
+    temperature = settings.temperature
 
-    oai = AsyncOpenAI(api_key=openai_key)
+    sequence = DEVELOPER_PROMPT + messages
+    annotate(model=model_name)
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("[generate_response] Combined developer + user messages:")
+        for i, s in enumerate(sequence):
+            logger.debug("  [%d] %s", i, s)
+
+    oai = get_openai_client()
     timer_start_time = time.time()
+    estimated_tokens = estimate_request_tokens(sequence, max_tokens)
 
-    response = None
-    for attempt in range(MAX_ATTEMPTS):
-        wait_time = await rate_limiter.get_limit("openai_requests")
+    async def attempt():
+        wait_time = await rate_limiter.acquire(
+            {"openai_requests": 1, "openai_tokens": estimated_tokens}
+        )
+        RATE_LIMITER_WAIT.observe(wait_time)
+        annotate(rate_limiter_wait_ms=round(wait_time * 1000, 1))
         if wait_time > 0:
-            logger.debug(f"[generate_response] Rate-limiter wait time: {wait_time}s")
-            await asyncio.sleep(wait_time)
+            logger.debug("[generate_response] Rate-limiter wait time: %.3fs", wait_time)
+        logger.debug("[generate_response] Sending request to oai.responses.create()")
+        raw = await oai.responses.with_raw_response.create(
+            model=model_name, input=sequence, temperature=temperature
+        )
+        rate_limiter.update_from_headers(raw.headers)
+        return raw.parse()
 
+    response = None
+    async with admission.slot("openai"):
         try:
-            logger.debug(
-                "[generate_response] Sending request to oai.responses.create()"
+            response = await get_retry_policy("generate").run(
+                attempt, on_error=record_upstream_error
             )
-            response = await oai.responses.create(
-                model=model_name, input=sequence, temperature=temperature
-            )
-            break
-        except RateLimitError as e:
-            logger.warning(
-                f"[generate_response] RateLimitError encountered on attempt {attempt+1}"
-            )
-            if hasattr(e, "response") and e.response.status_code == 429:
-                await rate_limiter.limit("openai_requests", e.response)
-            else:
-                await rate_limiter.limit("openai_requests")
+        except Exception as e:
+            if classify(e) == FATAL:
+                raise
+            logger.error(f"[generate_response] Giving up after {classify(e)}: {e!r}")
 
     if response is None:
         logger.error("[generate_response] No valid response after all attempts.")
-        return "Sorry, we could not process this request at the moment."
+        annotate(fallback=True)
+        return FALLBACK_ANSWER
 
     timer_end_time = time.time()
+    STAGE_SECONDS.observe(timer_end_time - timer_start_time, "llm")
     logger.info(
-        json.dumps(
-            {
-                "event": "aoi_request",
-                "latency": round(timer_end_time - timer_start_time, 3),
-                "model": model_name,
-            }
-        )
+        "aoi_request",
+        extra={
+            "event": "aoi_request",
+            "latency": round(timer_end_time - timer_start_time, 3),
+            "model": model_name,
+        },
     )
 
     # Log usage if the API provides it
     if hasattr(response, "usage"):
         input_tokens = getattr(response.usage, "input_tokens", None)
         output_tokens = getattr(response.usage, "output_tokens", None)
+        if input_tokens is not None and output_tokens is not None:
+            rate_limiter.settle(
+                "openai_tokens", estimated_tokens, input_tokens + output_tokens
+            )
+            observe_usage(input_tokens, output_tokens)
+            annotate(input_tokens=input_tokens, output_tokens=output_tokens)
         logger.info(
-            f"[generate_response] Usage - input tokens: {input_tokens}, output tokens: {output_tokens}"
+            "[generate_response] Usage - input tokens: %s, output tokens: %s",
+            input_tokens,
+            output_tokens,
         )
     else:
         logger.debug("[generate_response] No usage info returned from the API.")
 
     logger.debug(
-        f"[generate_response] Received response text (truncated): {response.output_text[:300]}..."
+        "[generate_response] Received response text (truncated): %.300s...",
+        response.output_text,
     )
     return response.output_text
 
 
-#####################
-# Routes
-#####################
-@app.post("/api")
-async def handle_conversation(data: ConversationRequest):
+async def stream_response(
+    messages: List[dict], settings: Optional[Settings] = None
+) -> AsyncIterator[dict]:
     """
-    Handles multi-turn conversation by receiving the entire conversation array.
-    1) Find the last user message as the new query.
-    2) Query Pinecone for references (filtered by threshold).
-    3) Construct prompt (system + references + conversation).
-    4) Get model response and return JSON with answer.
+    Streaming counterpart of generate_response. Yields {"type": "delta", "text": ...}
+    for each output text delta and a final {"type": "usage", "usage": {...}}.
+    Retries only happen before the stream opens; yields nothing if every attempt
+    fails. If the stream breaks off after opening (read error, timeout, a
+    response.failed or error event), the last item is {"type": "error", ...}.
     """
-    logger.debug("[handle_conversation] Received request with messages:")
-    for i, msg in enumerate(data.messages):
-        logger.debug(f"  [{i}] Role: {msg['role']}, Content: {msg['content']!r}")
+    settings = settings or config.snapshot()
+    model_name = settings.model_name
+    max_tokens = settings.max_tokens
+    temperature = settings.temperature
+    sequence = DEVELOPER_PROMPT + messages
 
-    messages = data.messages
-    if not messages:
-        logger.debug("[handle_conversation] No messages found in request.")
-        return {"answer": "No messages found."}
+    oai = get_openai_client()
+    timer_start_time = time.time()
+    estimated_tokens = estimate_request_tokens(sequence, max_tokens)
+    # Not made current across yields: the consumer's spans aren't its children
+    llm_span = start_span("stream_response", model=model_name)
+
+    async def attempt():
+        wait_time = await rate_limiter.acquire(
+            {"openai_requests": 1, "openai_tokens": estimated_tokens}
+        )
+        RATE_LIMITER_WAIT.observe(wait_time)
+        annotate(rate_limiter_wait_ms=round(wait_time * 1000, 1))
+        if wait_time > 0:
+            logger.debug("[stream_response] Rate-limiter wait time: %.3fs", wait_time)
+        raw = await oai.responses.with_raw_response.create(
+            model=model_name, input=sequence, temperature=temperature, stream=True
+        )
+        rate_limiter.update_from_headers(raw.headers)
+        return raw.parse()
 
-    # Find the last user message
-    latest_user_message = ""
-    for msg in reversed(messages):
-        if msg.get("role") == "user":
-            latest_user_message = msg.get("content", "")
-            break
+    async with admission.slot("openai"):
+        stream = None
+        try:
+            with use_span(llm_span):
+                stream = await get_retry_policy("generate").run(
+                    attempt, on_error=record_upstream_error
+                )
+        except Exception as e:
+            llm_span.end(error=type(e).__name__)
+            if classify(e) == FATAL:
+                raise
+            logger.error(f"[stream_response] Giving up after {classify(e)}: {e!r}")
 
-    if not latest_user_message:
-        logger.debug("[handle_conversation] No user message found in conversation.")
-        return {"answer": "No user message found."}
+        if stream is None:
+            logger.error("[stream_response] No valid stream after all attempts.")
+            return
 
-    logger.debug(f"[handle_conversation] Latest user message: {latest_user_message!r}")
+        first_token = True
+        error = "stream ended before response.completed"
+        try:
+            async for event in stream:
+                if event.type == "response.output_text.delta":
+                    if first_token:
+                        TIME_TO_FIRST_TOKEN.observe(time.time() - timer_start_time)
+                        llm_span.set(
+                            time_to_first_token_ms=round(
+                                (time.time() - timer_start_time) * 1000, 1
+                            )
+                        )
+                        first_token = False
+                    yield {"type": "delta", "text": event.delta}
+                elif event.type == "response.completed":
+                    error = None
+                    usage = getattr(event.response, "usage", None)
+                    if usage is not None:
+                        rate_limiter.settle(
+                            "openai_tokens",
+                            estimated_tokens,
+                            usage.input_tokens + usage.output_tokens,
+                        )
+                        observe_usage(usage.input_tokens, usage.output_tokens)
+                        llm_span.set(
+                            input_tokens=usage.input_tokens,
+                            output_tokens=usage.output_tokens,
+                        )
+                    yield {
+                        "type": "usage",
+                        "usage": {
+                            "input_tokens": getattr(usage, "input_tokens", None),
+                            "output_tokens": getattr(usage, "output_tokens", None),
+                        },
+                    }
+                elif event.type in ("response.failed", "error"):
+                    error = event.type
+                    break
+        except Exception as e:
+            error = type(e).__name__
+            logger.error(f"[stream_response] Stream failed mid-response: {e!r}")
+        finally:
+            # Also runs when the client disconnects (the generator is closed)
+            await stream.close()
+            STAGE_SECONDS.observe(time.time() - timer_start_time, "llm")
+            llm_span.end(error=error)
+            logger.info(
+                "aoi_stream",
+                extra={
+                    "event": "aoi_stream",
+                    "latency": round(time.time() - timer_start_time, 3),
+                    "model": model_name,
+                    **({"error": error} if error else {}),
+                },
+            )
 
-    # 1) Pinecone references
-    references = await find_similar_texts(latest_user_message)
-    logger.debug(f"[handle_conversation] references: {references}")
+        if error is not None:
+            logger.error(f"[stream_response] Upstream stream broke off: {error}")
+            yield {"type": "error", "message": error}
 
-    references_block = build_reference_block(references)
-    logger.debug(f"[handle_conversation] references_block: {references_block}")
 
-    # 2) Construct the full prompt sequence
-    prompt_sequence = [
+def find_latest_user_message(messages: List[dict]) -> Tuple[str, int]:
+    """
+    Returns the content and position of the last user message ("", len) if none.
+    """
+    for i in range(len(messages) - 1, -1, -1):
+        if messages[i].get("role") == "user":
+            return messages[i].get("content", ""), i
+    return "", len(messages)
+
+
+def build_prompt_sequence(references_block: str, messages: List[dict]) -> List[dict]:
+    """
+    System prompt + references + the conversation so far.
+    """
+    return [
         {"role": "system", "content": SYSTEM_PROMPT},
         # Put references in an 'assistant' role so it's seen as context
         {
@@ -349,16 +910,369 @@ async def handle_conversation(data: ConversationRequest):
         },
         *messages,
     ]
-    logger.debug("[handle_conversation] Final prompt sequence ready for generation.")
 
-    # 3) Generate response
-    answer = await generate_response(prompt_sequence)
-    logger.debug(f"[handle_conversation] Final answer from model: {answer}")
 
-    return {"answer": answer}
+# Everything build_prompt_sequence and generate_response add around the
+# conversation and the reference block, for the prompt budget
+PROMPT_FRAME = DEVELOPER_PROMPT + [
+    {"role": "system", "content": SYSTEM_PROMPT},
+    {"role": "assistant", "content": "Relevant Maui code references:\n\n"},
+]
+
+
+def plan_prompt(messages: List[dict], settings: Settings) -> Optional[PromptPlan]:
+    if not settings.prompt_budget_enabled:
+        return None
+    return prompt_budget.plan(PROMPT_FRAME, messages)
+
+
+def build_budgeted_prompt(
+    plan: Optional[PromptPlan],
+    messages: List[dict],
+    references: List[dict],
+    references_block: str,
+    settings: Settings,
+) -> List[dict]:
+    """
+    build_prompt_sequence within the prompt token budget: the history as planned,
+    and the reference block rebuilt with shorter snippets (then fewer
+    references) if it doesn't fit in what is left.
+    """
+    if plan is None:
+        return build_prompt_sequence(references_block, messages)
+    reference_tokens = get_tokenizer().count(references_block)
+    if references and reference_tokens > plan.reference_tokens:
+        keep, snippet_tokens = prompt_budget.reference_layout(
+            len(references), plan.reference_tokens
+        )
+        references_block = build_reference_block(
+            references[:keep], snippet_tokens=snippet_tokens, settings=settings
+        )
+        reference_tokens = get_tokenizer().count(references_block)
+    prompt_budget.record(plan, reference_tokens)
+    return build_prompt_sequence(references_block, plan.messages)
+
+
+def current_index_version(settings: Optional[Settings] = None) -> str:
+    settings = settings or config.snapshot()
+    return read_index_version(settings.INDEX_VERSION_PATH or DEFAULT_INDEX_VERSION_PATH)
+
+
+def answer_cache_context(
+    messages: List[dict], latest_user_index: int, settings: Settings
+) -> str:
+    """
+    Drops stale answers if the index was re-ingested, then returns the context key
+    (model + prior turns) that cached answers must match.
+    """
+    answer_cache.sync_index_version(current_index_version(settings))
+    return make_context_key(settings.model_name, messages[:latest_user_index])
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+#####################
+# Routes
+#####################
+@app.post("/api", dependencies=[Depends(client_limit("api"))])
+async def handle_conversation(data: ConversationRequest, response: Response):
+    """
+    Handles multi-turn conversation by receiving the entire conversation array.
+    1) Find the last user message as the new query.
+    2) Query Pinecone for references (filtered by threshold). The embedding
+       starts before the history work, or comes from this session's prefetch.
+    3) Serve a cached answer if a near-identical question was answered
+       with the same references and history (X-Answer-Cache: hit).
+    4) Construct prompt (system + references + conversation), within the
+       prompt token budget (older turns dropped or condensed if too long).
+    5) Get model response and return JSON with answer.
+    """
+    request_start = time.perf_counter()
+    async with admission.slot("api"):
+        settings = config.snapshot()  # one consistent config for this request
+        messages = data.messages
+        if not messages:
+            logger.debug("[handle_conversation] No messages found in request.")
+            return {"answer": "No messages found."}
+
+        # Find the last user message
+        latest_user_message, latest_user_index = find_latest_user_message(messages)
+
+        if not latest_user_message:
+            logger.debug(
+                "[handle_conversation] No user message found in conversation."
+            )
+            return {"answer": "No user message found."}
+
+        # 1) Pinecone references: start the embedding first (or pick up the
+        # session's prefetch), then do the history work while it is in flight
+        retrieval = start_retrieval(latest_user_message, data.session_id, settings)
+        try:
+            await asyncio.sleep(0)  # let the embedding request go out
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[handle_conversation] Received request with messages:")
+                for i, msg in enumerate(messages):
+                    logger.debug(
+                        "  [%d] Role: %s, Content: %r", i, msg["role"], msg["content"]
+                    )
+            use_answer_cache = settings.answer_cache_enabled
+            if use_answer_cache:
+                context_key = answer_cache_context(
+                    messages, latest_user_index, settings
+                )
+            plan = plan_prompt(messages, settings)
+
+            query_vector, references, references_block = await retrieval
+        finally:
+            retrieval.cancel()  # no-op unless we bailed out early
+        logger.debug("[handle_conversation] references: %s", references)
+        reference_ids = [ref["id"] for ref in references]
+
+        # 2) Semantic answer cache (keyed on the same query vector)
+        if use_answer_cache:
+            cached = answer_cache.get(query_vector, reference_ids, context_key)
+            if cached is not None:
+                logger.debug(
+                    "[handle_conversation] Answer cache hit (similarity=%.4f)",
+                    cached.similarity,
+                )
+                response.headers["X-Answer-Cache"] = "hit"
+                response.headers["X-Answer-Cache-Similarity"] = (
+                    f"{cached.similarity:.4f}"
+                )
+                REQUEST_SECONDS.observe(
+                    time.perf_counter() - request_start, "api", "hit"
+                )
+                annotate(answer_cache="hit")
+                return {"answer": cached.answer}
+            response.headers["X-Answer-Cache"] = "miss"
+        else:
+            response.headers["X-Answer-Cache"] = "bypass"
+
+        logger.debug("[handle_conversation] references_block: %s", references_block)
+
+        # 3) Construct the full prompt sequence, within the token budget
+        prompt_sequence = build_budgeted_prompt(
+            plan, messages, references, references_block, settings
+        )
+        logger.debug(
+            "[handle_conversation] Final prompt sequence ready for generation."
+        )
+
+        # 4) Generate response
+        answer = await generate_response(prompt_sequence, settings)
+        logger.debug("[handle_conversation] Final answer from model: %s", answer)
+
+        if use_answer_cache and answer != FALLBACK_ANSWER:
+            answer_cache.put(query_vector, reference_ids, context_key, answer)
+
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - request_start,
+            "api",
+            response.headers["X-Answer-Cache"],
+        )
+        annotate(answer_cache=response.headers["X-Answer-Cache"])
+        return {"answer": answer}
+
+
+@app.post("/api/stream", dependencies=[Depends(client_limit("api"))])
+async def handle_conversation_stream(data: ConversationRequest):
+    """
+    Streaming variant of /api using server-sent events:
+      - event: references  -> the reference block, sent before generation starts
+      - event: token       -> one per text delta from the model
+      - event: done        -> latency, time-to-first-token and token usage
+      - event: error       -> if no answer could be produced, or the model
+                              stream broke off partway ("partial": true)
+    """
+    request_start = time.time()
+    settings = config.snapshot()
+    messages = data.messages
+    latest_user_message, latest_user_index = find_latest_user_message(messages)
+
+    if not latest_user_message:
+        logger.debug("[handle_conversation_stream] No user message found.")
+
+        async def no_message():
+            yield sse_event("error", {"message": "No user message found."})
+
+        return StreamingResponse(no_message(), media_type="text/event-stream")
+
+    async with admission.slot("api"):
+        retrieval = start_retrieval(latest_user_message, data.session_id, settings)
+        try:
+            await asyncio.sleep(0)  # let the embedding request go out
+            use_answer_cache = settings.answer_cache_enabled
+            if use_answer_cache:
+                context_key = answer_cache_context(
+                    messages, latest_user_index, settings
+                )
+            plan = plan_prompt(messages, settings)
+            query_vector, references, references_block = await retrieval
+        finally:
+            retrieval.cancel()
+        reference_ids = [ref["id"] for ref in references]
+
+        cached = None
+        if use_answer_cache:
+            cached = answer_cache.get(query_vector, reference_ids, context_key)
+
+    cache_status = "hit" if cached else ("miss" if use_answer_cache else "bypass")
+    annotate(answer_cache=cache_status)
+
+    async def event_stream():
+        yield sse_event(
+            "references", {"references": references_block, "ids": reference_ids}
+        )
+
+        if cached is not None:
+            yield sse_event("token", {"text": cached.answer})
+            yield sse_event(
+                "done",
+                {
+                    "cached": True,
+                    "similarity": round(cached.similarity, 4),
+                    "latency": round(time.time() - request_start, 3),
+                },
+            )
+            REQUEST_SECONDS.observe(time.time() - request_start, "stream", "hit")
+            return
+
+        prompt_sequence = build_budgeted_prompt(
+            plan, messages, references, references_block, settings
+        )
+        parts = []
+        usage = {}
+        first_token_time = None
+        try:
+            async for chunk in stream_response(prompt_sequence, settings):
+                if chunk["type"] == "delta":
+                    if first_token_time is None:
+                        first_token_time = time.time()
+                    parts.append(chunk["text"])
+                    yield sse_event("token", {"text": chunk["text"]})
+                elif chunk["type"] == "usage":
+                    usage = chunk["usage"]
+                elif chunk["type"] == "error":
+                    # Broke off mid-answer: end with an error frame, cache nothing
+                    yield sse_event(
+                        "error",
+                        {"message": FALLBACK_ANSWER, "partial": bool(parts)},
+                    )
+                    return
+        except Overloaded as e:
+            logger.warning(f"[handle_conversation_stream] {e}")
+            yield sse_event(
+                "error",
+                {"message": FALLBACK_ANSWER, "retry_after": e.retry_after},
+            )
+            return
+        except Exception as e:
+            logger.error(f"[handle_conversation_stream] Generation failed: {e!r}")
+            yield sse_event("error", {"message": FALLBACK_ANSWER})
+            return
+
+        if first_token_time is None:
+            yield sse_event("error", {"message": FALLBACK_ANSWER})
+            return
+
+        if use_answer_cache:
+            answer_cache.put(query_vector, reference_ids, context_key, "".join(parts))
+
+        yield sse_event(
+            "done",
+            {
+                "cached": False,
+                "latency": round(time.time() - request_start, 3),
+                "time_to_first_token": round(first_token_time - request_start, 3),
+                **usage,
+            },
+        )
+        REQUEST_SECONDS.observe(time.time() - request_start, "stream", cache_status)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # don't let a proxy buffer the stream
+            "X-Answer-Cache": cache_status,
+        },
+    )
+
+
+@app.post("/api/prefetch", dependencies=[Depends(client_limit("prefetch"))])
+async def handle_prefetch(data: PrefetchRequest):
+    """
+    Called by the UI while the user types (debounced). Starts retrieval for the
+    draft in the background and returns at once; a following /api or /api/stream
+    call with the same session_id and text reuses the result. Skipped for short
+    drafts and while the upstream gates have a queue, so prefetching never
+    competes with real requests.
+    """
+    settings = config.snapshot()
+    if not settings.prefetch_enabled:
+        return {"status": "disabled"}
+    text = data.text.strip()
+    if len(text) < settings.prefetch_min_chars:
+        return {"status": "skipped"}
+    if prefetch_cache.has(data.session_id, text):
+        return {"status": "cached"}
+    if admission.gates["openai"].waiting or admission.gates["vector"].waiting:
+        return {"status": "busy"}
+
+    task = asyncio.ensure_future(retrieve(text, settings))
+    task.add_done_callback(log_prefetch_failure)
+    prefetch_cache.put(data.session_id, text, task)
+    return {"status": "started"}
+
+
+@app.get("/metrics")
+async def handle_metrics():
+    """
+    Prometheus text format. Metrics are per worker process; scrape each worker
+    (or run one) for complete numbers.
+    """
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+@app.get("/stats")
+async def handle_stats():
+    """
+    Cache, rate-limiter, admission (queue depth / wait) and per-client limit
+    counters for quick inspection.
+    """
+    return {
+        "embedding_cache": embedding_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "retrieval_cache": retrieval_cache.stats(),
+        "reranker": reranker.stats(),
+        "rate_limiter": rate_limiter.stats(),
+        "admission": admission.stats(),
+        "client_limits": client_limiter.stats(),
+        "retries": retry_stats(),
+        "embedding_hedge": embedding_hedger.stats(),
+        "prefetch": prefetch_cache.stats(),
+        "prompt_budget": prompt_budget.stats(),
+        "logging": log_stats(),
+        "tracing": tracer.stats(),
+    }
+
+
+@app.get("/admin/config")
+async def handle_config_status():
+    """
+    The active config version in this worker (bumped on every hot reload or
+    override), a hash of its settings, and the last reload error, if any.
+    Values themselves are not exposed.
+    """
+    return config.status()
 
 
-@app.post("/feedback")
+@app.post("/feedback", dependencies=[Depends(client_limit("feedback"))])
 async def handle_feedback(data: FeedbackRequest):
     """
     Receives user feedback (e.g. thumbs up/down) plus the conversation history.
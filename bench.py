@@ -0,0 +1,925 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the server's hot paths. Everything runs against local stub
+services, so no API keys or network access are needed.
+
+Run from the project root (the directory that contains server/):
+
+    python -m server.bench openai-client --requests 200
+"""
+
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List
+
+# Config is only read for pool limits; make sure it never demands real keys.
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+os.environ.setdefault("PINECONE_API_KEY", "pc-bench")
+
+logging.basicConfig(level=logging.WARNING)
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIM = 1536
+STUB_VECTOR = [random.random() for _ in range(EMBEDDING_DIM)]
+
+
+#####################
+# Stub services
+#####################
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    """
+    Minimal stand-in for the OpenAI REST API. Answers /embeddings with a fixed
+    vector per input after an optional artificial delay.
+    """
+
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+    delay: float = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self.delay:
+            time.sleep(self.delay)
+
+        if self.path.endswith("/embeddings"):
+            inputs = body.get("input", [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            payload = {
+                "object": "list",
+                "data": [
+                    {
+                        "object": "embedding",
+                        "index": i,
+                        "embedding": STUB_VECTOR,
+                    }
+                    for i in range(len(inputs))
+                ],
+                "model": body.get("model", "text-embedding-ada-002"),
+                "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)},
+            }
+        else:
+            self.send_error(404)
+            return
+
+        raw = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(handler: type, delay: float = 0.0) -> ThreadingHTTPServer:
+    """
+    Start a stub server on a free localhost port in a daemon thread.
+    """
+    handler_cls = type(handler.__name__, (handler,), {"delay": delay})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler_cls)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stub_url(server: ThreadingHTTPServer, path: str = "") -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}{path}"
+
+
+def report(name: str, latencies: List[float], wall: float) -> None:
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1] if latencies else 0.0
+    print(
+        f"{name:<28} n={len(latencies):<5} "
+        f"mean={statistics.mean(latencies) * 1000:8.2f}ms "
+        f"p95={p95 * 1000:8.2f}ms "
+        f"wall={wall:6.2f}s"
+    )
+
+
+async def timed_calls(
+    call: Callable, requests: int, concurrency: int
+) -> tuple[List[float], float]:
+    """
+    Run `call()` `requests` times with at most `concurrency` in flight.
+    Returns per-call latencies and the wall time.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - start)
+
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return latencies, time.perf_counter() - wall_start
+
+
+class SlowFakeIndex:
+    """
+    Stand-in for a Pinecone index whose synchronous query() takes `delay` seconds.
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def query(self, vector, top_k, **kwargs):
+        time.sleep(self.delay)
+        return {"matches": [{"id": f"doc{i}", "score": 0.9} for i in range(top_k)]}
+
+
+class CountingStore:
+    """
+    Vector store stand-in that counts upserts and sleeps `delay` per call,
+    like a network round-trip to Pinecone.
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.calls = 0
+        self.vectors = 0
+
+    def upsert(self, records):
+        time.sleep(self.delay)
+        self.calls += 1
+        self.vectors += len(records)
+
+    def delete(self, ids):
+        time.sleep(self.delay)
+
+    def close(self):
+        pass
+
+
+class QuotaUpstream:
+    """
+    Simulated API that enforces a requests/tokens quota over a sliding window
+    and answers 429 with Retry-After (rounded up to whole seconds, as OpenAI does)
+    once either is exceeded. Successful calls return x-ratelimit-* headers.
+    """
+
+    class TooManyRequests(Exception):
+        def __init__(self, headers: dict):
+            self.headers = headers
+
+    def __init__(self, requests: int, tokens: int, window: float, latency: float):
+        self.requests = requests
+        self.tokens = tokens
+        self.window = window
+        self.latency = latency
+        self.events = collections.deque()  # (timestamp, tokens)
+        self.completed = 0
+        self.rejected = 0
+
+    async def call(self, tokens: int) -> dict:
+        now = time.monotonic()
+        while self.events and self.events[0][0] <= now - self.window:
+            self.events.popleft()
+        used_tokens = sum(t for _, t in self.events)
+        if len(self.events) + 1 > self.requests or used_tokens + tokens > self.tokens:
+            self.rejected += 1
+            retry = self.events[0][0] + self.window - now if self.events else 1
+            raise self.TooManyRequests({"Retry-After": str(math.ceil(retry))})
+        self.events.append((now, tokens))
+        await asyncio.sleep(self.latency)
+        self.completed += 1
+        return {
+            "x-ratelimit-limit-requests": str(self.requests),
+            "x-ratelimit-remaining-requests": str(self.requests - len(self.events)),
+            "x-ratelimit-limit-tokens": str(self.tokens),
+            "x-ratelimit-remaining-tokens": str(
+                self.tokens - used_tokens - tokens
+            ),
+        }
+
+
+async def loop_lag(stop: asyncio.Event, interval: float = 0.01) -> float:
+    """
+    Tick every `interval` seconds until `stop` is set; return the worst overshoot,
+    i.e. the longest time the event loop was blocked.
+    """
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+#####################
+# Benchmarks
+#####################
+async def bench_openai_client(args) -> None:
+    """
+    Per-call AsyncOpenAI construction (the old behaviour) vs the shared pooled client.
+    """
+    from openai import AsyncOpenAI
+
+    from server.openaiclient import build_openai_client
+
+    server = start_stub_server(StubOpenAIHandler, delay=args.delay)
+    base_url = stub_url(server, "/v1")
+
+    async def per_call_client():
+        client = AsyncOpenAI(api_key="sk-bench", base_url=base_url)
+        await client.embeddings.create(model="text-embedding-ada-002", input=["q"])
+        await client.close()
+
+    shared = build_openai_client(api_key="sk-bench", base_url=base_url)
+
+    async def shared_client():
+        await shared.embeddings.create(model="text-embedding-ada-002", input=["q"])
+
+    # Warm both paths once so import/first-connect costs don't skew results
+    await per_call_client()
+    await shared_client()
+
+    for name, call in (
+        ("per-call AsyncOpenAI", per_call_client),
+        ("shared pooled client", shared_client),
+    ):
+        latencies, wall = await timed_calls(call, args.requests, args.concurrency)
+        report(name, latencies, wall)
+
+    await shared.close()
+    server.shutdown()
+
+
+async def bench_pinecone_concurrency(args) -> None:
+    """
+    Concurrent queries against a slow fake index: calling query() inline from
+    async code (the old behaviour) vs PineconeStore's bounded executor.
+    """
+    from server.vectorstore import PineconeStore
+
+    fake_index = SlowFakeIndex(args.delay)
+    store = PineconeStore(
+        fake_index, max_workers=args.workers, max_concurrency=args.workers
+    )
+    vector = [0.0] * EMBEDDING_DIM
+
+    async def inline_query():
+        fake_index.query(vector=vector, top_k=3)
+
+    async def store_query():
+        await store.query(vector, 3)
+
+    for name, call in (
+        ("inline index.query", inline_query),
+        ("PineconeStore executor", store_query),
+    ):
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(loop_lag(stop))
+        latencies, wall = await timed_calls(call, args.requests, args.requests)
+        stop.set()
+        report(name, latencies, wall)
+        print(f"{'':<28} worst event-loop stall={await lag_task * 1000:8.2f}ms")
+
+    store.close()
+
+
+async def bench_vector_query(args) -> None:
+    """
+    LocalStore (in-process, memory-mapped) vs the Pinecone path. Uses the real
+    Pinecone index when --pinecone-index is given (needs PINECONE_API_KEY),
+    otherwise a fake index with --simulated-rtt of network latency.
+    """
+    import tempfile
+
+    import numpy as np
+
+    from server.vectorstore import LocalStore, PineconeStore
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = LocalStore(tmp)
+        vectors = rng.standard_normal((args.docs, EMBEDDING_DIM), dtype=np.float32)
+        store.upsert(
+            [(f"doc{i}", vectors[i], {"text": f"chunk {i}"}) for i in range(args.docs)]
+        )
+        store.save()
+        store = LocalStore(tmp)  # reopen memory-mapped, as the server would
+
+        queries = rng.standard_normal((args.requests, EMBEDDING_DIM), dtype=np.float32)
+        query_iter = iter(queries.tolist())
+
+        async def local_query():
+            await store.query(next(query_iter), args.top_k)
+
+        latencies, wall = await timed_calls(local_query, args.requests, 1)
+        report(f"local ({args.docs} docs)", latencies, wall)
+
+        start = time.perf_counter()
+        store.search_batch(queries, args.top_k)
+        batch_wall = time.perf_counter() - start
+        print(
+            f"{'local batched':<28} n={args.requests:<5} "
+            f"per-query={batch_wall / args.requests * 1000:8.3f}ms"
+        )
+
+    if args.pinecone_index:
+        from pinecone import Pinecone
+
+        pc = Pinecone(api_key=os.environ["PINECONE_API_KEY"])
+        remote = PineconeStore(pc.Index(args.pinecone_index))
+        name = f"pinecone ({args.pinecone_index})"
+    else:
+        remote = PineconeStore(SlowFakeIndex(args.simulated_rtt))
+        name = f"pinecone (simulated {args.simulated_rtt * 1000:.0f}ms)"
+
+    vector = queries[0].tolist()
+
+    async def remote_query():
+        await remote.query(vector, args.top_k)
+
+    latencies, wall = await timed_calls(remote_query, args.requests, 1)
+    report(name, latencies, wall)
+    remote.close()
+
+
+async def bench_ingest(args) -> None:
+    """
+    One embedding request + one upsert per chunk (the old ingestion loop) vs
+    batched, concurrent embedding with bulk upserts, against stub services.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from tqdm import tqdm
+
+    server = start_stub_server(StubOpenAIHandler, delay=args.delay)
+    os.environ["OPENAI_BASE_URL"] = stub_url(server, "/v1")
+    from server import pdfs_to_pinecone as ingest
+
+    chunks = [
+        (f"doc_c{i}", f"chunk {i} " + "building code text " * 100, {"chunk_index": i})
+        for i in range(args.chunks)
+    ]
+    budget = ingest.RequestBudget(args.requests_per_minute, burst=args.concurrency)
+
+    store = CountingStore(args.upsert_delay)
+    start = time.perf_counter()
+    for doc_id, text, metadata in chunks:
+        embedding = ingest.create_embeddings([text], budget)[0]
+        store.upsert([(doc_id, embedding, metadata)])
+    wall = time.perf_counter() - start
+    print(
+        f"{'one-at-a-time':<28} chunks={args.chunks:<5} upserts={store.calls:<5} "
+        f"wall={wall:6.2f}s ({args.chunks / wall:8.1f} chunks/sec)"
+    )
+
+    store = CountingStore(args.upsert_delay)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor, tqdm(
+        disable=True
+    ) as progress:
+        ingest.embed_and_upsert(
+            chunks,
+            store,
+            executor,
+            budget,
+            progress,
+            embed_batch_size=args.batch_size,
+        )
+    wall = time.perf_counter() - start
+    print(
+        f"{'batched + concurrent':<28} chunks={args.chunks:<5} upserts={store.calls:<5} "
+        f"wall={wall:6.2f}s ({args.chunks / wall:8.1f} chunks/sec)"
+    )
+    server.shutdown()
+
+
+async def bench_chunker(args) -> None:
+    """
+    Word-count chunking per page (the old chunk_text) vs the token-aware,
+    section-aware chunker, on the PDFs in source_docs. Extraction is done once
+    up front so only chunking is timed.
+    """
+    import glob
+
+    from server.chunker import Chunker, get_tokenizer
+    from server.pdfs_to_pinecone import count_pages, extract_page_range
+
+    paths = sorted(glob.glob(os.path.join(args.folder, "*.pdf")))
+    if not paths:
+        print(f"No PDFs found in {args.folder}")
+        return
+    documents = []
+    for path in paths:
+        pages = extract_page_range(path, 1, count_pages(path) + 1)
+        if args.max_pages:
+            pages = pages[: args.max_pages]
+        documents.append(pages)
+    total_pages = sum(len(pages) for pages in documents)
+    tokenizer = get_tokenizer()
+    print(
+        f"{len(paths)} files, {total_pages} pages, "
+        f"tokenizer={'tiktoken' if tokenizer.exact else 'approximate'}"
+    )
+
+    def words_per_page(pages):
+        for _, text in pages:
+            words = (text or "").split()
+            for start in range(0, len(words), 600 - 50):
+                yield " ".join(words[start : start + 600])
+
+    def token_chunks(pages):
+        chunker = Chunker(args.max_tokens, args.overlap_tokens, args.min_tokens)
+        for chunk in chunker.chunk_pages(pages):
+            yield chunk.text
+
+    for name, chunk_fn in (
+        ("word-count per page", words_per_page),
+        ("token + section aware", token_chunks),
+    ):
+        start = time.perf_counter()
+        texts = [t for pages in documents for t in chunk_fn(pages)]
+        wall = time.perf_counter() - start
+        sizes = [tokenizer.count(t) for t in texts]
+        print(
+            f"{name:<28} chunks={len(texts):<6} "
+            f"pages/sec={total_pages / wall:8.1f} "
+            f"tokens mean={statistics.mean(sizes):6.1f} "
+            f"stdev={statistics.pstdev(sizes):6.1f} max={max(sizes)}"
+        )
+
+
+async def bench_ratelimiter(args) -> None:
+    """
+    Reactive (sleep after a 429) vs proactive token-bucket pacing against a
+    simulated quota. The quota window is shortened from a minute so the run is
+    quick; both limiters see the same window.
+    """
+    from server.ratelimiter import RateLimiter
+
+    logging.getLogger("server.ratelimiter").setLevel(logging.CRITICAL)
+    rng = random.Random(0)
+    costs = [rng.randint(200, 1500) for _ in range(10000)]
+    quota_rate = min(args.rpm, args.tpm / statistics.mean(costs)) / args.window
+
+    for mode in ("reactive", "proactive"):
+        upstream = QuotaUpstream(args.rpm, args.tpm, args.window, args.latency)
+        limiter = RateLimiter(
+            limits={"openai_requests": args.rpm, "openai_tokens": args.tpm},
+            window=args.window,
+        )
+        deadline = time.monotonic() + args.duration
+        cost_iter = itertools.cycle(costs)
+
+        async def worker():
+            while time.monotonic() < deadline:
+                tokens = next(cost_iter)
+                if mode == "proactive":
+                    await limiter.acquire(
+                        {"openai_requests": 1, "openai_tokens": tokens}
+                    )
+                else:
+                    wait = await limiter.get_limit("openai_requests")
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                try:
+                    headers = await upstream.call(tokens)
+                    limiter.update_from_headers(headers)
+                except QuotaUpstream.TooManyRequests as e:
+                    response = type("Response", (), {"headers": e.headers})()
+                    await limiter.limit("openai_requests", response)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        wall = time.perf_counter() - start
+        print(
+            f"{mode:<12} completed={upstream.completed:<6} 429s={upstream.rejected:<6} "
+            f"throughput={upstream.completed / wall:7.1f}/s "
+            f"({upstream.completed / wall / quota_rate:5.1%} of quota)"
+        )
+
+
+async def bench_admission(args) -> None:
+    """
+    Open-loop overload (arrivals faster than the upstream can serve) with and
+    without an admission gate in front. Without one, the upstream queue grows
+    until requests hit the client timeout; with one, the excess is rejected
+    quickly and admitted requests keep a stable latency.
+    """
+    from server.admission import Gate, Overloaded
+
+    for mode in ("unbounded", "admission"):
+        upstream = asyncio.Semaphore(args.capacity)
+        gate = Gate("api", args.capacity, args.queue, args.max_wait)
+        latencies, rejected, timed_out = [], [], 0
+
+        async def request():
+            nonlocal timed_out
+            start = time.perf_counter()
+            try:
+                if mode == "admission":
+                    async with gate.slot():
+                        async with upstream:
+                            await asyncio.sleep(args.service_time)
+                else:
+                    async def call():
+                        async with upstream:
+                            await asyncio.sleep(args.service_time)
+
+                    await asyncio.wait_for(call(), timeout=args.timeout)
+                latencies.append(time.perf_counter() - start)
+            except Overloaded:
+                rejected.append(time.perf_counter() - start)
+            except asyncio.TimeoutError:
+                timed_out += 1
+
+        tasks = []
+        interval = 1.0 / args.rate
+        for _ in range(int(args.rate * args.duration)):
+            tasks.append(asyncio.create_task(request()))
+            await asyncio.sleep(interval)
+        await asyncio.gather(*tasks)
+
+        ok = sorted(latencies)
+        p95 = ok[int(0.95 * (len(ok) - 1))] * 1000 if ok else 0.0
+        fast_fail = statistics.mean(rejected) * 1000 if rejected else 0.0
+        print(
+            f"{mode:<12} ok={len(ok):<5} timed_out={timed_out:<5} "
+            f"rejected={len(rejected):<5} p95={p95:8.1f}ms "
+            f"reject_latency={fast_fail:6.1f}ms"
+        )
+
+
+async def bench_client_limits(args) -> None:
+    """
+    Cost of one per-client limit check on the request path, in-process and with
+    the shared SQLite store enabled (its sync runs separately and is timed apart).
+    """
+    import tempfile
+
+    from server.clientlimits import ClientLimiter
+
+    clients = [f"ip:10.0.{i // 256}.{i % 256}" for i in range(args.clients)]
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, store_path in (
+            ("in-process", None),
+            ("sqlite-shared", os.path.join(tmp, "limits.db")),
+        ):
+            limiter = ClientLimiter({"api": (10**9, 60.0)}, store_path=store_path)
+            start = time.perf_counter()
+            for i in range(args.checks):
+                limiter.hit("api", clients[i % len(clients)])
+            per_check = (time.perf_counter() - start) / args.checks * 1e6
+            line = f"{name:<16} clients={args.clients:<6} per-check={per_check:6.2f}us"
+            if store_path:
+                start = time.perf_counter()
+                limiter.sync()
+                line += f" sync={(time.perf_counter() - start) * 1000:7.2f}ms"
+            print(line)
+            limiter.close()
+
+
+async def bench_hedge(args) -> None:
+    """
+    Embedding-like calls with a slow tail (a fraction of calls take much longer),
+    sent plainly and through a Hedger. Hedging re-sends calls that pass the recent
+    p95, so tail latency drops at the cost of a few duplicate calls.
+    """
+    from server.retrypolicy import Hedger
+
+    rng = random.Random(args.seed)
+    for mode in ("plain", "hedged"):
+        hedger = Hedger("bench")
+        sent = 0
+
+        async def call():
+            nonlocal sent
+            sent += 1
+            slow = rng.random() < args.slow_fraction
+            await asyncio.sleep(args.slow_latency if slow else args.latency)
+
+        async def request():
+            if mode == "hedged":
+                await hedger.run(call)
+            else:
+                await call()
+
+        latencies, wall = await timed_calls(request, args.requests, args.concurrency)
+        ordered = sorted(latencies)
+        p50, p99 = (ordered[int(q * (len(ordered) - 1))] * 1000 for q in (0.5, 0.99))
+        report(mode, latencies, wall)
+        print(
+            f"{'':<28} p50={p50:7.1f}ms p99={p99:7.1f}ms "
+            f"upstream_calls={sent} hedged={hedger.hedged} wins={hedger.hedge_wins}"
+        )
+
+
+async def bench_retrieval_cache(args) -> None:
+    """
+    Hit ratio and lookup cost of the LSH retrieval cache. Each base question is
+    stored once; paraphrases are the base vector plus noise (cosine around
+    --paraphrase-similarity) and should hit, unrelated vectors should not.
+    """
+    import numpy as np
+
+    from server.retrievalcache import RetrievalCache
+
+    rng = np.random.default_rng(args.seed)
+    cache = RetrievalCache(
+        max_entries=args.entries,
+        min_similarity=args.min_similarity,
+        num_tables=args.tables,
+        bits_per_table=args.bits,
+    )
+    bases = rng.standard_normal((args.entries, args.dim)).astype(np.float32)
+    bases /= np.linalg.norm(bases, axis=1, keepdims=True)
+    for i, v in enumerate(bases):
+        cache.put(v, 3, 0.5, [{"id": str(i)}], f"[{i}]")
+
+    # noise scaled so cos(base, base + noise) ~= target
+    target = args.paraphrase_similarity
+    scale = math.sqrt(1.0 / target**2 - 1.0)
+    picks = rng.integers(0, args.entries, args.lookups)
+    noise = rng.standard_normal((args.lookups, args.dim)).astype(np.float32)
+    noise *= scale / np.linalg.norm(noise, axis=1, keepdims=True)
+    paraphrases = bases[picks] + noise
+    unrelated = rng.standard_normal((args.lookups, args.dim)).astype(np.float32)
+
+    for name, queries in (("paraphrase", paraphrases), ("unrelated", unrelated)):
+        hits = correct = 0
+        start = time.perf_counter()
+        for i, q in enumerate(queries):
+            result = cache.get(q, 3, 0.5)
+            if result is not None:
+                hits += 1
+                correct += result.references[0]["id"] == str(picks[i])
+        per_lookup = (time.perf_counter() - start) / len(queries) * 1e6
+        print(
+            f"{name:<12} entries={args.entries:<6} hit_ratio={hits / len(queries):6.1%} "
+            f"correct={correct:<6} per-lookup={per_lookup:7.1f}us"
+        )
+
+
+async def bench_bm25(args) -> None:
+    """
+    Build the BM25 index from chunks of the PDFs in source_docs (chunked the way
+    ingestion does), then time queries for exact code terms, plus fusion with
+    a vector-style ranking.
+    """
+    import glob
+
+    from server.lexicalindex import BM25Index, reciprocal_rank_fusion
+    from server.pdfs_to_pinecone import count_pages, extract_page_range, iter_chunks
+
+    paths = sorted(glob.glob(os.path.join(args.folder, "*.pdf")))
+    if not paths:
+        print(f"No PDFs found in {args.folder}")
+        return
+    chunks = []
+    for path in paths:
+        pages = extract_page_range(path, 1, count_pages(path) + 1)
+        if args.max_pages:
+            pages = pages[: args.max_pages]
+        chunks.extend(iter_chunks(os.path.basename(path), pages))
+    # Copies stand in for a bigger corpus
+    chunks = [
+        (f"{doc_id}#{copy}", text, metadata)
+        for copy in range(args.replicate)
+        for doc_id, text, metadata in chunks
+    ]
+
+    start = time.perf_counter()
+    index = BM25Index(
+        [doc_id for doc_id, _, _ in chunks],
+        (text for _, text, _ in chunks),
+        [metadata for _, _, metadata in chunks],
+    )
+    build = time.perf_counter() - start
+    print(
+        f"chunks={len(index)} terms={len(index.vocab)} postings={len(index.docs)} "
+        f"build={build * 1000:.1f}ms"
+    )
+
+    queries = args.queries or [
+        "R602.10 wall bracing",
+        "U-factor for fenestration",
+        "R402.1.2 insulation R-value table",
+        "minimum ceiling height for habitable rooms",
+        "solar water heater requirement",
+    ]
+    # Stand-in vector ranking, so fusion is timed on realistic list sizes
+    vector_ranking = [
+        {"id": doc_id, "score": 0.8, "metadata": metadata}
+        for doc_id, _, metadata in chunks[: args.top_k]
+    ]
+    for query in queries:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            matches = index.search(query, args.top_k)
+        search_us = (time.perf_counter() - start) / args.repeat * 1e6
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            reciprocal_rank_fusion([vector_ranking, matches])
+        fuse_us = (time.perf_counter() - start) / args.repeat * 1e6
+        top = matches[0]["metadata"]["section"] or matches[0]["id"] if matches else "-"
+        print(
+            f"{query[:36]:<38} search={search_us:7.1f}us fuse={fuse_us:6.1f}us "
+            f"top={top}"
+        )
+
+
+async def bench_rerank(args) -> None:
+    """
+    Rerank cost per request: BM25 candidates from source_docs chunks go through
+    the feature scorer, and through an ONNX cross-encoder if --model-path is
+    given, as one batch per query.
+    """
+    import glob
+
+    from server.lexicalindex import BM25Index
+    from server.pdfs_to_pinecone import count_pages, extract_page_range, iter_chunks
+    from server.reranker import OnnxCrossEncoder, Reranker
+
+    chunks = []
+    for path in sorted(glob.glob(os.path.join(args.folder, "*.pdf"))):
+        pages = extract_page_range(path, 1, count_pages(path) + 1)
+        chunks.extend(iter_chunks(os.path.basename(path), pages))
+    if not chunks:
+        print(f"No PDFs found in {args.folder}")
+        return
+    index = BM25Index(
+        [doc_id for doc_id, _, _ in chunks],
+        (text for _, text, _ in chunks),
+        [metadata for _, _, metadata in chunks],
+    )
+    queries = [
+        "R402.1.2 insulation R-value table",
+        "U-factor for fenestration",
+        "solar water heater requirement",
+        "duct sealing and testing",
+    ]
+
+    scorers = [("features", None)]
+    if args.model_path:
+        scorers.append(("onnx", OnnxCrossEncoder(args.model_path)))
+    for name, model in scorers:
+        reranker = Reranker(model, budget_ms=args.budget_ms)
+        latencies = []
+        kept = 0
+        for _ in range(args.repeat):
+            for query in queries:
+                candidates = index.search(query, args.candidates)
+                start = time.perf_counter()
+                kept += len(await reranker.rerank(query, candidates, args.top_n))
+                latencies.append(time.perf_counter() - start)
+        report(f"rerank {name} ({args.candidates} cands)", latencies, sum(latencies))
+        print(
+            f"{'':<28} kept/request={kept / len(latencies):.2f} "
+            f"fallbacks={reranker.fallbacks}"
+        )
+        reranker.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark server hot paths.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    p = subparsers.add_parser(
+        "openai-client", help="Per-call vs shared pooled AsyncOpenAI client."
+    )
+    p.add_argument("--requests", type=int, default=200)
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--delay", type=float, default=0.0, help="Stub latency (s).")
+    p.set_defaults(func=bench_openai_client)
+
+    p = subparsers.add_parser(
+        "pinecone-concurrency",
+        help="Concurrent queries against a slow fake index, inline vs executor.",
+    )
+    p.add_argument("--requests", type=int, default=32)
+    p.add_argument("--workers", type=int, default=8)
+    p.add_argument("--delay", type=float, default=0.1, help="Fake query latency (s).")
+    p.set_defaults(func=bench_pinecone_concurrency)
+
+    p = subparsers.add_parser(
+        "vector-query", help="Local in-process index vs Pinecone query latency."
+    )
+    p.add_argument("--docs", type=int, default=5000)
+    p.add_argument("--requests", type=int, default=200)
+    p.add_argument("--top-k", type=int, default=3)
+    p.add_argument("--pinecone-index", type=str, default="")
+    p.add_argument("--simulated-rtt", type=float, default=0.05)
+    p.set_defaults(func=bench_vector_query)
+
+    p = subparsers.add_parser(
+        "ingest", help="Per-chunk vs batched/concurrent embedding and upserts."
+    )
+    p.add_argument("--chunks", type=int, default=300)
+    p.add_argument("--batch-size", type=int, default=64)
+    p.add_argument("--concurrency", type=int, default=4)
+    p.add_argument("--requests-per-minute", type=int, default=100000)
+    p.add_argument("--delay", type=float, default=0.02, help="Stub embed latency (s).")
+    p.add_argument("--upsert-delay", type=float, default=0.02)
+    p.set_defaults(func=bench_ingest)
+
+    p = subparsers.add_parser(
+        "chunker", help="Word-count vs token/section-aware chunking on source_docs."
+    )
+    p.add_argument("--folder", type=str, default="server/source_docs")
+    p.add_argument("--max-pages", type=int, default=0, help="Per file, 0 = all.")
+    p.add_argument("--max-tokens", type=int, default=400)
+    p.add_argument("--overlap-tokens", type=int, default=60)
+    p.add_argument("--min-tokens", type=int, default=100)
+    p.set_defaults(func=bench_chunker)
+
+    p = subparsers.add_parser(
+        "ratelimiter", help="Reactive 429 handling vs proactive token buckets."
+    )
+    p.add_argument("--rpm", type=int, default=100, help="Requests per window.")
+    p.add_argument("--tpm", type=int, default=60000, help="Tokens per window.")
+    p.add_argument("--window", type=float, default=2.0, help="Quota window (s).")
+    p.add_argument("--duration", type=float, default=10.0)
+    p.add_argument("--concurrency", type=int, default=16)
+    p.add_argument("--latency", type=float, default=0.05, help="Upstream latency (s).")
+    p.set_defaults(func=bench_ratelimiter)
+
+    p = subparsers.add_parser(
+        "admission", help="Overload with and without admission control."
+    )
+    p.add_argument("--rate", type=float, default=200, help="Arrivals per second.")
+    p.add_argument("--duration", type=float, default=5.0)
+    p.add_argument("--capacity", type=int, default=8, help="Upstream concurrency.")
+    p.add_argument("--service-time", type=float, default=0.08)
+    p.add_argument("--timeout", type=float, default=2.0, help="Client timeout (s).")
+    p.add_argument("--queue", type=int, default=16)
+    p.add_argument("--max-wait", type=float, default=0.5)
+    p.set_defaults(func=bench_admission)
+
+    p = subparsers.add_parser(
+        "client-limits", help="Per-client sliding-window check cost."
+    )
+    p.add_argument("--clients", type=int, default=1000)
+    p.add_argument("--checks", type=int, default=200000)
+    p.set_defaults(func=bench_client_limits)
+
+    p = subparsers.add_parser(
+        "hedge", help="Slow-tail upstream with and without hedged requests."
+    )
+    p.add_argument("--requests", type=int, default=1000)
+    p.add_argument("--concurrency", type=int, default=16)
+    p.add_argument("--latency", type=float, default=0.02, help="Typical latency (s).")
+    p.add_argument("--slow-latency", type=float, default=0.3)
+    p.add_argument("--slow-fraction", type=float, default=0.05)
+    p.add_argument("--seed", type=int, default=1)
+    p.set_defaults(func=bench_hedge)
+
+    p = subparsers.add_parser(
+        "retrieval-cache", help="LSH retrieval cache hit ratio and lookup cost."
+    )
+    p.add_argument("--entries", type=int, default=2048)
+    p.add_argument("--lookups", type=int, default=2000)
+    p.add_argument("--dim", type=int, default=1536)
+    p.add_argument("--paraphrase-similarity", type=float, default=0.97)
+    p.add_argument("--min-similarity", type=float, default=0.95)
+    p.add_argument("--tables", type=int, default=8)
+    p.add_argument("--bits", type=int, default=12)
+    p.add_argument("--seed", type=int, default=1)
+    p.set_defaults(func=bench_retrieval_cache)
+
+    p = subparsers.add_parser(
+        "bm25", help="BM25 index build and query/fusion cost on source_docs."
+    )
+    p.add_argument("--folder", type=str, default="server/source_docs")
+    p.add_argument("--max-pages", type=int, default=0, help="Per file, 0 = all.")
+    p.add_argument("--top-k", type=int, default=10)
+    p.add_argument("--repeat", type=int, default=200)
+    p.add_argument("--replicate", type=int, default=1, help="Corpus copies.")
+    p.add_argument("queries", nargs="*", help="Queries (default: a built-in set).")
+    p.set_defaults(func=bench_bm25)
+
+    p = subparsers.add_parser("rerank", help="Per-request rerank cost on CPU.")
+    p.add_argument("--folder", type=str, default="server/source_docs")
+    p.add_argument("--candidates", type=int, default=10)
+    p.add_argument("--top-n", type=int, default=3)
+    p.add_argument("--budget-ms", type=float, default=50.0)
+    p.add_argument("--model-path", type=str, default="", help="ONNX model dir.")
+    p.add_argument("--repeat", type=int, default=100)
+    p.set_defaults(func=bench_rerank)
+
+    args = parser.parse_args()
+    asyncio.run(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
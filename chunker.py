@@ -0,0 +1,257 @@
+# chunker.py
+# Token-aware, structure-aware chunking of extracted building-code text.
+
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Bump when chunk boundaries or metadata change for the same input (2: stricter
+# heading detection), so ingestion re-chunks files whose PDFs didn't change.
+CHUNKER_VERSION = 2
+
+# A section id at the start of a line, optionally after SECTION and with a
+# trailing period: "R402.1.2", "N1102.1", "C402.4.1.1", "101.1", "16.26.010".
+# Numeric ids need a major number of two or more digits, so exception list
+# items ("1.1 Those with...") and decimals ("0.64; or", "1.071 X Federal
+# Minimum SEER") don't qualify.
+HEADING_RE = re.compile(
+    r"^\s*(?P<keyword>(?:SECTION|Section)\s+)?"
+    r"(?P<section>[A-Z]{1,2}\d{3,4}(?:\.\d+)*|[1-9]\d+(?:\.\d+){1,3})"
+    r"\.?(?=\s|$)(?P<rest>.*)$"
+)
+# The title runs up to the first period, comma, semicolon or colon
+_TITLE_END_RE = re.compile(r"[.,;:](?:\s|$)")
+_TITLE_WORD_RE = re.compile(r"[A-Z][A-Za-z]")
+HEADING_MAX_TITLE_WORDS = 10
+_CONTINUATION_WORDS = frozenset(
+    "a an and as at be by for in is of on or shall the to with".split()
+)
+# Cheap fallback tokenization when tiktoken isn't installed: words and punctuation.
+_APPROX_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def heading_section(line: str) -> Optional[str]:
+    """
+    The section id if `line` is shaped like a heading, else None: the id, then
+    a title starting with a capitalized word, at most HEADING_MAX_TITLE_WORDS
+    words up to its first period or comma ("R402.4.1.2 Testing. The building
+    ..."). A bare id only counts after SECTION ("SECTION R407").
+
+    References that start a wrapped line of running text are rejected: an id
+    followed by punctuation or a lowercase word ("R402.1.2, based on...",
+    "R401.3 of the Hawaii State Energy Code is amended"), and titles ending in
+    ; or : or a word like "and".
+    """
+    match = HEADING_RE.match(line)
+    if match is None:
+        return None
+    rest = match.group("rest").strip()
+    if not rest:
+        return match.group("section") if match.group("keyword") else None
+    if not _TITLE_WORD_RE.match(rest):
+        return None
+    end = _TITLE_END_RE.search(rest)
+    title = rest[: end.start()] if end else rest
+    words = title.split()
+    if len(words) > HEADING_MAX_TITLE_WORDS:
+        return None
+    if end and rest[end.start()] in ";:":
+        return None
+    if words[-1] in _CONTINUATION_WORDS:
+        return None
+    return match.group("section")
+
+
+#####################
+# Tokenizer
+#####################
+class Tokenizer:
+    """
+    Counts tokens with tiktoken (cl100k_base, the encoding used by
+    text-embedding-ada-002 and the GPT-4 family) when it is installed, and
+    falls back to a word/punctuation approximation otherwise (or always, with
+    `encoding_name=None`).
+    """
+
+    def __init__(self, encoding_name: Optional[str] = "cl100k_base"):
+        self._encoding = None
+        if encoding_name is None:
+            return
+        try:
+            import tiktoken
+
+            self._encoding = tiktoken.get_encoding(encoding_name)
+        except Exception as e:
+            logger.warning(
+                f"[Tokenizer] tiktoken unavailable ({e}), using approximate counts"
+            )
+
+    @property
+    def exact(self) -> bool:
+        return self._encoding is not None
+
+    def count(self, text: str) -> int:
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return len(_APPROX_TOKEN_RE.findall(text))
+
+    def split(self, text: str, max_tokens: int) -> List[str]:
+        """
+        Split text into pieces of at most `max_tokens` tokens.
+        """
+        if self._encoding is not None:
+            tokens = self._encoding.encode(text, disallowed_special=())
+            return [
+                self._encoding.decode(tokens[i : i + max_tokens])
+                for i in range(0, len(tokens), max_tokens)
+            ]
+        pieces, current, count = [], [], 0
+        for word in text.split():
+            n = len(_APPROX_TOKEN_RE.findall(word))
+            if current and count + n > max_tokens:
+                pieces.append(" ".join(current))
+                current, count = [], 0
+            current.append(word)
+            count += n
+        if current:
+            pieces.append(" ".join(current))
+        return pieces
+
+
+_tokenizer_instance: Optional[Tokenizer] = None
+
+
+def get_tokenizer() -> Tokenizer:
+    global _tokenizer_instance
+    if _tokenizer_instance is None:
+        _tokenizer_instance = Tokenizer()
+    return _tokenizer_instance
+
+
+#####################
+# Chunker
+#####################
+@dataclass
+class Line:
+    text: str
+    line_number: int  # 1-based across the whole document
+    page_number: int
+    tokens: int
+    section: Optional[str] = None  # set when the line starts a heading
+
+
+@dataclass
+class TextChunk:
+    text: str
+    start_line: int
+    end_line: int
+    page_number: int
+    end_page: int
+    section: Optional[str]
+    token_count: int
+    lines: List[Line] = field(default_factory=list, repr=False)
+
+
+class Chunker:
+    """
+    Packs document lines into chunks of at most `max_tokens` tokens.
+
+    Lines are numbered across the whole document, so chunks can span page breaks
+    and carry `start_line`/`end_line`. A code-section heading closes the current
+    chunk once it holds at least `min_tokens`, so sections aren't cut in half
+    when they fit. When a chunk has to be split mid-section, its last
+    `overlap_tokens` worth of lines are repeated at the start of the next one,
+    as far as the next line still fits within `max_tokens`.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 400,
+        overlap_tokens: int = 60,
+        min_tokens: int = 100,
+        tokenizer: Optional[Tokenizer] = None,
+    ):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.min_tokens = min_tokens
+        self.tokenizer = tokenizer or get_tokenizer()
+
+    def iter_lines(self, pages: Iterable[Tuple[int, str]]) -> Iterator[Line]:
+        line_number = 0
+        for page_number, text in pages:
+            for raw in (text or "").splitlines():
+                line_number += 1
+                stripped = raw.strip()
+                if not stripped:
+                    continue
+                section = heading_section(stripped)
+                tokens = self.tokenizer.count(stripped)
+                if tokens > self.max_tokens:
+                    # A single enormous line (tables flattened by extraction)
+                    for piece in self.tokenizer.split(stripped, self.max_tokens):
+                        yield Line(
+                            piece,
+                            line_number,
+                            page_number,
+                            self.tokenizer.count(piece),
+                            section,
+                        )
+                        section = None
+                    continue
+                yield Line(stripped, line_number, page_number, tokens, section)
+
+    def chunk_pages(self, pages: Iterable[Tuple[int, str]]) -> Iterator[TextChunk]:
+        """
+        Chunk a stream of (page_number, text) pages in order.
+        """
+        current: List[Line] = []
+        current_tokens = 0
+        section: Optional[str] = None
+
+        for line in self.iter_lines(pages):
+            if line.section and current_tokens >= self.min_tokens:
+                yield self._make_chunk(current, section)
+                current, current_tokens = [], 0
+
+            if current and current_tokens + line.tokens > self.max_tokens:
+                yield self._make_chunk(current, section)
+                current = self._overlap(current)
+                current_tokens = sum(l.tokens for l in current)
+                while current and current_tokens + line.tokens > self.max_tokens:
+                    current_tokens -= current.pop(0).tokens
+
+            if line.section:
+                section = line.section
+            current.append(line)
+            current_tokens += line.tokens
+
+        if current:
+            yield self._make_chunk(current, section)
+
+    def _overlap(self, lines: List[Line]) -> List[Line]:
+        carried: List[Line] = []
+        tokens = 0
+        for line in reversed(lines):
+            if tokens + line.tokens > self.overlap_tokens:
+                break
+            carried.insert(0, line)
+            tokens += line.tokens
+        return carried
+
+    def _make_chunk(self, lines: List[Line], section: Optional[str]) -> TextChunk:
+        # Name the chunk after the first heading inside it, else the open section
+        heading = next((l.section for l in lines if l.section), None)
+        text = "\n".join(l.text for l in lines)
+        return TextChunk(
+            text=text,
+            start_line=lines[0].line_number,
+            end_line=lines[-1].line_number,
+            page_number=lines[0].page_number,
+            end_page=lines[-1].page_number,
+            section=heading or section,
+            token_count=sum(l.tokens for l in lines),
+            lines=lines,
+        )
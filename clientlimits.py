@@ -0,0 +1,251 @@
+# clientlimits.py
+# Per-client request limits (by API key or IP) for the public routes.
+
+import hashlib
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from server.configmanager import config
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_RULES = {
+    # rule: (requests, window seconds)
+    "api": (30, 60.0),
+    "feedback": (20, 60.0),
+    "prefetch": (120, 60.0),
+}
+
+
+@dataclass
+class LimitResult:
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: int  # seconds, 0 when allowed
+
+
+class ClientLimiter:
+    """
+    Sliding-window request counters per (rule, client).
+
+    Each counter keeps the current and previous fixed window and estimates the
+    sliding count as previous * (unexpired fraction) + current, so a check is a
+    dict lookup and a little arithmetic. With `store_path`, counts are also
+    published to a SQLite file every `sync_interval` seconds and other workers'
+    counts are read back, so several uvicorn workers enforce one shared limit
+    (at most `sync_interval` behind). The sync runs off the request path.
+
+    Only the issued `api_keys` identify a client; any other X-API-Key is
+    ignored, so a client can't mint itself fresh buckets by rotating keys.
+    """
+
+    def __init__(
+        self,
+        rules: Optional[Dict[str, Tuple[int, float]]] = None,
+        store_path: Optional[str] = None,
+        sync_interval: float = 1.0,
+        api_keys: Iterable[str] = (),
+    ):
+        self.rules = dict(rules or _DEFAULT_RULES)
+        # Digests of the issued keys, so the keys themselves aren't kept around
+        self._api_keys: Set[str] = {_key_digest(k) for k in api_keys if k}
+        self.sync_interval = sync_interval
+        self.max_window = max(window for _, window in self.rules.values())
+
+        # key -> [window_start, count, previous_count]
+        self._windows: Dict[str, List[float]] = {}
+        # (key, window_start) -> count from other workers
+        self._remote: Dict[Tuple[str, float], int] = {}
+        self._dirty: Set[str] = set()
+        self._lock = threading.Lock()
+        self._last_sync = time.monotonic()
+        self._syncing = False
+
+        self.allowed = 0
+        self.rejected = 0
+
+        self._db: Optional[sqlite3.Connection] = None
+        self._worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        if store_path:
+            self._open_store(store_path)
+
+    def client_key(self, api_key: Optional[str], ip: Optional[str]) -> str:
+        """
+        Identify a client by API key when it is one of the issued keys (hashed,
+        so keys aren't kept in memory or on disk), else by IP.
+        """
+        if api_key:
+            digest = _key_digest(api_key)
+            if digest in self._api_keys:
+                return "key:" + digest[:16]
+        return f"ip:{ip or 'unknown'}"
+
+    def hit(self, rule: str, client: str, now: Optional[float] = None) -> LimitResult:
+        """
+        Count one request for `client` under `rule` unless that would exceed the limit.
+        """
+        limit, window = self.rules[rule]
+        if limit <= 0:
+            return LimitResult(True, 0, 0, 0)  # rule disabled
+        now = time.time() if now is None else now
+        start = math.floor(now / window) * window  # identical in every worker
+        key = f"{rule}|{client}"
+
+        with self._lock:
+            w = self._windows.get(key)
+            if w is None:
+                w = self._windows[key] = [start, 0, 0]
+            elif w[0] != start:
+                w[2] = w[1] if w[0] == start - window else 0
+                w[0], w[1] = start, 0
+
+            current = w[1] + self._remote.get((key, start), 0)
+            previous = w[2] + self._remote.get((key, start - window), 0)
+            elapsed = (now - start) / window
+            estimated = previous * (1.0 - elapsed) + current
+
+            if estimated + 1 > limit:
+                self.rejected += 1
+                if current + 1 > limit or not previous:
+                    retry_at = start + window
+                else:
+                    # when the previous window's weight has decayed enough
+                    headroom = (limit - 1 - current) / previous
+                    retry_at = start + window * (1.0 - headroom)
+                return LimitResult(False, limit, 0, max(1, math.ceil(retry_at - now)))
+
+            w[1] += 1
+            if self._db is not None:
+                self._dirty.add(key)
+            self.allowed += 1
+            remaining = int(limit - estimated - 1)
+        return LimitResult(True, limit, remaining, 0)
+
+    def sync_due(self) -> bool:
+        return (
+            not self._syncing
+            and time.monotonic() - self._last_sync >= self.sync_interval
+        )
+
+    def schedule_sync(self, loop) -> None:
+        """
+        Run sync() on the loop's default executor if it is due.
+        """
+        if self.sync_due():
+            self._syncing = True
+            loop.run_in_executor(None, self.sync)
+
+    def sync(self) -> None:
+        """
+        Drop expired counters and, with a store, exchange counts with other
+        workers. Safe to call from a worker thread.
+        """
+        self._syncing = True
+        try:
+            now = time.time()
+            horizon = now - 2 * self.max_window
+            with self._lock:
+                for key in [k for k, w in self._windows.items() if w[0] < horizon]:
+                    del self._windows[key]
+                dirty = [
+                    (key, self._windows[key][0], self._windows[key][1])
+                    for key in self._dirty
+                    if key in self._windows
+                ]
+                self._dirty.clear()
+            if self._db is not None:
+                self._exchange(dirty, horizon)
+        finally:
+            self._last_sync = time.monotonic()
+            self._syncing = False
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self._windows),
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "shared": self._db is not None,
+        }
+
+    def close(self) -> None:
+        if self._db is not None:
+            self.sync()
+            self._db.close()
+            self._db = None
+
+    #####################
+    # Shared SQLite store
+    #####################
+    def _open_store(self, path: str) -> None:
+        try:
+            db = sqlite3.connect(path, check_same_thread=False, timeout=1.0)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS client_counts ("
+                " key TEXT, window_start REAL, worker TEXT, count INTEGER,"
+                " PRIMARY KEY (key, window_start, worker))"
+            )
+            db.commit()
+            self._db = db
+            logger.info(f"[ClientLimiter] Sharing counts through {path}")
+        except sqlite3.Error as e:
+            logger.error(f"[ClientLimiter] Could not open store {path}: {e}")
+            self._db = None
+
+    def _exchange(self, dirty: List[Tuple[str, float, int]], horizon: float) -> None:
+        try:
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO client_counts"
+                    " (key, window_start, worker, count) VALUES (?, ?, ?, ?)",
+                    [(key, start, self._worker_id, n) for key, start, n in dirty],
+                )
+                self._db.execute(
+                    "DELETE FROM client_counts WHERE window_start < ?", (horizon,)
+                )
+            rows = self._db.execute(
+                "SELECT key, window_start, SUM(count) FROM client_counts"
+                " WHERE worker != ? GROUP BY key, window_start",
+                (self._worker_id,),
+            ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"[ClientLimiter] Store sync failed: {e}")
+            return
+        remote = {(key, start): int(count) for key, start, count in rows}
+        with self._lock:
+            self._remote = remote
+
+
+def _key_digest(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+_client_limiter_instance: Optional[ClientLimiter] = None
+
+
+def get_client_limiter() -> ClientLimiter:
+    global _client_limiter_instance
+    if _client_limiter_instance is None:
+        rules = {
+            rule: (
+                config.get(f"client_limit_{rule}_requests", requests),
+                config.get(f"client_limit_{rule}_window", window),
+            )
+            for rule, (requests, window) in _DEFAULT_RULES.items()
+        }
+        _client_limiter_instance = ClientLimiter(
+            rules,
+            store_path=config.get("client_limit_store_path") or None,
+            sync_interval=config.get("client_limit_sync_interval", 1.0),
+            api_keys=config.get("client_api_keys", []),
+        )
+    return _client_limiter_instance
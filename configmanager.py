@@ -1,7 +1,11 @@
+import asyncio
+import hashlib
 import json
 import logging
 import os
-from typing import Any, Dict, Optional
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
 from server.settings import Settings
 
 # from sqlalchemy.orm import Session
@@ -15,6 +19,15 @@ class ConfigManager:
     Manages configurations:
     - file-based config.json (persisted)
     - environment overrides (in-memory only)
+
+    The merged result is published as a frozen, versioned Settings snapshot.
+    Hot paths take snapshot() once (e.g. per request) and read its attributes;
+    every change builds a new snapshot and swaps it in with one assignment, so
+    readers never see a half-applied change.
+
+    watch() hot-reloads config.json when it changes on disk. A file that fails
+    to parse or validate is logged and ignored, and the current snapshot keeps
+    serving.
     """
 
     def __init__(
@@ -29,7 +42,13 @@ class ConfigManager:
         self._file_config = {}
         self._env_config = {}
         self.raw_config = {}
-        self.settings = Settings()
+        self._current: Tuple[int, Settings] = (0, Settings())
+        self._publish_lock = threading.Lock()
+        # Guards _file_config/_env_config/raw_config across set() and reloads
+        self._lock = threading.RLock()
+        self._file_signature: Tuple[int, int] = (0, 0)  # (mtime_ns, size) loaded
+        self.loaded_at: Optional[float] = None
+        self.last_error: Optional[str] = None
 
         self._load_json_config()
         # if environment == "development":
@@ -40,6 +59,7 @@ class ConfigManager:
 
     def _load_json_config(self) -> None:
         """Load config.json into _file_config only."""
+        self._file_signature = self._read_file_signature()
         try:
             with open(self.config_file_path, "r", encoding="utf-8") as f:
                 self._file_config = json.load(f)
@@ -76,16 +96,147 @@ class ConfigManager:
         If there's an error, log and fallback to defaults.
         """
         try:
-            self.settings = Settings(**self.raw_config)
+            settings = Settings(**self.raw_config)
         except Exception as e:
             logger.error(f"Failed to validate Settings: {e}")
-            self.settings = Settings()
+            settings = Settings()
+        self._publish(settings)
+
+    def _publish(self, settings: Settings) -> None:
+        # One tuple assignment, so version and settings always match
+        with self._publish_lock:
+            self._current = (self._current[0] + 1, settings)
+        self.loaded_at = time.time()
+
+    def _apply(self, key: str, value: Any) -> bool:
+        """
+        Publish the current snapshot with one key changed. An invalid value is
+        logged and both raw_config and the current snapshot are kept.
+        """
+        with self._lock:
+            try:
+                settings = Settings(**{**self.snapshot().model_dump(), key: value})
+            except Exception as e:
+                logger.error(f"Rejected config value for '{key}': {e}")
+                return False
+            self.raw_config = {**self.raw_config, key: value}
+            self._publish(settings)
+        return True
+
+    def snapshot(self) -> Settings:
+        """
+        The current settings (frozen). Take it once and read attributes from it
+        to get one consistent view across a request.
+        """
+        return self._current[1]
+
+    @property
+    def version(self) -> int:
+        """
+        Bumped every time a new snapshot is published.
+        """
+        return self._current[0]
+
+    @property
+    def settings(self) -> Settings:
+        return self._current[1]
+
+    #####################
+    # Hot reload
+    #####################
+    def _read_file_signature(self) -> Tuple[int, int]:
+        try:
+            st = os.stat(self.config_file_path)
+        except OSError:
+            return (0, 0)
+        return (st.st_mtime_ns, st.st_size)
+
+    def reload_if_changed(self) -> bool:
+        """
+        Re-read config.json if it changed since the last load and publish it
+        (plus environment overrides) as a new snapshot. Keys changed with a
+        non-persisted set() revert to the file's values. Blocking; run it off
+        the event loop.
+        """
+        signature = self._read_file_signature()
+        if signature == self._file_signature:
+            return False
+        # Remember it even if it's bad, so it's reported once, not every poll
+        self._file_signature = signature
+        try:
+            with open(self.config_file_path, "r", encoding="utf-8") as f:
+                file_config = json.load(f)
+            if not isinstance(file_config, dict):
+                raise ValueError("top level must be a JSON object")
+        except Exception as e:
+            self._reject_file(e)
+            return False
+
+        # Under the lock so a concurrent set_temp() is neither lost nor torn
+        with self._lock:
+            raw_config = {**file_config, **self._env_config}
+            try:
+                settings = Settings(**raw_config)
+            except Exception as e:
+                self._reject_file(e)
+                return False
+            previous = self.snapshot()
+            changed = [
+                key
+                for key in Settings.model_fields
+                if getattr(settings, key) != getattr(previous, key)
+            ]
+            self._file_config = file_config
+            self.raw_config = raw_config
+            self.last_error = None
+            self._publish(settings)
+        # Key names only: values may be secrets
+        logger.info(
+            f"Reloaded {self.config_file_path} as config version {self.version}; "
+            f"changed: {', '.join(changed) or 'nothing'}"
+        )
+        return True
+
+    def _reject_file(self, error: Exception) -> None:
+        self.last_error = f"{type(error).__name__}: {error}"
+        logger.error(
+            f"Ignoring invalid {self.config_file_path}, keeping config "
+            f"version {self.version}: {error}"
+        )
+
+    async def watch(self, interval: float) -> None:
+        """
+        Poll config.json every `interval` seconds (one stat call) until
+        cancelled; reading and validating a changed file runs in a thread.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.reload_if_changed)
+            except Exception as e:
+                logger.error(f"Config reload failed: {e}")
+
+    def status(self) -> dict:
+        """
+        Active config version, for comparing workers after an edit.
+        """
+        version, settings = self._current
+        return {
+            "version": version,
+            "settings_hash": hashlib.sha256(
+                settings.model_dump_json().encode()
+            ).hexdigest()[:12],
+            "path": self.config_file_path,
+            "file_mtime": self._file_signature[0] / 1e9 or None,
+            "loaded_at": self.loaded_at,
+            "last_error": self.last_error,
+        }
 
     def get(self, key: str, default=None) -> Optional[Any]:
         """
         Get from final merged config (Pydantic).
         """
-        return getattr(self.settings, key, default)
+        return getattr(self.snapshot(), key, default)
 
     def get_or_error(self, key: str) -> Any:
         data = self.get(key)
@@ -96,39 +247,42 @@ class ConfigManager:
     def set(self, key: str, value: Any, persist: bool = False) -> None:
         """
         Update a single key in _file_config (and raw_config), optionally writing to disk.
+        Only persisting touches the file; the new snapshot is built from the
+        current one.
         """
+        with self._lock:
+            self._file_config[key] = value
 
-        try:
-            with open(self.config_file_path, "r", encoding="utf-8") as f:
-                disk_data = json.load(f)
-        except FileNotFoundError:
-            disk_data = {}
-        except Exception as e:
-            logger.error(f"Error reading config file before set: {e}")
-            disk_data = {}
+            if persist:
+                try:
+                    with open(self.config_file_path, "r", encoding="utf-8") as f:
+                        disk_data = json.load(f)
+                except FileNotFoundError:
+                    disk_data = {}
+                except Exception as e:
+                    logger.error(f"Error reading config file before set: {e}")
+                    disk_data = {}
+                disk_data[key] = value
+                try:
+                    with open(self.config_file_path, "w") as f:
+                        json.dump(disk_data, f, indent=2, ensure_ascii=False)
+                    logger.info(f"Key '{key}' updated in config.json.")
+                except Exception as e:
+                    logger.error(
+                        f"Failed to save updated key '{key}' to config file: {e}"
+                    )
 
-        disk_data[key] = value
-        self._file_config[key] = value
-
-        if persist:
-            try:
-                with open(self.config_file_path, "w") as f:
-                    json.dump(disk_data, f, indent=2, ensure_ascii=False)
-                logger.info(f"Key '{key}' updated in config.json.")
-            except Exception as e:
-                logger.error(f"Failed to save updated key '{key}' to config file: {e}")
-
-        self._merge_file_and_env()
-        self._validate_settings()
+            if key not in self._env_config:  # env overrides still win
+                self._apply(key, value)
 
     def set_temp(self, key: str, value: Any) -> None:
         """
         Set a key-value pair in the in-memory-only config (_env_config).
         This change will not be written to disk.
         """
-        self._env_config[key] = value
-        self._merge_file_and_env()
-        self._validate_settings()
+        with self._lock:
+            if self._apply(key, value):
+                self._env_config[key] = value
 
 
 config = ConfigManager()
@@ -0,0 +1,347 @@
+# embeddingcache.py
+# Normalized-text embedding cache: in-process LRU + TTL, optional SQLite tier.
+
+import asyncio
+import hashlib
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from server.configmanager import config
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """
+    Collapse whitespace and case so trivially different phrasings of the
+    same question share a cache entry.
+    """
+    return " ".join(text.split()).casefold()
+
+
+class EmbeddingCache:
+    """
+    Maps (model, normalized text) to an embedding vector.
+
+    The memory tier is an LRU bounded by entry count and by bytes, with a TTL per
+    entry. Vectors are stored as float32 arrays, roughly a quarter of the size of a
+    list of Python floats. If `disk_path` is set, entries are also written to a
+    SQLite file so they survive restarts; memory misses fall through to it.
+
+    Disk writes are queued and committed in batches by a writer thread, which
+    also deletes rows older than `ttl` (at open and every `prune_interval`
+    seconds). The event loop uses aget()/amissing(), which read disk in a
+    worker thread; get()/missing() do the same reads inline, for scripts.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 7 * 24 * 3600,
+        disk_path: Optional[str] = None,
+        prune_interval: float = 3600.0,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.prune_interval = prune_interval
+
+        # key -> (expires_at, vector)
+        self._entries: "OrderedDict[str, Tuple[float, array]]" = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._writes: queue.Queue = queue.Queue(maxsize=10000)
+        self._writer: Optional[threading.Thread] = None
+        self.disk_write_drops = 0
+        self.disk_pruned = 0
+        if disk_path:
+            self._open_disk(disk_path)
+
+    #####################
+    # Public API
+    #####################
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        digest = hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{model}:{digest}"
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        return self._count(*self._lookup(self.make_key(model, text)))
+
+    async def aget(self, model: str, text: str) -> Optional[List[float]]:
+        """
+        get() for the event loop: a memory miss reads disk in a worker thread.
+        """
+        return self._count(*await self._alookup(self.make_key(model, text)))
+
+    def _count(
+        self, vector: Optional[array], tier: Optional[str]
+    ) -> Optional[List[float]]:
+        if tier == "memory":
+            self.hits += 1
+        elif tier == "disk":
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            return None
+        return vector.tolist()
+
+    def put(self, model: str, text: str, embedding: List[float]) -> None:
+        key = self.make_key(model, text)
+        vector = array("f", embedding)
+        now = time.time()
+        self._store(key, vector, now)
+        self._disk_put(key, model, vector, now)
+
+    def missing(self, model: str, texts: List[str]) -> List[str]:
+        """
+        Return the texts (deduplicated by normalized form) that have no live entry.
+        Used to pre-warm the cache without re-embedding what's already there.
+        """
+        return [
+            text
+            for key, text in self._unique_keys(model, texts)
+            if self._lookup(key)[0] is None
+        ]
+
+    async def amissing(self, model: str, texts: List[str]) -> List[str]:
+        return [
+            text
+            for key, text in self._unique_keys(model, texts)
+            if (await self._alookup(key))[0] is None
+        ]
+
+    def _unique_keys(self, model: str, texts: List[str]) -> List[Tuple[str, str]]:
+        seen = set()
+        result = []
+        for text in texts:
+            key = self.make_key(model, text)
+            if key not in seen:
+                seen.add(key)
+                result.append((key, text))
+        return result
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "disk_pending": self._writes.qsize(),
+            "disk_write_drops": self.disk_write_drops,
+            "disk_pruned": self.disk_pruned,
+            "hit_ratio": (
+                round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0
+            ),
+        }
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writes.put(None)  # flush what is queued, then stop
+            self._writer.join(timeout=5.0)
+            self._writer = None
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    #####################
+    # Memory tier
+    #####################
+    def _lookup(self, key: str) -> Tuple[Optional[array], Optional[str]]:
+        """
+        Find a live entry in memory, then on disk (promoting disk hits into memory).
+        Returns (vector, tier) or (None, None).
+        """
+        now = time.time()
+        vector = self._memory_get(key, now)
+        if vector is not None:
+            return vector, "memory"
+        vector = self._disk_get(key, now)
+        if vector is not None:
+            self._store(key, vector, now)
+            return vector, "disk"
+        return None, None
+
+    async def _alookup(self, key: str) -> Tuple[Optional[array], Optional[str]]:
+        now = time.time()
+        vector = self._memory_get(key, now)
+        if vector is not None:
+            return vector, "memory"
+        if self._db is None:
+            return None, None
+        vector = await asyncio.to_thread(self._disk_get, key, now)
+        if vector is not None:
+            self._store(key, vector, now)
+            return vector, "disk"
+        return None, None
+
+    def _memory_get(self, key: str, now: float) -> Optional[array]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, vector = entry
+        if expires_at > now:
+            self._entries.move_to_end(key)
+            return vector
+        self._remove(key)
+        return None
+
+    @staticmethod
+    def _entry_size(key: str, vector: array) -> int:
+        return len(vector) * vector.itemsize + len(key)
+
+    def _store(self, key: str, vector: array, now: float) -> None:
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (now + self.ttl, vector)
+        self._bytes += self._entry_size(key, vector)
+
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        _, vector = self._entries.pop(key)
+        self._bytes -= self._entry_size(key, vector)
+
+    #####################
+    # Disk tier
+    #####################
+    def _open_disk(self, path: str) -> None:
+        try:
+            db = sqlite3.connect(path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY, model TEXT, created REAL, vector BLOB)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_created ON embeddings (created)"
+            )
+            db.commit()
+            self._db = db
+            logger.info(f"[EmbeddingCache] Disk tier enabled at {path}")
+        except sqlite3.Error as e:
+            logger.error(f"[EmbeddingCache] Could not open disk tier {path}: {e}")
+            self._db = None
+            return
+        self._prune()
+        self._writer = threading.Thread(
+            target=self._write_loop, name="embedding-cache-writer", daemon=True
+        )
+        self._writer.start()
+
+    def _disk_get(self, key: str, now: float) -> Optional[array]:
+        if self._db is None:
+            return None
+        try:
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT created, vector FROM embeddings WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"[EmbeddingCache] Disk read failed: {e}")
+            return None
+        if row is None or row[0] + self.ttl <= now:
+            return None
+        vector = array("f")
+        vector.frombytes(row[1])
+        return vector
+
+    def _disk_put(self, key: str, model: str, vector: array, now: float) -> None:
+        if self._writer is None:
+            return
+        try:
+            self._writes.put_nowait((key, model, now, vector.tobytes()))
+        except queue.Full:
+            self.disk_write_drops += 1  # still cached in memory
+
+    def _write_loop(self) -> None:
+        """
+        Writer thread: commits queued rows in batches (one fsync per batch)
+        and prunes expired rows every `prune_interval` seconds.
+        """
+        next_prune = time.time() + self.prune_interval
+        stop = False
+        while not stop:
+            try:
+                batch = [self._writes.get(timeout=max(0.0, next_prune - time.time()))]
+            except queue.Empty:
+                batch = []
+            while len(batch) < 500:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            rows = [row for row in batch if row is not None]
+            if rows:
+                try:
+                    with self._db_lock:
+                        self._db.executemany(
+                            "INSERT OR REPLACE INTO embeddings"
+                            " (key, model, created, vector) VALUES (?, ?, ?, ?)",
+                            rows,
+                        )
+                        self._db.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"[EmbeddingCache] Disk write failed: {e}")
+            if time.time() >= next_prune:
+                self._prune()
+                next_prune = time.time() + self.prune_interval
+
+    def _prune(self) -> None:
+        try:
+            with self._db_lock:
+                deleted = self._db.execute(
+                    "DELETE FROM embeddings WHERE created <= ?",
+                    (time.time() - self.ttl,),
+                ).rowcount
+                self._db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"[EmbeddingCache] Disk prune failed: {e}")
+            return
+        if deleted:
+            self.disk_pruned += deleted
+            logger.info(f"[EmbeddingCache] Pruned {deleted} expired disk entries")
+
+
+_embedding_cache_instance = None
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _embedding_cache_instance
+    if _embedding_cache_instance is None:
+        _embedding_cache_instance = EmbeddingCache(
+            max_entries=config.get("embedding_cache_max_entries", 10000),
+            max_bytes=config.get("embedding_cache_max_mb", 64) * 1024 * 1024,
+            ttl=config.get("embedding_cache_ttl", 7 * 24 * 3600),
+            disk_path=config.get("embedding_cache_path") or None,
+        )
+    return _embedding_cache_instance
@@ -1,4 +1,7 @@
-import time
+import asyncio
+import json
+import uuid
+
 import gradio as gr
 import requests
 
@@ -6,7 +9,13 @@ import requests
 # CONFIGURATION
 # ------------------------------------------------------------------
 API_URL = "http://127.0.0.1:8000/api"  # FastAPI endpoint
+STREAM_URL = "http://127.0.0.1:8000/api/stream"  # Server-sent events variant
 FEEDBACK_URL = "http://127.0.0.1:8000/feedback"  # Optional feedback endpoint
+PREFETCH_URL = "http://127.0.0.1:8000/api/prefetch"  # Warm references while typing
+PREFETCH_DEBOUNCE = 0.4  # seconds of no typing before prefetching
+
+# session id -> latest draft text, for debouncing prefetch calls
+_latest_drafts = {}
 
 
 def clear_history():
@@ -181,6 +190,52 @@ async def query_api(conversation):
         return f"Error contacting API\nResponse: {response}\nError: {e}"
 
 
+def stream_api(conversation, session_id=None):
+    """
+    Posts the conversation to the streaming endpoint and yields (event, data)
+    pairs as server-sent events arrive.
+    """
+    with requests.post(
+        STREAM_URL,
+        json={"messages": conversation, "session_id": session_id},
+        stream=True,
+        timeout=120,
+    ) as response:
+        response.raise_for_status()
+        event = "message"
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:") :].strip()
+            elif line.startswith("data:"):
+                yield event, json.loads(line[len("data:") :].strip())
+            elif not line:
+                event = "message"
+
+
+async def prefetch_references(draft, session_id):
+    """
+    Runs on every keystroke. Each call records its text and waits; only the one
+    still holding the latest text after PREFETCH_DEBOUNCE asks the server to
+    prefetch references for it. Best effort: errors are ignored. A coroutine,
+    so Gradio awaits it on its event loop and a pending keystroke holds no
+    worker thread while it waits.
+    """
+    _latest_drafts[session_id] = draft
+    await asyncio.sleep(PREFETCH_DEBOUNCE)
+    if _latest_drafts.get(session_id) != draft:
+        return  # the user kept typing
+    _latest_drafts.pop(session_id, None)
+    try:
+        await asyncio.to_thread(
+            requests.post,
+            PREFETCH_URL,
+            json={"session_id": session_id, "text": draft},
+            timeout=2,
+        )
+    except Exception:
+        pass
+
+
 async def send_vote_feedback(vote_type, conversation_history):
     """
     Sends a simple 'thumbs up' or 'thumbs down' vote to the FastAPI /feedback endpoint.
@@ -208,17 +263,30 @@ async def user_submit(user_message, history):
     return "", new_history
 
 
-async def bot_reply(history):
+def bot_reply(history, session_id):
     """
-    Calls the server to get the assistant's response, appends it to conversation.
+    Streams the assistant's response from the server, updating the conversation
+    (and the chatbot) as each token arrives.
     """
-    import time
-
-    time.sleep(2)
     if not history or history[-1]["role"] != "user":
-        return history  # no new user message
-    bot_response = await query_api(history)
-    return history + [{"role": "assistant", "content": bot_response}]
+        yield history, history  # no new user message
+        return
+
+    answer = ""
+    new_history = history + [{"role": "assistant", "content": answer}]
+    try:
+        for event, data in stream_api(history, session_id):
+            if event == "token":
+                answer += data.get("text", "")
+                new_history[-1] = {"role": "assistant", "content": answer}
+                yield new_history, new_history
+            elif event == "error":
+                answer = data.get("message", "No response found.")
+    except Exception as e:
+        answer = answer or f"Error contacting API\nError: {e}"
+
+    new_history[-1] = {"role": "assistant", "content": answer or "No response found."}
+    yield new_history, new_history
 
 
 def delayed_hide_spinner(_):
@@ -247,6 +315,8 @@ with gr.Blocks(title="Maui Building Code Assistant", css=CUSTOM_CSS) as demo:
 
     # Conversation state
     conversation_history = gr.State([])
+    # Per-browser-session id, so the server can match prefetches to requests
+    session_id = gr.State(lambda: uuid.uuid4().hex)
 
     # Main chatbot
     chatbot = gr.Chatbot(
@@ -324,8 +394,8 @@ with gr.Blocks(title="Maui Building Code Assistant", css=CUSTOM_CSS) as demo:
         )
         .then(
             fn=bot_reply,
-            inputs=[conversation_history],
-            outputs=[conversation_history],
+            inputs=[conversation_history, session_id],
+            outputs=[conversation_history, chatbot],
             show_progress=True,
         )
         .then(
@@ -351,8 +421,8 @@ with gr.Blocks(title="Maui Building Code Assistant", css=CUSTOM_CSS) as demo:
         outputs=[chatbot],
     ).then(
         fn=bot_reply,
-        inputs=[conversation_history],
-        outputs=[conversation_history],
+        inputs=[conversation_history, session_id],
+        outputs=[conversation_history, chatbot],
         show_progress=True,
     ).then(
         fn=lambda h: h,
@@ -364,6 +434,16 @@ with gr.Blocks(title="Maui Building Code Assistant", css=CUSTOM_CSS) as demo:
         outputs=[spinner_html],
     )
 
+    # 3) While typing: prefetch references for the draft (debounced)
+    user_input.input(
+        fn=prefetch_references,
+        inputs=[user_input, session_id],
+        outputs=None,
+        trigger_mode="multiple",
+        show_progress="hidden",
+        queue=False,
+    )
+
     # Footer
     gr.Markdown(
         "#### Powered by Gradio + FastAPI + OpenAI + Pinecone", elem_id="footer_text"
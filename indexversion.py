@@ -0,0 +1,61 @@
+# indexversion.py
+# A tiny version marker that ingestion bumps after changing the vector index,
+# so the server can drop caches that were built against the old contents.
+
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_VERSION_PATH = "server/index_version.json"
+
+# path -> (mtime_ns, version); avoids re-reading the file on every request
+_version_cache: Dict[str, Tuple[int, str]] = {}
+
+
+def read_index_version(path: str = DEFAULT_INDEX_VERSION_PATH) -> str:
+    """
+    Returns the current index version, or "0" if ingestion has never written one.
+    Only a stat() per call unless the file actually changed.
+    """
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return "0"
+
+    cached = _version_cache.get(path)
+    if cached and cached[0] == mtime_ns:
+        return cached[1]
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            version = str(json.load(f).get("version", "0"))
+    except Exception as e:
+        logger.error(f"[indexversion] Failed to read {path}: {e}")
+        return cached[1] if cached else "0"
+
+    _version_cache[path] = (mtime_ns, version)
+    return version
+
+
+def bump_index_version(path: str = DEFAULT_INDEX_VERSION_PATH) -> str:
+    """
+    Write a new random version (atomically) and return it.
+    """
+    version = uuid.uuid4().hex[:12]
+    payload = {"version": version, "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2)
+    os.replace(tmp_path, path)
+
+    logger.info(f"[indexversion] Index version bumped to {version}")
+    return version
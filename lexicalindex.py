@@ -0,0 +1,367 @@
+# lexicalindex.py
+# In-memory BM25 index over the ingested chunks, for exact code terms
+# ("R602.10", "U-factor") that embeddings match poorly, and rank fusion of
+# its results with the vector matches.
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from array import array
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from server.configmanager import config
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.\-][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i if in is it my of on or "
+    "that the this to what when where which with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased terms. A dotted section number also yields its parents
+    ("r602.10.1" -> "r602.10", "r602") and a hyphenated word its parts, so a
+    query for a section finds its subsections.
+    """
+    terms = []
+    for token in TOKEN_RE.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        if "." in token:
+            parts = token.split(".")
+            terms.extend(".".join(parts[:n]) for n in range(len(parts) - 1, 0, -1))
+        if "-" in token:
+            terms.extend(p for p in token.split("-") if len(p) > 1)
+    return terms
+
+
+def exact_terms(text: str) -> str:
+    """
+    The query's terms that contain a digit (section numbers, R-values), as one
+    string. Two queries that differ here should not share cached results even
+    if their embeddings are nearly identical.
+    """
+    terms = {t for t in TOKEN_RE.findall(text.lower()) if any(c.isdigit() for c in t)}
+    return " ".join(sorted(terms))
+
+
+def reciprocal_rank_fusion(rankings: Sequence[List[dict]], k: int = 60) -> List[dict]:
+    """
+    Merge ranked match lists: a document scores sum(1 / (k + rank)) over the
+    lists it appears in. Scores are rescaled so 1.0 means first in every list,
+    which keeps them comparable with the similarity scores shown in the
+    reference block.
+    """
+    totals: Dict[str, float] = {}
+    matches: Dict[str, dict] = {}
+    for ranking in rankings:
+        for rank, match in enumerate(ranking, start=1):
+            totals[match["id"]] = totals.get(match["id"], 0.0) + 1.0 / (k + rank)
+            matches.setdefault(match["id"], match)
+    best = len(rankings) / (k + 1)
+    ordered = sorted(totals, key=totals.get, reverse=True)
+    return [dict(matches[i], score=totals[i] / best) for i in ordered]
+
+
+class BM25Index:
+    """
+    Okapi BM25 over a fixed set of documents.
+
+    Postings are stored CSR-style in flat arrays: for term t, the slice
+    offsets[t]:offsets[t + 1] of `docs` (int32) and `weights` (float32). Each
+    weight is the term's whole BM25 contribution to that document, computed at
+    build time, so a query adds one slice per query term into a dense score
+    array and takes the top k. For a few thousand chunks that is well under a
+    millisecond.
+    """
+
+    def __init__(
+        self,
+        ids: Sequence[str],
+        texts: Iterable[str],
+        metadata: Sequence[Dict[str, Any]],
+        k1: float = 1.2,
+        b: float = 0.75,
+    ):
+        self.ids = list(ids)
+        self.metadata = list(metadata)
+        self.vocab: Dict[str, int] = {}
+
+        term_col, doc_col, tf_col = array("i"), array("i"), array("f")
+        lengths = np.zeros(len(self.ids), dtype=np.float32)
+        for d, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths[d] = sum(counts.values())
+            for term, tf in counts.items():
+                term_col.append(self.vocab.setdefault(term, len(self.vocab)))
+                doc_col.append(d)
+                tf_col.append(tf)
+
+        terms = np.frombuffer(term_col, dtype=np.int32)
+        order = np.argsort(terms, kind="stable")
+        terms = terms[order]
+        tf = np.frombuffer(tf_col, dtype=np.float32)[order]
+        self.docs = np.frombuffer(doc_col, dtype=np.int32)[order]
+
+        df = np.bincount(terms, minlength=len(self.vocab))
+        self.offsets = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        np.cumsum(df, out=self.offsets[1:])
+
+        n = len(self.ids)
+        avgdl = float(lengths.mean()) if n else 1.0
+        idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        norm = k1 * (1.0 - b + b * lengths / (avgdl or 1.0))
+        weights = idf[terms] * tf * (k1 + 1.0) / (tf + norm[self.docs])
+        self.weights = weights.astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(self, query: str, top_k: int) -> List[dict]:
+        """
+        Up to `top_k` matches with a positive score, best first, in the same
+        shape as vector matches (id, score, metadata).
+        """
+        term_ids = {self.vocab[t] for t in tokenize(query) if t in self.vocab}
+        if not term_ids or not self.ids:
+            return []
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for t in term_ids:
+            lo, hi = self.offsets[t], self.offsets[t + 1]
+            scores[self.docs[lo:hi]] += self.weights[lo:hi]
+
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > top_k:
+            top = np.argpartition(-scores[candidates], top_k - 1)[:top_k]
+            candidates = candidates[top]
+        ordered = candidates[np.argsort(-scores[candidates])]
+        return [
+            {
+                "id": self.ids[i],
+                "score": float(scores[i]),
+                "metadata": self.metadata[i],
+            }
+            for i in ordered
+        ]
+
+
+class LexicalStore:
+    """
+    The chunk records behind the BM25 index, kept in `<path>/records.json`
+    (ids and metadata, the chunk text included) so the index can be rebuilt in
+    any process, whichever vector backend holds the embeddings.
+
+    Ingestion upserts/deletes records and save()s them atomically. The server
+    builds the index at startup; when the file changes later, the records are
+    reloaded and the index rebuilt on a worker thread while queries keep using
+    the old index, which is swapped out once the new one is ready. After a
+    failed rebuild, the next attempt waits `retry_interval` seconds.
+    """
+
+    RECORDS_FILE = "records.json"
+
+    def __init__(self, path: str, retry_interval: float = 30.0):
+        self.path = path
+        self.retry_interval = retry_interval
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._files: Optional[set] = None
+        self._index: Optional[BM25Index] = None
+        self._loaded_mtime_ns = 0
+        self._dirty = False
+        self._refreshing = False
+        self._failed_at: Optional[float] = None  # monotonic time of last failure
+        self._load()
+
+    #####################
+    # Query path
+    #####################
+    def search(self, query: str, top_k: int) -> List[dict]:
+        """
+        Never blocks on a rebuild: until the first index is built (see
+        build()), there are no lexical matches.
+        """
+        self._refresh_in_background()
+        index = self._index
+        return index.search(query, top_k) if index is not None else []
+
+    def build(self) -> BM25Index:
+        """
+        The BM25 index over the current records, built synchronously (about a
+        second per few thousand chunks, so the server calls it at startup off
+        the event loop).
+        """
+        self._maybe_reload()
+        if self._index is None:
+            self._index = self._build_index(self._records)
+        return self._index
+
+    def ready(self) -> bool:
+        """
+        True if there are records to search (a newly ingested file is picked
+        up in the background).
+        """
+        self._refresh_in_background()
+        return bool(self._records)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    #####################
+    # Ingestion path
+    #####################
+    def upsert(self, chunks: Iterable[Tuple[str, str, Dict[str, Any]]]) -> None:
+        for doc_id, text, metadata in chunks:
+            self._records[doc_id] = dict(metadata, text=text)
+            if self._files is not None:
+                self._files.add(metadata.get("filename", ""))
+            self._dirty = True
+        self._index = None
+
+    def delete(self, ids: Iterable[str]) -> None:
+        for doc_id in ids:
+            if self._records.pop(doc_id, None) is not None:
+                self._dirty = True
+        self._files = None
+        self._index = None
+
+    def has_file(self, filename: str) -> bool:
+        if self._files is None:
+            self._files = {m.get("filename", "") for m in self._records.values()}
+        return filename in self._files
+
+    def save(self) -> None:
+        """
+        Atomically publish the current records.
+        """
+        if not self._dirty:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        records_path = os.path.join(self.path, self.RECORDS_FILE)
+        with open(f"{records_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "ids": list(self._records),
+                    "metadata": list(self._records.values()),
+                },
+                f,
+            )
+        os.replace(f"{records_path}.tmp", records_path)
+        self._dirty = False
+        logger.info(f"[LexicalStore] Saved {len(self._records)} records to {self.path}")
+
+    #####################
+    # Loading
+    #####################
+    def _records_mtime_ns(self) -> int:
+        try:
+            return os.stat(os.path.join(self.path, self.RECORDS_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def _read_records(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        try:
+            with open(
+                os.path.join(self.path, self.RECORDS_FILE), "r", encoding="utf-8"
+            ) as f:
+                records = json.load(f)
+        except Exception as e:
+            logger.error(f"[LexicalStore] Failed to load {self.path}: {e}")
+            return None
+        return dict(zip(records["ids"], records["metadata"]))
+
+    @staticmethod
+    def _build_index(records: Dict[str, Dict[str, Any]]) -> BM25Index:
+        return BM25Index(
+            list(records),
+            (meta.get("text", "") for meta in records.values()),
+            list(records.values()),
+        )
+
+    def _load(self) -> None:
+        mtime_ns = self._records_mtime_ns()
+        if not mtime_ns:
+            logger.warning(f"[LexicalStore] No lexical index found at {self.path}")
+            return
+        records = self._read_records()
+        if records is None:
+            return
+        self._records = records
+        self._files = None
+        self._index = None
+        self._loaded_mtime_ns = mtime_ns
+        logger.info(f"[LexicalStore] Loaded {len(self._records)} records")
+
+    def _maybe_reload(self) -> None:
+        if not self._dirty and self._records_mtime_ns() != self._loaded_mtime_ns:
+            self._load()
+
+    def _refresh_in_background(self) -> None:
+        """
+        Start a reload + rebuild on a worker thread if records.json changed
+        since it was loaded, or there are records but no index yet.
+        """
+        if self._dirty or self._refreshing:
+            return
+        if (
+            self._failed_at is not None
+            and time.monotonic() - self._failed_at < self.retry_interval
+        ):
+            return
+        stale = self._records_mtime_ns() != self._loaded_mtime_ns
+        if not stale and (self._index is not None or not self._records):
+            return
+        self._refreshing = True
+        threading.Thread(
+            target=self._refresh, name="lexical-refresh", daemon=True
+        ).start()
+
+    def _refresh(self) -> None:
+        try:
+            mtime_ns = self._records_mtime_ns()
+            records = self._records
+            if mtime_ns != self._loaded_mtime_ns:
+                records = self._read_records()
+                if records is None:
+                    # keep serving the old index; retry once the file changes again
+                    self._loaded_mtime_ns = mtime_ns
+                    return
+            index = self._build_index(records)
+            # Readers take one attribute at a time, so each assignment is an
+            # atomic swap; a query in between just uses the old index
+            self._records = records
+            self._files = None
+            self._index = index
+            self._loaded_mtime_ns = mtime_ns
+            self._failed_at = None
+            logger.info(f"[LexicalStore] Rebuilt index over {len(records)} records")
+        except Exception as e:
+            self._failed_at = time.monotonic()
+            logger.error(
+                f"[LexicalStore] Background rebuild failed, retrying in "
+                f"{self.retry_interval:.0f}s: {e!r}"
+            )
+        finally:
+            self._refreshing = False
+
+
+_lexical_store_instance: Optional[LexicalStore] = None
+
+
+def get_lexical_store() -> LexicalStore:
+    global _lexical_store_instance
+    if _lexical_store_instance is None:
+        _lexical_store_instance = LexicalStore(
+            config.get("lexical_index_path", "server/lexical_index"),
+            retry_interval=config.get("lexical_retry_interval", 30.0),
+        )
+    return _lexical_store_instance
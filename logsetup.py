@@ -0,0 +1,193 @@
+# logsetup.py
+# Logging pipeline that keeps log I/O off the event loop: records go onto a
+# bounded in-memory queue, and a listener thread formats them (JSON or text)
+# and writes them to a size-rotated (or externally rotated) file and the console.
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import traceback
+from typing import Optional
+
+from server.configmanager import config
+from server.tracing import RequestIdFilter, process_path
+
+# Attributes every LogRecord has; anything else came in through `extra=`
+_RECORD_ATTRS = frozenset(
+    logging.LogRecord("", 0, "", 0, "", (), None).__dict__
+) | {"message", "asctime", "taskName"}
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+
+def extra_fields(record: logging.LogRecord) -> dict:
+    return {k: v for k, v in record.__dict__.items() if k not in _RECORD_ATTRS}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: time, level, logger, message, any `extra=`
+    fields, and the traceback if there is one.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **extra_fields(record),
+        }
+        if record.exc_info:
+            entry["exc"] = "".join(traceback.format_exception(*record.exc_info))
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """
+    The classic one-line format, with `extra=` fields appended as key=value.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = extra_fields(record)
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return line
+
+
+class DebugSampler(logging.Filter):
+    """
+    Passes every record at INFO and above, and DEBUG records with probability
+    `rate`, so debug logging can stay on under load.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+        self.sampled_out = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or random.random() < self.rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues the record as is: the message (`msg % args`) and traceback are
+    only rendered by the listener thread. When the queue is full the record is
+    dropped and counted rather than blocking the caller.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.queued = 0
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+            self.queued += 1
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[NonBlockingQueueHandler] = None
+_sampler: Optional[DebugSampler] = None
+
+
+def setup_logging() -> None:
+    """
+    Route the root logger through the queue. Idempotent; settings are read
+    from config once (log_* keys).
+
+    RotatingFileHandler's size check and rename aren't safe across processes:
+    with several uvicorn workers, either set `log_per_process` (each worker
+    rotates its own `server.<pid>.log`) or set `log_max_bytes` to 0 and rotate
+    the shared file externally (logrotate); a WatchedFileHandler then reopens
+    it after the move.
+    """
+    global _listener, _queue_handler, _sampler
+    if _listener is not None:
+        return
+    settings = config.snapshot()
+
+    formatter = (
+        JsonFormatter() if settings.log_format == "json" else TextFormatter(TEXT_FORMAT)
+    )
+    handlers = []
+    if settings.log_file:
+        log_file = process_path(settings.log_file, settings.log_per_process)
+        os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+        if settings.log_max_bytes > 0:
+            file_handler = logging.handlers.RotatingFileHandler(
+                log_file,
+                maxBytes=settings.log_max_bytes,
+                backupCount=settings.log_backup_count,
+                encoding="utf-8",
+            )
+        else:
+            file_handler = logging.handlers.WatchedFileHandler(
+                log_file, encoding="utf-8"
+            )
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(TextFormatter(TEXT_FORMAT))
+    handlers.append(console_handler)
+
+    log_queue: queue.Queue = queue.Queue(maxsize=settings.log_queue_size)
+    _queue_handler = NonBlockingQueueHandler(log_queue)
+    _sampler = DebugSampler(settings.log_debug_sample_rate)
+    _queue_handler.addFilter(_sampler)
+    _queue_handler.addFilter(RequestIdFilter())  # runs in the caller's context
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(settings.log_level.upper())
+
+    _listener = logging.handlers.QueueListener(
+        log_queue, *handlers, respect_handler_level=True
+    )
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """
+    Flush what is queued and stop the listener thread. Anything logged after
+    this goes straight to the handlers.
+    """
+    global _listener
+    if _listener is None:
+        return
+    root = logging.getLogger()
+    root.removeHandler(_queue_handler)
+    _listener.stop()
+    for handler in _listener.handlers:
+        root.addHandler(handler)
+    _listener = None
+
+
+def log_stats() -> dict:
+    if _queue_handler is None:
+        return {"pipeline": False}
+    return {
+        "pipeline": True,
+        "queued": _queue_handler.queued,
+        "dropped": _queue_handler.dropped,
+        "backlog": _queue_handler.queue.qsize(),
+        "debug_sampled_out": _sampler.sampled_out if _sampler else 0,
+    }
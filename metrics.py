@@ -0,0 +1,235 @@
+# metrics.py
+# Minimal in-process metrics (counters, histograms, scrape-time callbacks)
+# rendered in the Prometheus text exposition format for GET /metrics.
+
+import math
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+Labels = Tuple[str, ...]
+Sample = Tuple[Dict[str, str], float]
+
+# Seconds; covers cache hits (sub-ms) up to slow generations
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+class Counter:
+    """
+    Monotonic counter, optionally split by label values (passed positionally
+    in `labelnames` order).
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, *labels: str) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        for labels, value in self._values.items():
+            yield self.name, dict(zip(self.labelnames, labels)), value
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: "Histogram", labels: Labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> "_Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram. observe() is one bisect and three additions, so it
+    can stay on in every request.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[Labels, list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def time(self, *labels: str) -> _Timer:
+        """
+        `with histogram.time("stage"):` observes the block's duration.
+        """
+        return _Timer(self, labels)
+
+    def samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        for labels, (counts, total, count) in self._series.items():
+            base = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), counts):
+                cumulative += n
+                le = _format_value(bound)
+                yield f"{self.name}_bucket", {**base, "le": le}, cumulative
+            yield f"{self.name}_sum", base, total
+            yield f"{self.name}_count", base, count
+
+
+class CallbackMetric:
+    """
+    A gauge or counter read at scrape time from `collect()`, which returns
+    (labels, value) pairs. Used to expose counters the components already keep
+    (cache hits, limiter waits) at no cost per request.
+    """
+
+    def __init__(
+        self, name: str, help: str, kind: str, collect: Callable[[], Iterable[Sample]]
+    ):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.collect = collect
+
+    def samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        for labels, value in self.collect():
+            yield self.name, labels, value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback(
+        self,
+        name: str,
+        help: str,
+        collect: Callable[[], Iterable[Sample]],
+        kind: str = "gauge",
+    ) -> CallbackMetric:
+        return self.register(CallbackMetric(name, help, kind, collect))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+#####################
+# Request path metrics
+#####################
+REQUEST_SECONDS = REGISTRY.histogram(
+    "rag_request_seconds",
+    "End-to-end request latency.",
+    ("route", "answer_cache"),
+)
+STAGE_SECONDS = REGISTRY.histogram(
+    "rag_stage_seconds",
+    "Latency of each request stage (embedding, vector_query, lexical_query, "
+    "rerank, reference_build, llm).",
+    ("stage",),
+)
+TIME_TO_FIRST_TOKEN = REGISTRY.histogram(
+    "rag_llm_time_to_first_token_seconds",
+    "Time from the start of a streamed model call (queueing included) to its "
+    "first token.",
+)
+LLM_TOKENS = REGISTRY.counter(
+    "rag_llm_tokens_total",
+    "Tokens reported in response.usage.",
+    ("direction",),
+)
+RATE_LIMITER_WAIT = REGISTRY.histogram(
+    "rag_rate_limiter_wait_seconds",
+    "Time each model call waited on the proactive rate limiter.",
+    buckets=(0.0, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+CLIENT_REJECTIONS = REGISTRY.counter(
+    "rag_client_rejections_total",
+    "Requests refused with 429 by the per-client limits.",
+    ("rule",),
+)
+
+
+def observe_usage(input_tokens: Optional[int], output_tokens: Optional[int]) -> None:
+    if input_tokens:
+        LLM_TOKENS.inc(input_tokens, "input")
+    if output_tokens:
+        LLM_TOKENS.inc(output_tokens, "output")
@@ -0,0 +1,143 @@
+# openaiclient.py
+# Single app-scoped AsyncOpenAI client with a pooled httpx transport.
+
+import logging
+from typing import Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+from server.configmanager import config
+from server.tracing import CLIENT, start_span
+
+logger = logging.getLogger(__name__)
+
+
+def http2_available() -> bool:
+    """
+    HTTP/2 support in httpx needs the optional 'h2' package.
+    """
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+async def trace_request(request: httpx.Request) -> None:
+    """
+    httpx request hook: a client span per upstream call (retries and hedges
+    each get their own), with the request ID and W3C traceparent forwarded.
+    """
+    span = start_span(
+        f"{request.method} {request.url.host}{request.url.path}",
+        CLIENT,
+        **{"http.method": request.method, "server.address": request.url.host},
+    )
+    if not span.trace.request_id:
+        return  # outside a request (e.g. the embedding cache warm-up)
+    request.headers["X-Request-ID"] = span.trace.request_id
+    request.headers["traceparent"] = span.traceparent()
+    request.extensions["trace_span"] = span
+
+
+class TracingTransport(httpx.AsyncBaseTransport):
+    """
+    Ends a request's client span when the call fails before a response
+    arrives (connect error, timeout, cancellation), which the response hook
+    never sees.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        try:
+            return await self._transport.handle_async_request(request)
+        except BaseException as e:
+            span = request.extensions.get("trace_span")
+            if span is not None:
+                span.end(error=type(e).__name__)
+            raise
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+async def trace_response(response: httpx.Response) -> None:
+    """
+    httpx response hook (runs once headers arrive, before a stream's body):
+    records the status and OpenAI's own x-request-id, so a slow call can be
+    matched with the provider's logs.
+    """
+    span = response.request.extensions.get("trace_span")
+    if span is None:
+        return
+    span.set(**{"http.status_code": response.status_code})
+    upstream_id = response.headers.get("x-request-id")
+    if upstream_id:
+        span.set(**{"openai.request_id": upstream_id})
+    span.end(error=f"HTTP {response.status_code}" if response.is_error else None)
+
+
+def build_openai_client(
+    api_key: Optional[str] = None, base_url: Optional[str] = None
+) -> AsyncOpenAI:
+    """
+    Create an AsyncOpenAI client backed by a pooled httpx.AsyncClient.
+    Connection and keep-alive limits come from config so they can be tuned per host.
+    """
+    limits = httpx.Limits(
+        max_connections=config.get("openai_max_connections", 100),
+        max_keepalive_connections=config.get("openai_max_keepalive", 20),
+        keepalive_expiry=config.get("openai_keepalive_expiry", 30.0),
+    )
+    timeout = httpx.Timeout(
+        config.get("openai_timeout", 60.0),
+        connect=config.get("openai_connect_timeout", 5.0),
+    )
+    use_http2 = config.get("openai_http2", True) and http2_available()
+
+    http_client = httpx.AsyncClient(
+        transport=TracingTransport(
+            httpx.AsyncHTTPTransport(limits=limits, http2=use_http2)
+        ),
+        timeout=timeout,
+        event_hooks={"request": [trace_request], "response": [trace_response]},
+    )
+    logger.info(
+        f"[openaiclient] Created pooled client (http2={use_http2}, "
+        f"max_connections={limits.max_connections}, "
+        f"max_keepalive={limits.max_keepalive_connections})"
+    )
+    return AsyncOpenAI(
+        api_key=api_key or config.get_or_error("OPENAI_API_KEY"),
+        base_url=base_url,
+        http_client=http_client,
+        max_retries=0,  # retries are owned by retrypolicy, not stacked inside the SDK
+    )
+
+
+_openai_client_instance: Optional[AsyncOpenAI] = None
+
+
+def get_openai_client() -> AsyncOpenAI:
+    """
+    Returns the shared client, creating it on first use. The FastAPI lifespan
+    handler normally creates it at startup so the first request doesn't pay for it.
+    """
+    global _openai_client_instance
+    if _openai_client_instance is None:
+        _openai_client_instance = build_openai_client()
+    return _openai_client_instance
+
+
+async def close_openai_client() -> None:
+    """
+    Close the shared client and its connection pool (called on shutdown).
+    """
+    global _openai_client_instance
+    if _openai_client_instance is not None:
+        await _openai_client_instance.close()
+        _openai_client_instance = None
+        logger.info("[openaiclient] Closed pooled client.")
@@ -2,18 +2,33 @@
 
 import os
 import sys
+import json
+import time
+import hashlib
 import logging
 import argparse
-from tkinter.filedialog import Open
+import queue
+import threading
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
 
-from httpx import Client
 import pdfplumber
-from openai import OpenAI
+from openai import OpenAI, RateLimitError
 from pinecone import Pinecone, ServerlessSpec
-from typing import List
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
 from tqdm import tqdm
 
+from server.chunker import CHUNKER_VERSION, Chunker, get_tokenizer
+from server.indexversion import DEFAULT_INDEX_VERSION_PATH, bump_index_version
+from server.lexicalindex import LexicalStore
+from server.vectorstore import LocalStore, PineconeStore, VectorStore
+
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -23,72 +38,527 @@ PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_ENV = os.getenv("PINECONE_ENV", "us-west-2")
 INDEX_NAME = os.getenv("INDEX_NAME", "mauibuildingcode")
 SOURCE_DOCS_PATH = os.getenv("SOURCE_DOCS_PATH", "./source_docs")
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH", "server/local_index")
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "server/lexical_index")
+INDEX_VERSION_PATH = os.getenv("INDEX_VERSION_PATH", DEFAULT_INDEX_VERSION_PATH)
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))  # chunks per request
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))  # requests in flight
+EMBED_REQUESTS_PER_MINUTE = int(os.getenv("EMBED_REQUESTS_PER_MINUTE", "500"))
+EMBED_MAX_ATTEMPTS = 5
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "100"))  # vectors per upsert
+
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+PAGES_PER_TASK = int(os.getenv("PAGES_PER_TASK", "8"))  # page range per worker task
+PAGE_QUEUE_SIZE = int(os.getenv("PAGE_QUEUE_SIZE", "64"))  # extracted pages buffered
+TASKS_PER_EXTRACT_WORKER = 2  # one running plus one queued, so no worker idles
+
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "400"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "60"))
+CHUNK_MIN_TOKENS = int(os.getenv("CHUNK_MIN_TOKENS", "100"))  # before a heading may split
+
+# 2: token/section-aware chunk ids, 3: chunk hashes cover metadata
+MANIFEST_VERSION = 3
+
+# (doc_id, text, metadata) for one chunk, before it has an embedding
+Chunk = Tuple[str, str, Dict[str, Any]]
 
 client = OpenAI(api_key=OPENAI_API_KEY)
 
-# Initialize Pinecone client
-pc = Pinecone(api_key=PINECONE_API_KEY, environment=PINECONE_ENV)
-# Parse environment string into region and cloud for serverless spec
-parts = PINECONE_ENV.split("-")
-region = parts[0]
-cloud = parts[1] if len(parts) > 1 else "aws"
-spec = ServerlessSpec(cloud=cloud, region=region)
-# Create index if it doesn't exist
-if INDEX_NAME not in pc.list_indexes().names():
-    pc.create_index(name=INDEX_NAME, dimension=1536, metric="cosine", spec=spec)
-# Reference the index
-index = pc.Index(INDEX_NAME)
-
-
-def chunk_text(text: str, chunk_size=600, overlap=50) -> List[str]:
-    words = text.split()
-    chunks = []
-    start = 0
-    while start < len(words):
-        end = start + chunk_size
-        chunk = " ".join(words[start:end])
-        chunks.append(chunk)
-        start += chunk_size - overlap
-    return chunks
-
-
-def create_embedding(text: str) -> List[float]:
-    text = text.replace("\n", " ")
-    response = client.embeddings.create(model="text-embedding-ada-002", input=text)
-    return response.data[0].embedding
-
-
-def process_pdf_file(pdf_path: str):
+
+def open_store(backend: str, local_path: str) -> VectorStore:
+    """
+    Open the vector store to ingest into: the hosted Pinecone index (created if
+    missing) or a local in-process index directory.
+    """
+    if backend == "local":
+        return LocalStore(local_path)
+
+    # Initialize Pinecone client
+    pc = Pinecone(api_key=PINECONE_API_KEY, environment=PINECONE_ENV)
+    # Parse environment string into region and cloud for serverless spec
+    parts = PINECONE_ENV.split("-")
+    region = parts[0]
+    cloud = parts[1] if len(parts) > 1 else "aws"
+    spec = ServerlessSpec(cloud=cloud, region=region)
+    # Create index if it doesn't exist
+    if INDEX_NAME not in pc.list_indexes().names():
+        pc.create_index(name=INDEX_NAME, dimension=1536, metric="cosine", spec=spec)
+    # Reference the index
+    return PineconeStore(pc.Index(INDEX_NAME))
+
+
+class RequestBudget:
+    """
+    Token bucket of embedding requests per minute, shared by the worker threads so
+    concurrent requests stay under the account's rate limit instead of
+    discovering it through 429s.
+    """
+
+    def __init__(self, per_minute: int, burst: int = EMBED_CONCURRENCY):
+        self.rate = per_minute / 60.0
+        self.capacity = float(max(1, min(per_minute, burst)))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def create_embeddings(texts: List[str], budget: RequestBudget) -> List[List[float]]:
+    """
+    Embed many chunks in one request, retrying with backoff on rate limits.
+    """
+    texts = [t.replace("\n", " ") for t in texts]
+    for attempt in range(EMBED_MAX_ATTEMPTS):
+        budget.acquire()
+        try:
+            response = client.embeddings.create(model=EMBEDDING_MODEL, input=texts)
+            ordered = sorted(response.data, key=lambda d: d.index)
+            return [d.embedding for d in ordered]
+        except RateLimitError:
+            wait = 2**attempt
+            logger.warning(f"Embedding rate limited, retrying in {wait}s")
+            time.sleep(wait)
+    raise RuntimeError(f"Embedding failed after {EMBED_MAX_ATTEMPTS} attempts")
+
+
+#####################
+# Extraction stage (process pool)
+#####################
+def count_pages(pdf_path: str) -> int:
+    with pdfplumber.open(pdf_path) as pdf:
+        return len(pdf.pages)
+
+
+def extract_page_range(pdf_path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """
+    Runs in a worker process: extract text for pages [start, end), 1-based.
+    """
+    pages = []
+    with pdfplumber.open(pdf_path) as pdf:
+        for page_num in range(start, end):
+            pages.append((page_num, pdf.pages[page_num - 1].extract_text() or ""))
+    return pages
+
+
+def iter_pages(
+    pdf_path: str,
+    extract_pool: ProcessPoolExecutor,
+    pages_per_task: int = PAGES_PER_TASK,
+    queue_size: int = PAGE_QUEUE_SIZE,
+) -> Iterator[Tuple[int, str]]:
+    """
+    Yield (page_number, text) in page order while later page ranges are still
+    being extracted in other processes. A feeder thread keeps up to
+    TASKS_PER_EXTRACT_WORKER ranges per pool worker in flight and moves finished
+    pages into a bounded queue; when the embed/upsert stages fall behind, the
+    full queue stops the feeder and with it new submissions.
+    """
+    total = count_pages(pdf_path)
+    ranges = [
+        (start, min(start + pages_per_task, total + 1))
+        for start in range(1, total + 1, pages_per_task)
+    ]
+    pages: "queue.Queue" = queue.Queue(maxsize=queue_size)
+    done = object()
+    workers = getattr(extract_pool, "_max_workers", None) or os.cpu_count() or 1
+    max_tasks = TASKS_PER_EXTRACT_WORKER * workers
+
+    def feed():
+        try:
+            in_flight: List[Future] = []
+            next_range = 0
+            while next_range < len(ranges) or in_flight:
+                while next_range < len(ranges) and len(in_flight) < max_tasks:
+                    start, end = ranges[next_range]
+                    in_flight.append(
+                        extract_pool.submit(extract_page_range, pdf_path, start, end)
+                    )
+                    next_range += 1
+                # Keep page order: wait on the oldest range
+                for page in in_flight.pop(0).result():
+                    pages.put(page)
+        except Exception as e:
+            pages.put(e)
+        finally:
+            pages.put(done)
+
+    feeder = threading.Thread(target=feed, name="pdf-extract-feeder", daemon=True)
+    feeder.start()
+    while True:
+        item = pages.get()
+        if item is done:
+            break
+        if isinstance(item, Exception):
+            raise item
+        yield item
+    feeder.join()
+
+
+def iter_chunks(file_id: str, pages: Iterable[Tuple[int, str]]) -> Iterator[Chunk]:
+    """
+    Chunk page texts as they arrive from the extraction stage. Chunks follow
+    code-section headings and may run across a page break; ids are numbered per
+    starting page.
+    """
+    chunker = Chunker(
+        max_tokens=CHUNK_MAX_TOKENS,
+        overlap_tokens=CHUNK_OVERLAP_TOKENS,
+        min_tokens=CHUNK_MIN_TOKENS,
+    )
+    page_num, i = None, 0
+    for chunk in chunker.chunk_pages(pages):
+        i = i + 1 if chunk.page_number == page_num else 0
+        page_num = chunk.page_number
+        metadata = {
+            "filename": file_id,
+            "page_number": chunk.page_number,
+            "end_page": chunk.end_page,
+            "chunk_index": i,
+            "start_line": chunk.start_line,
+            "end_line": chunk.end_line,
+            "section": chunk.section or "",
+            "token_count": chunk.token_count,
+            "text": chunk.text,
+        }
+        yield (f"{file_id}_p{page_num}_c{i}", chunk.text, metadata)
+
+
+#####################
+# Embed / upsert stage (thread pool)
+#####################
+def embed_and_upsert(
+    chunks: Iterable[Chunk],
+    store: VectorStore,
+    executor: ThreadPoolExecutor,
+    budget: RequestBudget,
+    progress: tqdm,
+    embed_batch_size: int = EMBED_BATCH_SIZE,
+    upsert_batch_size: int = UPSERT_BATCH_SIZE,
+) -> None:
+    """
+    Embed chunks in batches (several requests in flight on `executor`) and upsert
+    the resulting vectors in large batches as they come back. `chunks` may be a
+    lazy stream; batches are submitted as soon as they fill.
+    """
+    max_in_flight = max(1, getattr(executor, "_max_workers", 1)) * 2
+    in_flight: Dict[Future, List[Chunk]] = {}
+    pending: list = []
+
+    def collect(block: bool) -> None:
+        nonlocal pending
+        finished, _ = wait(
+            list(in_flight),
+            timeout=None if block else 0,
+            return_when=FIRST_COMPLETED,
+        )
+        for future in finished:
+            batch = in_flight.pop(future)
+            for (doc_id, _, metadata), embedding in zip(batch, future.result()):
+                pending.append((doc_id, embedding, metadata))
+            progress.update(len(batch))
+        while len(pending) >= upsert_batch_size:
+            store.upsert(pending[:upsert_batch_size])
+            pending = pending[upsert_batch_size:]
+
+    def submit(batch: List[Chunk]) -> None:
+        texts = [text for _, text, _ in batch]
+        in_flight[executor.submit(create_embeddings, texts, budget)] = batch
+        while len(in_flight) >= max_in_flight:
+            collect(block=True)
+        if in_flight:
+            collect(block=False)
+
+    batch: List[Chunk] = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= embed_batch_size:
+            submit(batch)
+            batch = []
+    if batch:
+        submit(batch)
+    while in_flight:
+        collect(block=True)
+
+    if pending:
+        store.upsert(pending)
+
+
+#####################
+# Incremental manifest
+#####################
+def default_manifest_path(backend: str, local_path: str) -> str:
+    if backend == "local":
+        return os.path.join(local_path, "manifest.json")
+    return os.path.join(os.path.dirname(INDEX_VERSION_PATH), f"manifest_{INDEX_NAME}.json")
+
+
+def load_manifest(path: str) -> Dict[str, Any]:
+    """
+    The manifest records, per source file, its content hash and the hash of every
+    chunk it produced, so re-runs only embed what changed. It is discarded if it
+    was built with a different embedding model or chunker settings.
+    """
+    empty = {
+        "version": MANIFEST_VERSION,
+        "embedding_model": EMBEDDING_MODEL,
+        "chunker": chunker_settings(),
+        "files": {},
+    }
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return empty
+    except Exception as e:
+        logger.error(f"Failed to read manifest {path}, starting fresh: {e}")
+        return empty
+
+    if manifest.get("version") != MANIFEST_VERSION:
+        logger.warning(f"Manifest {path} has an old format, re-ingesting everything.")
+        return dict(empty, stale_files=manifest.get("files", {}))
+    if manifest.get("embedding_model") != EMBEDDING_MODEL:
+        logger.warning(
+            f"Manifest built with {manifest.get('embedding_model')}, "
+            f"re-embedding everything with {EMBEDDING_MODEL}."
+        )
+        # Keep the old chunk ids so vectors that disappear still get deleted
+        return dict(empty, stale_files=manifest.get("files", {}))
+    if manifest.get("chunker") != empty["chunker"]:
+        logger.warning(
+            f"Manifest built with chunker settings {manifest.get('chunker')}, "
+            f"re-chunking everything with {empty['chunker']}."
+        )
+        return dict(empty, stale_files=manifest.get("files", {}))
+    return manifest
+
+
+def save_manifest(path: str, manifest: Dict[str, Any]) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    data = {k: v for k, v in manifest.items() if k != "stale_files"}
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=1)
+    os.replace(f"{path}.tmp", path)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunker_settings() -> Dict[str, Any]:
+    return {
+        "version": CHUNKER_VERSION,
+        "max_tokens": CHUNK_MAX_TOKENS,
+        "overlap_tokens": CHUNK_OVERLAP_TOKENS,
+        "min_tokens": CHUNK_MIN_TOKENS,
+        # Approximate counts size chunks differently; switching re-chunks
+        "exact_tokens": get_tokenizer().exact,
+    }
+
+
+def chunk_sha256(text: str, metadata: Dict[str, Any]) -> str:
+    """
+    Hash of a chunk as stored: its text and its metadata (section, pages,
+    lines), so a chunk whose text is the same but whose metadata changed is
+    re-upserted too.
+    """
+    payload = json.dumps([text, metadata], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def process_pdf_file(
+    pdf_path: str,
+    store: VectorStore,
+    executor: ThreadPoolExecutor,
+    budget: RequestBudget,
+    progress: tqdm,
+    manifest: Optional[Dict[str, Any]] = None,
+    extract_pool: Optional[ProcessPoolExecutor] = None,
+    lexical: Optional[LexicalStore] = None,
+) -> bool:
+    """
+    Ingest one PDF. With a manifest, an unchanged file is skipped without even
+    being opened, only new or changed chunks are embedded, and vectors for
+    chunks that no longer exist are deleted. Every chunk, changed or not, is
+    also recorded in the lexical (BM25) store, so a file missing from it is
+    re-chunked (without re-embedding). Returns True if the index changed.
+    """
     file_id = os.path.basename(pdf_path)
+    files = manifest["files"] if manifest is not None else {}
+    stale = manifest.get("stale_files", {}) if manifest is not None else {}
+    previous = files.get(file_id) or stale.get(file_id) or {}
+    previous_chunks = files.get(file_id, {}).get("chunks", {})
+
+    file_hash = file_sha256(pdf_path)
+    unchanged_file = file_id in files and files[file_id]["sha256"] == file_hash
+    backfill_lexical = lexical is not None and not lexical.has_file(file_id)
+    if manifest is not None and unchanged_file and not backfill_lexical:
+        logger.info(f"Unchanged, skipping: {file_id}")
+        return False
+
     logger.info(f"Processing: {file_id}")
-    with pdfplumber.open(pdf_path) as pdf:
-        for page_num, page in enumerate(pdf.pages, start=1):
-            text = page.extract_text()
-            if not text or not text.strip():
-                continue
-            for i, chunk in enumerate(chunk_text(text, 600, 50)):
-                embedding = create_embedding(chunk)
-                metadata = {
-                    "filename": file_id,
-                    "page_number": page_num,
-                    "chunk_index": i,
-                    "text": chunk,
-                }
-                doc_id = f"{file_id}_p{page_num}_c{i}"
-                index.upsert([(doc_id, embedding, metadata)])
-                logger.debug(f"Upserted: {doc_id}")
+    pages = (
+        iter_pages(pdf_path, extract_pool)
+        if extract_pool is not None
+        else extract_page_range(pdf_path, 1, count_pages(pdf_path) + 1)
+    )
+
+    chunk_hashes: Dict[str, str] = {}
+    changed_count = 0
+
+    def changed_chunks() -> Iterator[Chunk]:
+        nonlocal changed_count
+        for chunk in iter_chunks(file_id, pages):
+            doc_id, text, metadata = chunk
+            if lexical is not None:
+                lexical.upsert([chunk])
+            chunk_hashes[doc_id] = chunk_sha256(text, metadata)
+            if previous_chunks.get(doc_id) != chunk_hashes[doc_id]:
+                changed_count += 1
+                yield chunk
+
+    embed_and_upsert(changed_chunks(), store, executor, budget, progress)
+
+    removed = [i for i in previous.get("chunks", {}) if i not in chunk_hashes]
+    if removed:
+        store.delete(removed)
+        if lexical is not None:
+            lexical.delete(removed)
+    logger.info(
+        f"{file_id}: {changed_count} new/changed, "
+        f"{len(chunk_hashes) - changed_count} unchanged, {len(removed)} deleted"
+    )
+
+    if manifest is not None:
+        files[file_id] = {"sha256": file_hash, "chunks": chunk_hashes}
+        stale.pop(file_id, None)
+    return bool(changed_count or removed or backfill_lexical)
+
+
+def prune_missing_files(
+    manifest: Dict[str, Any],
+    present: List[str],
+    store: VectorStore,
+    lexical: Optional[LexicalStore] = None,
+) -> bool:
+    """
+    Delete vectors for files that are in the manifest but no longer in the folder.
+    """
+    files = manifest["files"]
+    stale = manifest.get("stale_files", {})
+    pruned = False
+    for file_id in sorted((set(files) | set(stale)) - set(present)):
+        ids = list((files.get(file_id) or stale.get(file_id, {})).get("chunks", {}))
+        if ids:
+            store.delete(ids)
+            if lexical is not None:
+                lexical.delete(ids)
+        files.pop(file_id, None)
+        stale.pop(file_id, None)
+        logger.info(f"Removed {len(ids)} vectors for deleted file {file_id}")
+        pruned = True
+    return pruned
 
 
 def main():
-    parser = argparse.ArgumentParser(description="Ingest PDFs into Pinecone.")
+    parser = argparse.ArgumentParser(
+        description="Ingest PDFs into Pinecone or a local vector index."
+    )
     parser.add_argument(
         "--folder", type=str, help="Path to a folder containing PDFs to process."
     )
     parser.add_argument(
         "--file", type=str, help="Path to a single PDF file to process."
     )
+    parser.add_argument(
+        "--backend",
+        choices=["pinecone", "local"],
+        default=VECTOR_BACKEND,
+        help="Vector store to ingest into (default: pinecone).",
+    )
+    parser.add_argument(
+        "--local-path",
+        type=str,
+        default=LOCAL_INDEX_PATH,
+        help="Directory of the local index when --backend local.",
+    )
+    parser.add_argument(
+        "--lexical-path",
+        type=str,
+        default=LEXICAL_INDEX_PATH,
+        help="Directory of the chunk records used for BM25 retrieval.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=EMBED_CONCURRENCY,
+        help="Embedding requests in flight at once.",
+    )
+    parser.add_argument(
+        "--requests-per-minute",
+        type=int,
+        default=EMBED_REQUESTS_PER_MINUTE,
+        help="Embedding request budget (stay under the account's RPM limit).",
+    )
+    parser.add_argument(
+        "--extract-workers",
+        type=int,
+        default=EXTRACT_WORKERS,
+        help="Processes used for PDF text extraction (default: CPU count).",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default=None,
+        help="Content-hash manifest for incremental runs (default: per index).",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Ignore the manifest and re-embed every chunk.",
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="With --folder, delete vectors of files no longer in the folder.",
+    )
+    parser.add_argument(
+        "--approximate-tokens",
+        action="store_true",
+        help="Chunk with approximate token counts if tiktoken is unavailable.",
+    )
     args = parser.parse_args()
 
+    if not get_tokenizer().exact and not args.approximate_tokens:
+        logger.error(
+            "tiktoken's cl100k_base encoding is unavailable, so chunk sizes would "
+            "only be approximate. Install tiktoken (requirements.txt) and make the "
+            "encoding downloadable or cached (TIKTOKEN_CACHE_DIR), or pass "
+            "--approximate-tokens."
+        )
+        sys.exit(1)
+
     if args.folder and args.file:
         parser.error("Cannot use --folder and --file together.")
     elif not args.folder and not args.file:
@@ -102,14 +572,65 @@ def main():
         if not pdf_files:
             logger.info("No PDFs found.")
             return
-        for pdf_file in tqdm(pdf_files, desc="Processing PDFs"):
-            process_pdf_file(os.path.join(args.folder, pdf_file))
+        pdf_paths = [os.path.join(args.folder, f) for f in pdf_files]
     else:
         if not os.path.isfile(args.file):
             logger.error(f"File not found: {args.file}")
             sys.exit(1)
-        process_pdf_file(args.file)
+        pdf_paths = [args.file]
+
+    store = open_store(args.backend, args.local_path)
+    lexical = LexicalStore(args.lexical_path)
+    manifest_path = args.manifest or default_manifest_path(
+        args.backend, args.local_path
+    )
+    manifest = load_manifest(manifest_path)
+    if args.full:
+        manifest = dict(manifest, files={}, stale_files=manifest["files"])
 
+    budget = RequestBudget(args.requests_per_minute, burst=args.concurrency)
+    start = time.time()
+    index_changed = False
+    extract_pool = ProcessPoolExecutor(max_workers=args.extract_workers)
+    executor = ThreadPoolExecutor(max_workers=args.concurrency)
+    with extract_pool, executor, tqdm(desc="Embedding", unit="chunk") as progress:
+        for pdf_path in pdf_paths:
+            if process_pdf_file(
+                pdf_path,
+                store,
+                executor,
+                budget,
+                progress,
+                manifest,
+                extract_pool,
+                lexical,
+            ):
+                index_changed = True
+                # Save as we go so an interrupted run doesn't redo finished files
+                store.save()
+                lexical.save()
+                save_manifest(manifest_path, manifest)
+        total_chunks = progress.n
+
+    if args.folder and args.prune:
+        if prune_missing_files(manifest, pdf_files, store, lexical):
+            index_changed = True
+    store.save()
+    lexical.save()
+    save_manifest(manifest_path, manifest)
+
+    store.close()
+    elapsed = time.time() - start
+    logger.info(
+        f"Ingested {total_chunks} chunks in {elapsed:.1f}s "
+        f"({total_chunks / elapsed if elapsed else 0:.1f} chunks/sec)"
+    )
+
+    # Tell the server its cached answers/retrievals are stale
+    if index_changed:
+        bump_index_version(INDEX_VERSION_PATH)
+    else:
+        logger.info("Index unchanged.")
     logger.info("Ingestion complete.")
 
 
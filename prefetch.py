@@ -0,0 +1,114 @@
+# prefetch.py
+# Per-session retrieval prefetch: embed and query the draft question while the
+# user is still typing, so references are ready when they press Send.
+
+import asyncio
+import logging
+import time
+import weakref
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from server.configmanager import config
+from server.embeddingcache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+
+class PrefetchCache:
+    """
+    Holds at most one prefetched retrieval per session: the normalized draft text
+    and the task producing its (query vector, references). Entries expire after
+    `ttl` seconds, and the least recently used sessions are dropped beyond
+    `max_sessions`. A newer draft replaces the previous one, which is cancelled
+    unless a request already picked it up with get(); such a task is only
+    dropped from the cache and left to finish for the request awaiting it.
+
+    Only used from the event loop, so no locking.
+    """
+
+    def __init__(self, ttl: float = 30.0, max_sessions: int = 1000):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+
+        # session_id -> (expires_at, normalized text, task)
+        self._entries: "OrderedDict[str, Tuple[float, str, asyncio.Future]]" = (
+            OrderedDict()
+        )
+
+        # Tasks handed out by get(), which replacement/eviction must not cancel
+        self._claimed: "weakref.WeakSet[asyncio.Future]" = weakref.WeakSet()
+
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+
+    def has(self, session_id: str, text: str) -> bool:
+        return self._lookup(session_id, text) is not None
+
+    def get(self, session_id: str, text: str) -> Optional[asyncio.Future]:
+        """
+        The prefetch task for exactly this text, finished or still running.
+        """
+        task = self._lookup(session_id, text)
+        if task is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._claimed.add(task)
+        return task
+
+    def put(self, session_id: str, text: str, task: asyncio.Future) -> None:
+        old = self._entries.pop(session_id, None)
+        if old is not None:
+            self._discard(old[2])
+        self._entries[session_id] = (
+            time.monotonic() + self.ttl,
+            normalize_text(text),
+            task,
+        )
+        self.started += 1
+        while len(self._entries) > self.max_sessions:
+            _, (_, _, evicted) = self._entries.popitem(last=False)
+            self._discard(evicted)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "sessions": len(self._entries),
+            "started": self.started,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+    def _discard(self, task: asyncio.Future) -> None:
+        if task not in self._claimed:
+            task.cancel()  # no-op if it already finished
+
+    def _lookup(self, session_id: str, text: str) -> Optional[asyncio.Future]:
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return None
+        expires_at, cached_text, task = entry
+        if expires_at < time.monotonic():
+            del self._entries[session_id]
+            self._discard(task)
+            return None
+        if cached_text != normalize_text(text) or task.cancelled():
+            return None
+        self._entries.move_to_end(session_id)
+        return task
+
+
+_prefetch_cache_instance: Optional[PrefetchCache] = None
+
+
+def get_prefetch_cache() -> PrefetchCache:
+    global _prefetch_cache_instance
+    if _prefetch_cache_instance is None:
+        _prefetch_cache_instance = PrefetchCache(
+            ttl=config.get("prefetch_ttl", 30.0),
+            max_sessions=config.get("prefetch_max_sessions", 1000),
+        )
+    return _prefetch_cache_instance
@@ -0,0 +1,225 @@
+# promptbudget.py
+# Token budget for the model input: older conversation turns are dropped (or
+# condensed into a short summary) once they exceed the history allowance, and
+# whatever is left of the budget goes to the references.
+
+import hashlib
+import logging
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+from server.chunker import get_tokenizer
+from server.configmanager import config
+from server.ratelimiter import estimate_request_tokens
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_LINE_TOKENS = 40  # numbering, score and link around each snippet
+MIN_SNIPPET_TOKENS = 40  # below this a snippet isn't worth sending
+SUMMARY_LINE_TOKENS = 30  # per condensed turn
+_SENTENCE_END_RE = re.compile(r"(?<=[.?!])\s")
+
+# Turns repeat on every request of a conversation, so counts are memoized. Keys
+# are a digest of the content, so the cache never holds message bodies.
+MESSAGE_TOKENS_CACHE_SIZE = 4096
+_message_token_counts: "OrderedDict[Tuple[str, bytes], int]" = OrderedDict()
+
+
+def message_tokens(message: dict) -> int:
+    role = message.get("role", "")
+    content = str(message.get("content", ""))
+    key = (role, hashlib.blake2b(content.encode("utf-8"), digest_size=16).digest())
+    count = _message_token_counts.get(key)
+    if count is not None:
+        _message_token_counts.move_to_end(key)
+        return count
+    count = estimate_request_tokens([{"role": role, "content": content}], 0)
+    _message_token_counts[key] = count
+    if len(_message_token_counts) > MESSAGE_TOKENS_CACHE_SIZE:
+        _message_token_counts.popitem(last=False)
+    return count
+
+
+@dataclass
+class PromptPlan:
+    messages: List[dict]  # kept history (after an optional summary) + latest turn
+    fixed_tokens: int  # system/developer prompts
+    history_tokens: int  # kept history, summary included
+    original_history_tokens: int
+    latest_tokens: int
+    reference_tokens: int  # what is left for the reference block
+    dropped: int  # history messages not sent verbatim
+    summarized: bool
+
+
+class PromptBudget:
+    """
+    Splits `total_tokens` of model input between fixed prompts, conversation
+    history, the latest turn and references.
+
+    History gets at most `history_tokens`, and less if that would leave the
+    references under `min_reference_tokens`. The newest turns are kept whole;
+    older ones are dropped, or with overflow="summarize" replaced by one
+    message quoting the first sentence of each (at most `summary_tokens`),
+    which costs no model call. The latest user turn is always sent as is.
+    Tokens are counted locally (see chunker.get_tokenizer).
+    """
+
+    def __init__(
+        self,
+        total_tokens: int = 6000,
+        history_tokens: int = 2500,
+        min_reference_tokens: int = 600,
+        summary_tokens: int = 200,
+        overflow: str = "summarize",
+    ):
+        self.total_tokens = total_tokens
+        self.history_tokens = history_tokens
+        self.min_reference_tokens = min_reference_tokens
+        self.summary_tokens = summary_tokens
+        self.overflow = overflow
+
+        self.requests = 0
+        self.dropped_messages = 0
+        self.summaries = 0
+        self.tokens_saved = 0
+
+    def plan(self, fixed: Sequence[dict], messages: List[dict]) -> PromptPlan:
+        latest_index = len(messages)
+        for i in range(len(messages) - 1, -1, -1):
+            if messages[i].get("role") == "user":
+                latest_index = i
+                break
+        history, latest = messages[:latest_index], messages[latest_index:]
+
+        fixed_tokens = sum(message_tokens(m) for m in fixed)
+        latest_tokens = sum(message_tokens(m) for m in latest)
+        counts = [message_tokens(m) for m in history]
+        allowance = min(
+            self.history_tokens,
+            self.total_tokens - fixed_tokens - latest_tokens - self.min_reference_tokens,
+        )
+
+        start = self._fit(counts, allowance)
+        summary: Optional[dict] = None
+        if start and self.overflow == "summarize":
+            start = self._fit(counts, allowance - self.summary_tokens)
+            summary = self._summarize(history[:start]) if start else None
+
+        kept = history[start:]
+        history_tokens = sum(counts[start:])
+        if summary is not None:
+            kept = [summary] + kept
+            history_tokens += message_tokens(summary)
+        if latest_tokens + fixed_tokens > self.total_tokens:
+            logger.warning(
+                f"[PromptBudget] Latest turn alone ({latest_tokens} tokens) "
+                f"exceeds the {self.total_tokens}-token budget"
+            )
+
+        return PromptPlan(
+            messages=kept + latest,
+            fixed_tokens=fixed_tokens,
+            history_tokens=history_tokens,
+            original_history_tokens=sum(counts),
+            latest_tokens=latest_tokens,
+            reference_tokens=max(
+                0, self.total_tokens - fixed_tokens - history_tokens - latest_tokens
+            ),
+            dropped=start,
+            summarized=summary is not None,
+        )
+
+    def reference_layout(self, count: int, budget: int) -> Tuple[int, int]:
+        """
+        How many references (best first) and how many snippet tokens each, so
+        the block fits `budget`. At least one reference is always kept.
+        """
+        for n in range(count, 0, -1):
+            snippet_tokens = (budget - n * REFERENCE_LINE_TOKENS) // n
+            if snippet_tokens >= MIN_SNIPPET_TOKENS:
+                return n, snippet_tokens
+        return min(count, 1), MIN_SNIPPET_TOKENS
+
+    def record(self, plan: PromptPlan, reference_tokens: int) -> None:
+        """
+        Log the per-turn breakdown and count what trimming saved.
+        """
+        saved = plan.original_history_tokens - plan.history_tokens
+        self.requests += 1
+        self.dropped_messages += plan.dropped
+        self.summaries += plan.summarized
+        self.tokens_saved += saved
+        total = (
+            plan.fixed_tokens + plan.history_tokens + plan.latest_tokens + reference_tokens
+        )
+        logger.info(
+            f"[PromptBudget] fixed={plan.fixed_tokens} "
+            f"history={plan.history_tokens}/{plan.original_history_tokens} "
+            f"(dropped={plan.dropped}, summarized={plan.summarized}) "
+            f"latest={plan.latest_tokens} references={reference_tokens} "
+            f"total={total}/{self.total_tokens} saved={saved}"
+        )
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "dropped_messages": self.dropped_messages,
+            "summaries": self.summaries,
+            "history_tokens_saved": self.tokens_saved,
+            "exact_tokens": get_tokenizer().exact,
+        }
+
+    @staticmethod
+    def _fit(counts: List[int], allowance: int) -> int:
+        """
+        Index of the oldest message kept when keeping the newest that fit.
+        """
+        used, start = 0, len(counts)
+        for i in range(len(counts) - 1, -1, -1):
+            if used + counts[i] > allowance:
+                break
+            used += counts[i]
+            start = i
+        return start
+
+    def _summarize(self, dropped: List[dict]) -> dict:
+        tokenizer = get_tokenizer()
+        header = "Earlier in this conversation (condensed):"
+        lines: List[str] = []
+        used = tokenizer.count(header)
+        for m in reversed(dropped):  # newest first, so those survive the cut
+            content = " ".join(str(m.get("content", "")).split())
+            if not content:
+                continue
+            first = _SENTENCE_END_RE.split(content, maxsplit=1)[0]
+            pieces = tokenizer.split(first, SUMMARY_LINE_TOKENS)
+            text = pieces[0] + ("..." if len(pieces) > 1 else "")
+            line = f"{'Q' if m.get('role') == 'user' else 'A'}: {text}"
+            cost = tokenizer.count(line)
+            if used + cost > self.summary_tokens:
+                break
+            lines.append(line)
+            used += cost
+        return {
+            "role": "developer",
+            "content": "\n".join([header] + lines[::-1]),
+        }
+
+
+_prompt_budget_instance: Optional[PromptBudget] = None
+
+
+def get_prompt_budget() -> PromptBudget:
+    global _prompt_budget_instance
+    if _prompt_budget_instance is None:
+        _prompt_budget_instance = PromptBudget(
+            total_tokens=config.get("prompt_token_budget", 6000),
+            history_tokens=config.get("history_token_budget", 2500),
+            min_reference_tokens=config.get("min_reference_tokens", 600),
+            summary_tokens=config.get("history_summary_tokens", 200),
+            overflow=config.get("history_overflow", "summarize"),
+        )
+    return _prompt_budget_instance
@@ -4,27 +4,268 @@
 
 import asyncio
 import logging
+import mmap
+import os
+import re
+import struct
+import threading
 import time
-from typing import Optional
+import zlib
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterable, Iterator, Mapping, Optional, Sequence, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no shared state, each worker limits on its own
+    fcntl = None
 
 import httpx
-import requests  # for demonstration only
 
+from server.chunker import get_tokenizer
 from server.configmanager import config
+from server.retrypolicy import full_jitter_backoff
 
 logger = logging.getLogger(__name__)
 
+# "1s", "6m0s", "20ms", "1h2m3.5s" as sent in x-ratelimit-reset-* headers
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+# Rough per-message overhead of the chat format, in tokens
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After / x-ratelimit-reset-* value into seconds.
+    """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * _DURATION_UNITS[unit] for n, unit in parts)
+
+
+def estimate_request_tokens(messages: Iterable[dict], max_output_tokens: int) -> int:
+    """
+    Tokens a request will be charged against the TPM quota: the prompt plus the
+    output allowance, which OpenAI reserves up front.
+    """
+    tokenizer = get_tokenizer()
+    prompt = sum(
+        tokenizer.count(str(m.get("content", ""))) + _MESSAGE_OVERHEAD_TOKENS
+        for m in messages
+    )
+    return prompt + max_output_tokens
+
+
+class TokenBucket:
+    """
+    Holds up to `capacity` units and refills continuously at `capacity` per
+    `window` seconds. The level may go negative when a request turns out to cost
+    more than was reserved; later callers then wait for the debt to refill.
+    """
+
+    _clock = staticmethod(time.monotonic)
+
+    def __init__(self, capacity: float, window: float = 60.0):
+        self.window = window
+        self.capacity = capacity
+        self.rate = capacity / window
+        self.level = capacity
+        self._updated = self._clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def time_until(self, amount: float) -> float:
+        """
+        Seconds until `amount` can be taken (0 if it can be taken now).
+        """
+        self._refill()
+        amount = min(amount, self.capacity)  # never wait forever on an oversize cost
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.level -= amount
+
+    def give_back(self, amount: float) -> None:
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+    def calibrate(self, limit: Optional[float], remaining: Optional[float]) -> None:
+        """
+        Adopt the server's view: its quota, and its remaining count if that is
+        lower than ours (other clients share the same key).
+        """
+        self._refill()
+        if limit and limit != self.capacity:
+            self.capacity = limit
+            self.rate = limit / self.window
+            self.level = min(self.level, limit)
+        if remaining is not None and remaining < self.level:
+            self.level = remaining
+
+
+class SharedState:
+    """
+    Limiter state in a small memory-mapped file, so every worker process on the
+    host sees the same 429 back-off and bucket levels.
+
+    Layout: an 8-byte magic, the CRC of the service names, then per service four
+    float64s (wait_until, level, updated, capacity). Reads are plain loads from
+    the mapping (get_limit() stays lock-free); read-modify-write sequences run
+    under locked(), an flock on the file plus a thread lock.
+    """
+
+    MAGIC = b"MBRL0001"
+    HEADER = struct.Struct("8sQ")
+    FIELDS = ("wait_until", "level", "updated", "capacity")
+
+    def __init__(self, path: str, services: Sequence[str]):
+        self.path = path
+        self._slots = {name: i for i, name in enumerate(sorted(services))}
+        layout = zlib.crc32(",".join(sorted(services)).encode("utf-8"))
+        size = self.HEADER.size + len(self._slots) * 8 * len(self.FIELDS)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._thread_lock = threading.Lock()
+        with self.locked():
+            if os.fstat(self._fd).st_size != size:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+            self._mm = mmap.mmap(self._fd, size)
+            if self.HEADER.unpack_from(self._mm, 0) != (self.MAGIC, layout):
+                self._mm[:] = bytes(size)
+                self.HEADER.pack_into(self._mm, 0, self.MAGIC, layout)
+
+    def __contains__(self, service: str) -> bool:
+        return service in self._slots
+
+    def _offset(self, service: str, field: str) -> int:
+        slot = self._slots[service] * len(self.FIELDS) + self.FIELDS.index(field)
+        return self.HEADER.size + slot * 8
+
+    def read(self, service: str, field: str) -> float:
+        return struct.unpack_from("d", self._mm, self._offset(service, field))[0]
+
+    def write(self, service: str, field: str, value: float) -> None:
+        struct.pack_into("d", self._mm, self._offset(service, field), value)
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        with self._thread_lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self) -> None:
+        self._mm.close()
+        os.close(self._fd)
+
+
+class SharedWaitUntil:
+    """
+    Dict-like view of the shared wait-until timestamps (what RateLimiter.wait_until
+    is when state is shared).
+    """
+
+    def __init__(self, state: SharedState):
+        self._state = state
+
+    def __contains__(self, service: str) -> bool:
+        return service in self._state
+
+    def __getitem__(self, service: str) -> float:
+        if service not in self._state:
+            raise KeyError(service)
+        return self._state.read(service, "wait_until")
+
+    def __setitem__(self, service: str, value: float) -> None:
+        self._state.write(service, "wait_until", value)
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    A TokenBucket whose level lives in SharedState. Uses wall-clock time, since
+    monotonic clocks aren't comparable across processes. Callers hold
+    state.locked() around every operation.
+    """
+
+    _clock = staticmethod(time.time)
+
+    def __init__(
+        self, state: SharedState, service: str, capacity: float, window: float
+    ):
+        self._state = state
+        self._service = service
+        self.window = window
+        if not self.capacity:  # first process to use this file
+            super().__init__(capacity, window)
+        elif self.capacity != capacity:  # quota changed since the file was made
+            self.calibrate(capacity, None)
+
+    def _field(name: str):
+        return property(
+            lambda self: self._state.read(self._service, name),
+            lambda self, value: self._state.write(self._service, name, value),
+        )
+
+    level = _field("level")
+    capacity = _field("capacity")
+    _updated = _field("updated")
+    del _field
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.window
+
+    @rate.setter
+    def rate(self, value: float) -> None:
+        pass  # derived from capacity
+
 
 class RateLimiter:
     """
     Keeps track of wait times for different services. After a 429, it sets a 'wait-until' time
     (the current time + wait duration) for the given service. Subsequent calls to 'get_limit()'
     return the remaining wait time if it has not elapsed yet, or 0 if no wait is needed.
+
+    Services with a configured quota (requests or tokens per minute) also get a
+    token bucket, and acquire() waits until every bucket it draws from has room, so
+    requests are paced under the quota instead of discovering it through 429s.
+    Waiters are served first come, first served.
+
+    With `state_path`, the wait-until times and buckets live in a shared
+    memory-mapped file, so all uvicorn workers on the host draw from one budget and
+    a 429 seen by one worker pauses them all.
     """
 
-    def __init__(self, default_wait_times: Optional[dict] = None):
+    def __init__(
+        self,
+        default_wait_times: Optional[dict] = None,
+        limits: Optional[Dict[str, float]] = None,
+        window: float = 60.0,
+        state_path: Optional[str] = None,
+    ):
         """
-        default_wait_times is expected to be a dictionary
+        default_wait_times is expected to be a dictionary;
+        limits maps a service to its quota per `window` seconds
         """
         # Fallback if user doesn't provide defaults
         defaults = {
@@ -42,29 +283,159 @@ class RateLimiter:
             "openai_requests": 0,
         }
 
+        self._shared: Optional[SharedState] = None
+        if state_path and fcntl is None:
+            logger.warning("[RateLimiter] Shared state needs fcntl, using local state")
+        elif state_path:
+            try:
+                self._shared = SharedState(state_path, list(self.wait_until))
+            except OSError as e:
+                logger.error(f"[RateLimiter] Could not open {state_path}: {e}")
+
+        quotas = {service: quota for service, quota in (limits or {}).items() if quota}
+        self.buckets: Dict[str, TokenBucket] = {}
+        if self._shared is not None:
+            self.wait_until = SharedWaitUntil(self._shared)
+            with self._shared.locked():
+                for service, quota in quotas.items():
+                    self.buckets[service] = SharedTokenBucket(
+                        self._shared, service, quota, window
+                    )
+            logger.info(f"[RateLimiter] Sharing limiter state through {state_path}")
+        else:
+            for service, quota in quotas.items():
+                self.buckets[service] = TokenBucket(quota, window)
+        # One FIFO queue per combination of services drawn from
+        self._queues: Dict[Tuple[str, ...], asyncio.Lock] = {}
+
+        self.acquired = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+        self.rate_limited = 0
+
+    async def acquire(self, costs: Mapping[str, float]) -> float:
+        """
+        Wait until every service in `costs` has room (and no 429 cool-down is
+        active), then reserve the costs. Returns the seconds spent waiting.
+        """
+        for service in costs:
+            if service not in self.wait_until:
+                raise ValueError(f"Unknown service '{service}'")
+
+        key = tuple(sorted(costs))
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = asyncio.Lock()
+
+        start = time.monotonic()
+        async with queue:
+            while True:
+                # Check and reserve in one step so other workers can't interleave
+                with self._locked():
+                    delay = self._delay_for(costs)
+                    if delay <= 0:
+                        for service, amount in costs.items():
+                            bucket = self.buckets.get(service)
+                            if bucket is not None:
+                                bucket.take(amount)
+                        break
+                await asyncio.sleep(delay)
+
+        waited = time.monotonic() - start
+        self.acquired += 1
+        if waited > 0.001:
+            self.throttled += 1
+            self.wait_seconds += waited
+            logger.debug(f"[RateLimiter] Waited {waited:.3f}s for {dict(costs)}")
+        return waited
+
+    def settle(self, service: str, reserved: float, actual: Optional[float]) -> None:
+        """
+        Correct a reservation once the real cost is known (e.g. from usage).
+        """
+        bucket = self.buckets.get(service)
+        if bucket is None or actual is None:
+            return
+        with self._locked():
+            if actual < reserved:
+                bucket.give_back(reserved - actual)
+            elif actual > reserved:
+                bucket.take(actual - reserved)
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """
+        Calibrate the OpenAI buckets from x-ratelimit-limit-* / x-ratelimit-remaining-*.
+        """
+        for kind, service in (
+            ("requests", "openai_requests"),
+            ("tokens", "openai_tokens"),
+        ):
+            bucket = self.buckets.get(service)
+            if bucket is None:
+                continue
+            try:
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                with self._locked():
+                    bucket.calibrate(
+                        float(limit) if limit else None,
+                        float(remaining) if remaining else None,
+                    )
+            except ValueError:
+                logger.debug(f"[RateLimiter] Unparseable {kind} rate-limit headers")
+
+    def _locked(self):
+        return self._shared.locked() if self._shared is not None else nullcontext()
+
+    def _delay_for(self, costs: Mapping[str, float]) -> float:
+        now = time.time()
+        delay = 0.0
+        for service, amount in costs.items():
+            delay = max(delay, self.wait_until[service] - now)
+            bucket = self.buckets.get(service)
+            if bucket is not None:
+                delay = max(delay, bucket.time_until(amount))
+        return delay
+
     async def limit(
-        self, service: str, response: Optional[httpx.Response] = None
+        self,
+        service: str,
+        response: Optional[httpx.Response] = None,
+        attempt: int = 0,
     ) -> None:
         """
         If a 429 is received, set the next valid request time for the service
-        using the Retry-After header or a default if that's missing.
+        using the Retry-After header, or exponential backoff with full jitter
+        (capped at the service's default wait) if the server gave no hint.
+        `attempt` counts consecutive 429s for this request, starting at 0.
         """
         logger.error(f"ALERT: Rate limit exceeded for service '{service}'")
         if service not in self.wait_until:
             raise ValueError(f"Unknown service '{service}'")
+        self.rate_limited += 1
 
-        # Either the 'Retry-After' header or the default for that service
+        # Either the 'Retry-After' header, the quota reset time or a backoff
+        wait_time = None
         if response is not None:
-            retry_after = response.headers.get("Retry-After")
-            wait_time = (
-                int(retry_after) if retry_after else self.default_wait_times[service]
+            wait_time = parse_duration(response.headers.get("Retry-After"))
+            if wait_time is None:
+                wait_time = parse_duration(
+                    response.headers.get("x-ratelimit-reset-requests")
+                )
+            self.update_from_headers(response.headers)
+        if wait_time is None:
+            wait_time = full_jitter_backoff(
+                attempt,
+                config.get("retry_base_delay", 0.5),
+                self.default_wait_times[service],
             )
-        else:
-            # Default 15 seconds of wait time.
-            wait_time = 15
 
-        # Record the future time after which requests can resume
-        self.wait_until[service] = time.time() + wait_time
+        # Record the future time after which requests can resume (never moving an
+        # existing back-off earlier; another worker may have set a longer one)
+        with self._locked():
+            self.wait_until[service] = max(
+                self.wait_until[service], time.time() + wait_time
+            )
 
     async def get_limit(self, service: str) -> int:
         """
@@ -80,6 +451,29 @@ class RateLimiter:
             return int(wait_time_remaining)
         return 0
 
+    def stats(self) -> dict:
+        with self._locked():
+            buckets = {
+                service: {
+                    "capacity": bucket.capacity,
+                    "level": round(bucket.level, 1),
+                }
+                for service, bucket in self.buckets.items()
+            }
+        return {
+            "shared": self._shared is not None,
+            "acquired": self.acquired,
+            "throttled": self.throttled,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "rate_limited": self.rate_limited,
+            "buckets": buckets,
+        }
+
+    def close(self) -> None:
+        if self._shared is not None:
+            self._shared.close()
+            self._shared = None
+
 
 _rate_limiter_instance = None
 
@@ -88,5 +482,12 @@ def get_ratelimiter() -> RateLimiter:
 
     global _rate_limiter_instance
     if _rate_limiter_instance is None:
-        _rate_limiter_instance = RateLimiter(config.get("DEFAULT_WAIT_TIMES"))
+        _rate_limiter_instance = RateLimiter(
+            config.get("DEFAULT_WAIT_TIMES"),
+            limits={
+                "openai_requests": config.get("openai_requests_per_minute", 500),
+                "openai_tokens": config.get("openai_tokens_per_minute", 200000),
+            },
+            state_path=config.get("rate_limiter_state_path") or None,
+        )
     return _rate_limiter_instance
@@ -0,0 +1,243 @@
+# reranker.py
+# Rerank retrieved candidates on CPU so fewer, better snippets reach the prompt:
+# a small ONNX cross-encoder when one is configured, a feature scorer otherwise.
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from server.configmanager import config
+from server.lexicalindex import exact_terms, tokenize
+
+logger = logging.getLogger(__name__)
+
+
+class FeatureScorer:
+    """
+    Scores (query, candidate) pairs from cheap features, all in [0, 1]:
+      - the retrieval score (cosine similarity or fused rank score),
+      - the share of query terms that occur in the snippet or its section,
+      - the share of the query's exact terms (section numbers, R-values) found.
+    Snippets of only a few words (a lone heading) are halved. Scoring a batch of
+    ten 400-token candidates takes well under a millisecond.
+    """
+
+    name = "features"
+
+    def score(self, query: str, candidates: Sequence[dict]) -> np.ndarray:
+        query_terms = set(tokenize(query))
+        exact = set(exact_terms(query).split())
+        scores = np.zeros(len(candidates), dtype=np.float32)
+        for i, match in enumerate(candidates):
+            meta = match.get("metadata", {})
+            text = meta.get("text", "")
+            # Substring tests (C speed) instead of tokenizing every snippet
+            haystack = f"{meta.get('section') or ''} {text}".lower()
+
+            retrieval = min(max(float(match.get("score", 0.0)), 0.0), 1.0)
+            coverage = (
+                sum(t in haystack for t in query_terms) / len(query_terms)
+                if query_terms
+                else 0.0
+            )
+            if exact:
+                found = sum(t in haystack for t in exact) / len(exact)
+                score = 0.5 * retrieval + 0.3 * coverage + 0.2 * found
+            else:
+                score = 0.6 * retrieval + 0.4 * coverage
+            if len(text.split()) < 15:
+                score *= 0.5
+            scores[i] = score
+        return scores
+
+
+class OnnxCrossEncoder:
+    """
+    A cross-encoder (e.g. an ms-marco MiniLM export) run with onnxruntime on
+    CPU. `model_dir` holds `model.onnx` and a Hugging Face `tokenizer.json`.
+    Each request's candidates go through the model as one padded batch.
+    Raises at construction if onnxruntime/tokenizers or the files are missing.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_dir: str, max_length: int = 256, threads: int = 1):
+        import onnxruntime
+        from tokenizers import Tokenizer as HFTokenizer
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self._session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, "model.onnx"),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self._input_names = {i.name for i in self._session.get_inputs()}
+        self._tokenizer = HFTokenizer.from_file(
+            os.path.join(model_dir, "tokenizer.json")
+        )
+        self._tokenizer.enable_truncation(max_length=max_length)
+        self._tokenizer.enable_padding()
+
+    def score(self, query: str, candidates: Sequence[dict]) -> np.ndarray:
+        encodings = self._tokenizer.encode_batch(
+            [(query, c.get("metadata", {}).get("text", "")) for c in candidates]
+        )
+        feeds = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array(
+                [e.attention_mask for e in encodings], dtype=np.int64
+            ),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        feeds = {k: v for k, v in feeds.items() if k in self._input_names}
+        logits = np.asarray(self._session.run(None, feeds)[0], dtype=np.float32)
+        return 1.0 / (1.0 + np.exp(-logits.reshape(len(candidates), -1)[:, 0]))
+
+
+class Reranker:
+    """
+    Reorders a request's candidates and keeps at most `top_n` of them, dropping
+    those scoring under `min_score` (the best one is always kept).
+
+    With a model, scoring runs on a single worker thread, so concurrent
+    requests queue for the CPU instead of oversubscribing it, and it must
+    finish within `budget_ms`. Past the budget, or on a model error, the
+    request falls back to the feature scorer. A timed-out call that hasn't
+    started is cancelled; one already running can't be stopped, so until it
+    finishes requests go straight to the feature scorer rather than queueing
+    behind abandoned work.
+    """
+
+    def __init__(
+        self,
+        model: Optional[OnnxCrossEncoder] = None,
+        budget_ms: float = 50.0,
+        min_score: float = 0.15,
+    ):
+        self.model = model
+        self.features = FeatureScorer()
+        self.budget = budget_ms / 1000.0
+        self.min_score = min_score
+        self._executor = (
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+            if model is not None
+            else None
+        )
+        # Last model call abandoned past the budget while still running
+        self._abandoned: Optional[Future] = None
+
+        self.calls = 0
+        self.fallbacks = 0
+        self.busy = 0  # fallbacks because an abandoned call was still running
+        self.dropped = 0
+        self._latencies = deque(maxlen=1024)
+
+    async def rerank(
+        self, query: str, candidates: List[dict], top_n: int
+    ) -> List[dict]:
+        if not candidates:
+            return []
+        start = time.perf_counter()
+        self.calls += 1
+        scores = None
+        if self.model is not None and self._model_busy():
+            self.fallbacks += 1
+            self.busy += 1
+        elif self.model is not None:
+            future = self._executor.submit(self.model.score, query, candidates)
+            try:
+                scores = await asyncio.wait_for(
+                    asyncio.wrap_future(future), timeout=self.budget
+                )
+            except asyncio.TimeoutError:
+                self.fallbacks += 1
+                if not future.cancel():
+                    self._abandoned = future  # already running
+                logger.warning(
+                    "[Reranker] Model over the %.0fms budget, using feature scores",
+                    self.budget * 1000,
+                )
+            except Exception as e:
+                self.fallbacks += 1
+                logger.error("[Reranker] Model failed, using feature scores: %r", e)
+        if scores is None:
+            scores = self.features.score(query, candidates)
+
+        order = np.argsort(-scores, kind="stable")
+        kept = [
+            dict(candidates[i], rerank_score=round(float(scores[i]), 4))
+            for rank, i in enumerate(order[:top_n])
+            if rank == 0 or scores[i] >= self.min_score
+        ]
+        self.dropped += len(candidates) - len(kept)
+        self._latencies.append(time.perf_counter() - start)
+        logger.debug(
+            "[Reranker] %d -> %d candidates in %.2fms",
+            len(candidates),
+            len(kept),
+            (time.perf_counter() - start) * 1000,
+        )
+        return kept
+
+    def _model_busy(self) -> bool:
+        if self._abandoned is None:
+            return False
+        if self._abandoned.done():
+            self._abandoned = None
+            return False
+        return True
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+        p95 = latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0
+        return {
+            "scorer": (self.model or self.features).name,
+            "calls": self.calls,
+            "fallbacks": self.fallbacks,
+            "busy": self.busy,
+            "dropped": self.dropped,
+            "p95_ms": round(p95 * 1000, 3),
+        }
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_reranker_instance: Optional[Reranker] = None
+
+
+def get_reranker() -> Reranker:
+    """
+    Uses the cross-encoder in `rerank_model_path` if it loads, else features.
+    """
+    global _reranker_instance
+    if _reranker_instance is None:
+        model = None
+        model_dir = config.get("rerank_model_path", "")
+        if model_dir:
+            try:
+                model = OnnxCrossEncoder(
+                    model_dir,
+                    max_length=config.get("rerank_max_length", 256),
+                    threads=config.get("rerank_threads", 1),
+                )
+                logger.info(f"[Reranker] Loaded cross-encoder from {model_dir}")
+            except Exception as e:
+                logger.warning(
+                    f"[Reranker] Cross-encoder unavailable ({e}), using feature scores"
+                )
+        _reranker_instance = Reranker(
+            model,
+            budget_ms=config.get("rerank_budget_ms", 50.0),
+            min_score=config.get("rerank_min_score", 0.15),
+        )
+    return _reranker_instance
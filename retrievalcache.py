@@ -0,0 +1,218 @@
+# retrievalcache.py
+# Retrieval result cache: reuse the references found for a recent, nearly
+# identical query vector instead of querying the index again.
+
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from server.configmanager import config
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedRetrieval:
+    references: List[dict]
+    references_block: str
+    similarity: float
+
+
+@dataclass
+class _Entry:
+    vector: np.ndarray
+    params: Tuple[Any, ...]  # (top_k, min_score, variant, options)
+    signature: Tuple[int, ...]
+    references: List[dict]
+    references_block: str
+    expires_at: float
+
+
+class RetrievalCache:
+    """
+    Maps a query vector (plus top_k, the score threshold, an optional variant
+    string and a tuple of the other settings that shape the result) to its
+    filtered matches and rendered reference block.
+
+    Keys are locality-sensitive: each vector is hashed against fixed random
+    hyperplanes into `num_tables` signatures of `bits_per_table` sign bits, and
+    vectors pointing in nearly the same direction share at least one signature
+    with high probability. A lookup gathers the entries in its buckets and
+    serves the most similar one whose cosine similarity clears
+    `min_similarity`, so paraphrased questions hit without scanning the whole
+    cache. The hyperplanes come from a fixed seed, so signatures are stable
+    across restarts and workers. Everything is dropped when the index version
+    changes.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 2048,
+        ttl: float = 600,
+        min_similarity: float = 0.95,
+        num_tables: int = 8,
+        bits_per_table: int = 12,
+        seed: int = 0,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.min_similarity = min_similarity
+        self.num_tables = num_tables
+        self.bits_per_table = bits_per_table
+        self.seed = seed
+        self.index_version: Optional[str] = None
+
+        self._planes: Optional[np.ndarray] = None  # allocated on first use
+        self._weights = 1 << np.arange(bits_per_table, dtype=np.int64)
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()  # LRU order
+        self._buckets: List[Dict[int, Set[int]]] = [{} for _ in range(num_tables)]
+        self._next_id = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalize(vector: Iterable[float]) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def signature(self, v: np.ndarray) -> Tuple[int, ...]:
+        if self._planes is None or self._planes.shape[1] != v.shape[0]:
+            if self._planes is not None:
+                self.clear()  # embedding model changed
+            rng = np.random.default_rng(self.seed)
+            self._planes = rng.standard_normal(
+                (self.num_tables * self.bits_per_table, v.shape[0])
+            ).astype(np.float32)
+        bits = (self._planes @ v > 0).reshape(self.num_tables, self.bits_per_table)
+        return tuple(int(code) for code in bits @ self._weights)
+
+    def sync_index_version(self, version: str) -> None:
+        """
+        Invalidate everything if the index was re-ingested since the last call.
+        """
+        if self.index_version is not None and version != self.index_version:
+            logger.info(
+                f"[RetrievalCache] Index version {self.index_version} -> {version}, clearing"
+            )
+            self.clear()
+        self.index_version = version
+
+    def get(
+        self,
+        query_vector: Iterable[float],
+        top_k: int,
+        min_score: float,
+        variant: str = "",
+        options: Tuple[Any, ...] = (),
+    ) -> Optional[CachedRetrieval]:
+        if not self._entries:
+            self.misses += 1
+            return None
+
+        v = self._normalize(query_vector)
+        signature = self.signature(v)
+        candidates: Set[int] = set()
+        for table, code in zip(self._buckets, signature):
+            candidates.update(table.get(code, ()))
+
+        params = (top_k, min_score, variant, options)
+        now = time.time()
+        best, best_score = None, self.min_similarity
+        for entry_id in candidates:
+            entry = self._entries[entry_id]
+            if entry.expires_at <= now:
+                self._evict(entry_id)
+                continue
+            if entry.params != params:
+                continue
+            score = float(entry.vector @ v)
+            if score >= best_score:
+                best, best_score = entry_id, score
+
+        if best is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(best)
+        self.hits += 1
+        entry = self._entries[best]
+        return CachedRetrieval(entry.references, entry.references_block, best_score)
+
+    def put(
+        self,
+        query_vector: Iterable[float],
+        top_k: int,
+        min_score: float,
+        references: List[dict],
+        references_block: str,
+        variant: str = "",
+        options: Tuple[Any, ...] = (),
+    ) -> None:
+        v = self._normalize(query_vector)
+        signature = self.signature(v)
+
+        while len(self._entries) >= self.max_entries:
+            self._evict(next(iter(self._entries)))
+            self.evictions += 1
+
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = _Entry(
+            vector=v,
+            params=(top_k, min_score, variant, options),
+            signature=signature,
+            references=references,
+            references_block=references_block,
+            expires_at=time.time() + self.ttl,
+        )
+        for table, code in zip(self._buckets, signature):
+            table.setdefault(code, set()).add(entry_id)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        for table in self._buckets:
+            table.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "index_version": self.index_version,
+        }
+
+    def _evict(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        for table, code in zip(self._buckets, entry.signature):
+            bucket = table.get(code)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del table[code]
+
+
+_retrieval_cache_instance: Optional[RetrievalCache] = None
+
+
+def get_retrieval_cache() -> RetrievalCache:
+    global _retrieval_cache_instance
+    if _retrieval_cache_instance is None:
+        _retrieval_cache_instance = RetrievalCache(
+            max_entries=config.get("retrieval_cache_max_entries", 2048),
+            ttl=config.get("retrieval_cache_ttl", 600),
+            min_similarity=config.get("retrieval_cache_min_similarity", 0.95),
+            num_tables=config.get("retrieval_cache_tables", 8),
+            bits_per_table=config.get("retrieval_cache_bits", 12),
+        )
+    return _retrieval_cache_instance
@@ -0,0 +1,253 @@
+# retrypolicy.py
+# Retry policy for upstream calls: error classification, exponential backoff
+# with full jitter, a per-request deadline, and optional hedged requests.
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+import httpx
+import openai
+
+from server.configmanager import config
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT = "rate_limit"
+TIMEOUT = "timeout"
+CONNECTION = "connection"
+SERVER = "server"
+FATAL = "fatal"
+
+RETRYABLE = frozenset({RATE_LIMIT, TIMEOUT, CONNECTION, SERVER})
+
+
+def classify(exc: BaseException) -> str:
+    """
+    Sort an upstream failure into a retry class. Anything unrecognized, and
+    4xx errors other than 429, are fatal (retrying won't help).
+    """
+    if isinstance(exc, openai.RateLimitError):
+        return RATE_LIMIT
+    if isinstance(exc, (openai.APITimeoutError, asyncio.TimeoutError)):
+        return TIMEOUT
+    if isinstance(exc, httpx.TimeoutException):
+        return TIMEOUT
+    if isinstance(exc, openai.APIConnectionError):
+        return CONNECTION
+    if isinstance(exc, (httpx.TransportError, ConnectionError)):
+        return CONNECTION
+    if isinstance(exc, openai.APIStatusError):
+        if exc.status_code == 429:
+            return RATE_LIMIT
+        if exc.status_code >= 500:
+            return SERVER
+    return FATAL
+
+
+def full_jitter_backoff(attempt: int, base: float, cap: float) -> float:
+    """
+    Random delay in [0, min(cap, base * 2**attempt)] ("full jitter"), so clients
+    that failed together don't retry together.
+    """
+    return random.uniform(0.0, min(cap, base * (2**attempt)))
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    from server.ratelimiter import parse_duration
+
+    return parse_duration(headers.get("Retry-After"))
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """
+    The request's time budget ran out before an attempt succeeded.
+    """
+
+
+class RetryPolicy:
+    """
+    Runs an async call up to `max_attempts` times within `deadline` seconds.
+
+    Each attempt is bounded by the time left in the deadline. Retryable failures
+    (see classify) wait full-jitter exponential backoff, or the server's
+    Retry-After for 429s, before the next attempt. No retry is started if its
+    delay would overrun the deadline. The last error is re-raised.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_attempts: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        deadline: float = 30.0,
+        retry_on: Set[str] = RETRYABLE,
+    ):
+        self.name = name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retry_on = retry_on
+
+        self.calls = 0
+        self.retries = 0
+        self.failures: Dict[str, int] = {}
+
+    async def run(
+        self,
+        call: Callable[[], Awaitable[Any]],
+        on_error: Optional[Callable[[BaseException, str, int], Awaitable]] = None,
+        deadline: Optional[float] = None,
+    ) -> Any:
+        """
+        `on_error(exc, kind, attempt)` is awaited after each failed attempt, e.g.
+        to record a 429 with the rate limiter.
+        """
+        self.calls += 1
+        expires = time.monotonic() + (deadline or self.deadline)
+        attempt = 0
+        while True:
+            remaining = expires - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise DeadlineExceeded(f"{self.name}: deadline exceeded")
+                return await asyncio.wait_for(call(), timeout=remaining)
+            except DeadlineExceeded:
+                self._count(TIMEOUT)
+                raise
+            except Exception as e:
+                kind = classify(e)
+                self._count(kind)
+                if on_error is not None:
+                    await on_error(e, kind, attempt)
+
+                attempt += 1
+                if kind not in self.retry_on or attempt >= self.max_attempts:
+                    raise
+                delay = full_jitter_backoff(
+                    attempt - 1, self.base_delay, self.max_delay
+                )
+                if kind == RATE_LIMIT:
+                    delay = max(delay, retry_after_seconds(e) or 0.0)
+                if time.monotonic() + delay >= expires:
+                    logger.warning(
+                        f"[RetryPolicy] {self.name}: no time left to retry ({kind})"
+                    )
+                    raise
+                logger.warning(
+                    f"[RetryPolicy] {self.name}: {kind} on attempt {attempt}, "
+                    f"retrying in {delay:.2f}s"
+                )
+                self.retries += 1
+                await asyncio.sleep(delay)
+
+    def _count(self, kind: str) -> None:
+        self.failures[kind] = self.failures.get(kind, 0) + 1
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+        }
+
+
+class Hedger:
+    """
+    Sends a second, identical request when the first is slower than the recent
+    p95 latency, and takes whichever finishes first. Meant for cheap, idempotent
+    calls (embeddings), where an occasional duplicate costs little and cuts the
+    latency tail. Hedging starts once `min_samples` latencies have been seen.
+    """
+
+    def __init__(self, name: str, quantile: float = 0.95, min_samples: int = 20):
+        self.name = name
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=256)
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def threshold(self) -> Optional[float]:
+        if len(self._latencies) < self.min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))]
+
+    async def run(self, call: Callable[[], Awaitable[Any]]) -> Any:
+        start = time.monotonic()
+        threshold = self.threshold()
+        first = asyncio.ensure_future(call())
+        if threshold is None:
+            result = await first
+            self._latencies.append(time.monotonic() - start)
+            return result
+
+        pending = {first}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=threshold)
+            if done:
+                self._latencies.append(time.monotonic() - start)
+                return first.result()
+
+            self.hedged += 1
+            second = asyncio.ensure_future(call())
+            pending = {first, second}
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedge_wins += 1
+                        self._latencies.append(time.monotonic() - start)
+                        return task.result()
+            # Both failed: surface the original request's error
+            if second.done():
+                second.exception()  # retrieved, so it isn't logged as unhandled
+            return first.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> dict:
+        threshold = self.threshold()
+        return {
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "threshold_ms": round(threshold * 1000, 1) if threshold else None,
+        }
+
+
+_retry_policies: Dict[str, RetryPolicy] = {}
+
+
+def get_retry_policy(name: str) -> RetryPolicy:
+    """
+    Policies are configured per call site: `<name>_deadline` plus the shared
+    MAX_ATTEMPTS, retry_base_delay and retry_max_delay.
+    """
+    policy = _retry_policies.get(name)
+    if policy is None:
+        policy = _retry_policies[name] = RetryPolicy(
+            name,
+            max_attempts=config.get("MAX_ATTEMPTS", 3),
+            base_delay=config.get("retry_base_delay", 0.5),
+            max_delay=config.get("retry_max_delay", 8.0),
+            deadline=config.get(f"{name}_deadline", 30.0),
+        )
+    return policy
+
+
+def retry_stats() -> dict:
+    return {name: policy.stats() for name, policy in _retry_policies.items()}
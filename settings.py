@@ -1,27 +1,156 @@
 # settings.py
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from pydantic import BaseModel, ConfigDict
+from typing import List, Dict, Optional
 
 
 class Settings(BaseModel):
-    environment: str = "development"
+    # Snapshots are shared between requests, so never mutated in place
+    model_config = ConfigDict(frozen=True)
+
+    ENVIRONMENT: str = "development"
     host: str = "0.0.0.0"
     port: int = 8000
     reload: bool = False
     ssl_certfile: str = ""
     ssl_keyfile: str = ""
     timeout_keep_alive: int = 5
+    config_reload_interval: float = 2.0  # config.json poll interval (s); 0 = off
+
+    # Logging: queued, written by a background thread; DEBUG records are sampled
+    log_level: str = "INFO"
+    log_format: str = "json"  # file format: "json" lines or "text"
+    log_file: str = "server/logs/server.log"
+    log_max_bytes: int = 10 * 1024 * 1024  # 0 = rotated externally (logrotate)
+    log_backup_count: int = 5
+    log_debug_sample_rate: float = 0.05
+    log_queue_size: int = 10000  # records beyond this are dropped, never waited on
+    log_per_process: bool = False  # pid in log/trace file names, for --workers N
 
+    # Tracing: per-request spans as OTLP/JSON lines; slow requests always logged
+    tracing_enabled: bool = True
+    trace_file: str = "server/logs/traces.jsonl"
+    trace_endpoint: str = ""  # OTLP/HTTP JSON collector, e.g. .../v1/traces
+    trace_sample_rate: float = 0.1  # of normal requests; slow/failed always kept
+    trace_slow_ms: float = 2000.0
+    trace_slow_log: str = "server/logs/slow_requests.jsonl"
+    trace_max_bytes: int = 50 * 1024 * 1024  # 0 = rotated externally
+    trace_exclude_paths: List[str] = ["/metrics"]
+
+    vector_backend: str = "pinecone"  # or "local"
+    local_index_path: str = "server/local_index"
     INDEX_NAME: str = "mauibuildingcode"
+    INDEX_VERSION_PATH: str = "server/index_version.json"
     pinecone_top_k: int = 3
+    pinecone_max_workers: int = 8
+    pinecone_max_concurrency: int = 8
+    pinecone_timeout: float = 10.0
+
+    # Hybrid retrieval: BM25 over the ingested chunks fused with vector matches
+    hybrid_retrieval: bool = True
+    lexical_index_path: str = "server/lexical_index"
+    lexical_retry_interval: float = 30.0  # wait after a failed index rebuild (s)
+    hybrid_candidates: int = 10  # per side, before fusion
+    hybrid_rrf_k: int = 60
+
+    # Rerank stage: fetch rerank_candidates, keep <= pinecone_top_k above min score
+    rerank_enabled: bool = True
+    rerank_candidates: int = 10
+    rerank_min_score: float = 0.15
+    rerank_budget_ms: float = 50.0
+    rerank_model_path: str = ""  # dir with model.onnx + tokenizer.json ("" = features)
+    rerank_max_length: int = 256
+    rerank_threads: int = 1
+
+    # Prompt token budget: history first (up to its share), then references
+    prompt_budget_enabled: bool = True
+    prompt_token_budget: int = 6000  # input tokens per model call
+    history_token_budget: int = 2500
+    min_reference_tokens: int = 600  # history shrinks before references go below
+    history_overflow: str = "summarize"  # or "drop"
+    history_summary_tokens: int = 200
+
+    embedding_model: str = "text-embedding-ada-002"
+    embedding_cache_max_entries: int = 10000
+    embedding_cache_max_mb: int = 64
+    embedding_cache_ttl: int = 7 * 24 * 3600
+    embedding_cache_path: str = ""
+    embedding_cache_warmup: List[str] = []
+
+    answer_cache_enabled: bool = True
+    answer_cache_max_entries: int = 512  # 0 = store nothing
+    answer_cache_ttl: int = 3600
+    answer_cache_min_similarity: float = 0.97
+
+    # Retrieval results keyed by an LSH of the query vector (+ top_k, threshold)
+    retrieval_cache_enabled: bool = True
+    retrieval_cache_max_entries: int = 2048
+    retrieval_cache_ttl: int = 600
+    retrieval_cache_min_similarity: float = 0.95
+    retrieval_cache_tables: int = 8
+    retrieval_cache_bits: int = 12
+
+    # Retrieval prefetch from the UI while the user types (/api/prefetch)
+    prefetch_enabled: bool = True
+    prefetch_ttl: float = 30.0
+    prefetch_max_sessions: int = 1000
+    prefetch_min_chars: int = 12
 
     model_name: str = "gpt-4.1-mini"
     max_tokens: int = 500
     temperature: float = 0.7
 
+    # Admission control: concurrency, queue length and max queue wait per gate
+    admission_api_concurrency: int = 32
+    admission_api_queue: int = 64
+    admission_api_max_wait: float = 5.0
+    admission_openai_concurrency: int = 16
+    admission_openai_queue: int = 64
+    admission_openai_max_wait: float = 10.0
+    admission_vector_concurrency: int = 16
+    admission_vector_queue: int = 64
+    admission_vector_max_wait: float = 2.0
+
+    # Per-client limits (by X-API-Key, else IP); 0 requests disables a rule
+    client_limit_api_requests: int = 30
+    client_limit_api_window: float = 60.0
+    client_limit_feedback_requests: int = 20
+    client_limit_feedback_window: float = 60.0
+    client_limit_prefetch_requests: int = 120
+    client_limit_prefetch_window: float = 60.0
+    client_limit_store_path: str = ""  # SQLite file shared by workers
+    client_limit_sync_interval: float = 1.0
+    client_limit_trust_forwarded: bool = False
+    client_api_keys: List[str] = []  # X-API-Key values with their own limits
+
+    # Proactive pacing under the OpenAI quota (calibrated from response headers)
+    openai_requests_per_minute: int = 500
+    openai_tokens_per_minute: int = 200000
+    # Memory-mapped limiter state shared by all workers on the host ("" = per process)
+    rate_limiter_state_path: str = "server/ratelimiter.state"
+
     use_responses_api: bool = True
     MAX_ATTEMPTS: int = 3
+    # Retry policy: full-jitter exponential backoff within a per-request deadline
+    retry_base_delay: float = 0.5
+    retry_max_delay: float = 8.0
+    generate_deadline: float = 45.0
+    embedding_deadline: float = 10.0
+    embedding_hedge: bool = True  # duplicate embedding calls slower than p95
     PINECONE_API_KEY: str = ""
     OPENAI_API_KEY: str = ""
     DATABASE_URL: str = ""
     MIN_SCORE_THRESHOLD: float = 0.5
+    # Fallback waits (seconds) per service after a 429 without Retry-After
+    DEFAULT_WAIT_TIMES: Optional[Dict[str, float]] = None
+
+    # Reference block rendering
+    repo_url: str = "https://github.com/username/repo/blob/main/"
+    MAX_SNIPPET_LEN: int = 300
+
+    # Pooled OpenAI HTTP client
+    openai_max_connections: int = 100
+    openai_max_keepalive: int = 20
+    openai_keepalive_expiry: float = 30.0
+    openai_timeout: float = 60.0
+    openai_connect_timeout: float = 5.0
+    openai_http2: bool = True
@@ -0,0 +1,19 @@
+# conftest.py
+# Makes the modules importable as the `server` package, whatever the checkout
+# directory is called, so tests can import them the way app.py does.
+
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if "server" not in sys.modules:
+    spec = importlib.util.spec_from_file_location(
+        "server",
+        os.path.join(ROOT, "__init__.py"),
+        submodule_search_locations=[ROOT],
+    )
+    package = importlib.util.module_from_spec(spec)
+    sys.modules["server"] = package
+    spec.loader.exec_module(package)
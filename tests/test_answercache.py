@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from server.answercache import AnswerCache, make_context_key
+
+
+def vector(seed: int, dim: int = 64) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+
+
+@pytest.fixture
+def cache():
+    return AnswerCache(max_entries=4, ttl=60, min_similarity=0.97)
+
+
+def test_context_key_is_stable_and_order_sensitive():
+    history = [{"role": "user", "content": "R402?"}]
+    assert make_context_key("gpt-4.1-mini", history) == make_context_key(
+        "gpt-4.1-mini", [dict(history[0])]
+    )
+    assert make_context_key("gpt-4.1-mini", history) != make_context_key(
+        "gpt-4.1", history
+    )
+    assert make_context_key("a", "b") != make_context_key("b", "a")
+
+
+def test_hit_needs_same_references_and_context(cache):
+    v = vector(1)
+    context = make_context_key("gpt-4.1-mini", [])
+    cache.put(v, ["r1", "r2"], context, "Use R-30.")
+    hit = cache.get(v * 2, ["r2", "r1"], context)  # scale and order don't matter
+    assert hit is not None
+    assert hit.answer == "Use R-30."
+    assert hit.similarity == pytest.approx(1.0)
+    assert cache.get(v, ["r1"], context) is None
+    assert cache.get(v, ["r1", "r2"], make_context_key("gpt-4.1", [])) is None
+
+
+def test_dissimilar_question_misses(cache):
+    cache.put(vector(1), ["r1"], "ctx", "answer")
+    assert cache.get(vector(2), ["r1"], "ctx") is None
+
+
+def test_expiry_and_index_version(cache):
+    v = vector(1)
+    cache.put(v, ["r1"], "ctx", "old", ttl=-1)
+    assert cache.get(v, ["r1"], "ctx") is None
+    cache.sync_index_version("a")
+    cache.put(v, ["r1"], "ctx", "answer")
+    cache.sync_index_version("b")
+    assert cache.get(v, ["r1"], "ctx") is None
+
+
+def test_lru_eviction_reuses_slots(cache):
+    vectors = [vector(i) for i in range(5)]
+    for i, v in enumerate(vectors):
+        cache.put(v, ["r1"], "ctx", str(i))
+    assert cache.get(vectors[0], ["r1"], "ctx") is None
+    assert cache.get(vectors[4], ["r1"], "ctx").answer == "4"
+    assert cache.evictions == 1
+
+
+@pytest.mark.parametrize("max_entries", [0, -1])
+def test_non_positive_max_entries_disables_storing(max_entries):
+    cache = AnswerCache(max_entries=max_entries)
+    v = vector(1)
+    cache.put(v, ["r1"], "ctx", "answer")
+    assert cache.get(v, ["r1"], "ctx") is None
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,138 @@
+import random
+
+import pytest
+
+from server.chunker import Chunker, Tokenizer, heading_section
+
+# One token per word, so line sizes are easy to control
+WORDS = Tokenizer(encoding_name=None)
+
+
+def words(n: int, word: str = "insulation") -> str:
+    return " ".join([word] * n)
+
+
+def chunker(max_tokens=100, overlap_tokens=30, min_tokens=10) -> Chunker:
+    return Chunker(max_tokens, overlap_tokens, min_tokens, tokenizer=WORDS)
+
+
+@pytest.mark.parametrize(
+    "line, section",
+    [
+        ("R402.4.1.2 Testing. The building or dwelling unit must be", "R402.4.1.2"),
+        ("C406.10.1. Baseline percentage electric vehicle readiness", "C406.10.1"),
+        ("R401.3. Certificate (Mandatory) A permanent certificate", "R401.3"),
+        ("R401.2.1 Tropical zone, Residential buildings in the", "R401.2.1"),
+        ("C405.10 Solar-readiness (Mandatory). New commercial", "C405.10"),
+        ("R402.2 Specific insulation requirements", "R402.2"),
+        ("101.1 Title. This code shall be known as the Energy", "101.1"),
+        ("Section 16.26.010 Definitions.", "16.26.010"),
+        ("SECTION R407", "R407"),
+        ("  N1102.1 General", "N1102.1"),
+    ],
+)
+def test_heading_lines(line, section):
+    assert heading_section(line) == section
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        # decimals and exception list items
+        "1.071 X Federal Minimum SEER 1 1",
+        "0.64; or",
+        "1.1 Those with a peak design rate of energy usage less",
+        # references that open a wrapped line of running text
+        "R402.1.2, based on the climate zone specified in Chapter 3.",
+        "R401.3 of the Hawaii State Energy Code is amended to read as",
+        "R301.1 and Table R201.1.",
+        "C401.2(1) ANSI/ASHRAE/IESNA 90.1",
+        "R102.1 (Alternative)",
+        "Section 101.1 is amended to read as follows:",
+        "C406.2.",
+        "R406.",
+        # too long, or cut off mid-phrase
+        "C402.1 Roof assemblies with insulation entirely above the deck and "
+        "those with attic spaces",
+        "R404.1 Lighting equipment and",
+        "C403.1 Mechanical systems: the following",
+        "Plain text with R402.1 in the middle.",
+    ],
+)
+def test_non_heading_lines(line):
+    assert heading_section(line) is None
+
+
+def test_overlap_is_trimmed_so_chunks_stay_within_max_tokens():
+    # 50+20+20, then a 90-token line: the carried 20-token line must not stay
+    text = "\n".join(words(n, f"w{i}") for i, n in enumerate([50, 20, 20, 90]))
+    chunks = list(chunker().chunk_pages([(1, text)]))
+    assert [c.token_count for c in chunks] == [90, 90]
+    assert chunks[1].start_line == 4
+
+
+def test_split_carries_overlap_lines():
+    text = "\n".join(words(n, f"w{i}") for i, n in enumerate([50, 20, 20, 25]))
+    first, second = chunker().chunk_pages([(1, text)])
+    assert (first.start_line, first.end_line) == (1, 3)
+    assert (second.start_line, second.end_line) == (3, 4)  # line 3 repeated
+    assert second.text.startswith(words(20, "w2"))
+
+
+def test_random_documents_never_exceed_max_tokens():
+    rng = random.Random(0)
+    pages = [
+        (page, "\n".join(words(rng.randint(1, 100)) for _ in range(20)))
+        for page in range(1, 11)
+    ]
+    chunks = list(chunker().chunk_pages(pages))
+    assert all(c.token_count <= 100 for c in chunks)
+    assert all(WORDS.count(c.text) <= 100 for c in chunks)
+    assert any(a.end_line >= b.start_line for a, b in zip(chunks, chunks[1:]))
+
+
+def test_chunk_spans_a_page_break_with_document_line_numbers():
+    pages = [(7, "first line here\n\nsecond line"), (8, "third line\nfourth")]
+    [chunk] = chunker().chunk_pages(pages)
+    assert (chunk.page_number, chunk.end_page) == (7, 8)
+    assert (chunk.start_line, chunk.end_line) == (1, 5)  # blank line 2 skipped
+    assert chunk.text == "first line here\nsecond line\nthird line\nfourth"
+
+
+def test_page_numbers_follow_the_lines_of_each_chunk():
+    pages = [(1, words(60)), (2, words(60)), (3, words(60))]
+    chunks = list(chunker(overlap_tokens=0).chunk_pages(pages))
+    assert [(c.page_number, c.end_page) for c in chunks] == [(1, 1), (2, 2), (3, 3)]
+    assert [(c.start_line, c.end_line) for c in chunks] == [(1, 1), (2, 2), (3, 3)]
+
+
+def test_heading_closes_a_chunk_that_reached_min_tokens():
+    text = "\n".join(
+        [
+            "R401.1 General",
+            words(12),
+            "R401.2 Scope",  # 16 tokens so far: closes the chunk
+            words(3),
+            "R401.3 Certificate",  # 8 tokens: below min_tokens, stays
+            words(3),
+        ]
+    )
+    first, second = chunker(min_tokens=10).chunk_pages([(1, text)])
+    assert (first.section, first.start_line, first.end_line) == ("R401.1", 1, 2)
+    assert (second.section, second.start_line, second.end_line) == ("R401.2", 3, 6)
+
+
+def test_chunk_without_a_heading_keeps_the_open_section():
+    text = "\n".join(["R402.1 General", words(80), words(80)])
+    first, second = chunker(overlap_tokens=0).chunk_pages([(1, text)])
+    assert first.section == second.section == "R402.1"
+
+
+def test_oversize_line_is_split_into_max_token_pieces():
+    text = "R402.4 Air leakage. " + words(246) + "\nnext line"
+    chunks = list(chunker(overlap_tokens=0).chunk_pages([(3, text)]))
+    assert [c.token_count for c in chunks] == [100, 100, 54]
+    assert all((c.start_line, c.page_number) == (1, 3) for c in chunks[:2])
+    assert chunks[-1].end_line == 2
+    assert chunks[0].text.startswith("R402.4 Air leakage.")
+    assert {c.section for c in chunks} == {"R402.4"}
@@ -0,0 +1,52 @@
+import uuid
+
+from server.clientlimits import ClientLimiter
+
+NOW = 1_000_040.0  # 20s into a 60s window
+
+
+def limiter(**kwargs) -> ClientLimiter:
+    return ClientLimiter({"api": (3, 60.0)}, **kwargs)
+
+
+def test_rotating_unknown_keys_counts_against_the_ip():
+    limits = limiter(api_keys=["issued-key"])
+    results = [
+        limits.hit("api", limits.client_key(uuid.uuid4().hex, "203.0.113.7"), NOW)
+        for _ in range(5)
+    ]
+    assert [r.allowed for r in results] == [True, True, True, False, False]
+    assert limits.stats()["clients"] == 1
+
+
+def test_issued_key_gets_its_own_bucket():
+    limits = limiter(api_keys=["issued-key"])
+    key = limits.client_key("issued-key", "203.0.113.7")
+    assert key.startswith("key:") and "issued-key" not in key
+    for _ in range(3):
+        limits.hit("api", limits.client_key(None, "203.0.113.7"), NOW)
+    assert limits.hit("api", key, NOW).allowed
+    assert not limits.hit("api", limits.client_key("other", "203.0.113.7"), NOW).allowed
+
+
+def test_without_issued_keys_every_client_is_keyed_by_ip():
+    limits = limiter()
+    assert limits.client_key("anything", "198.51.100.1") == "ip:198.51.100.1"
+    assert limits.client_key(None, None) == "ip:unknown"
+
+
+def test_sliding_window_weights_the_previous_window():
+    limits = limiter()
+    for _ in range(3):
+        assert limits.hit("api", "ip:a", NOW).allowed
+    result = limits.hit("api", "ip:a", NOW)
+    assert not result.allowed
+    assert result.retry_after == 40  # until the window ends
+    # 30s into the next window half of the previous count still applies
+    assert limits.hit("api", "ip:a", NOW + 70).allowed
+    assert not limits.hit("api", "ip:a", NOW + 70).allowed
+
+
+def test_disabled_rule_allows_everything():
+    limits = ClientLimiter({"api": (0, 60.0)})
+    assert all(limits.hit("api", "ip:a", NOW).allowed for _ in range(100))
@@ -0,0 +1,58 @@
+import json
+import threading
+
+from server.configmanager import ConfigManager
+
+
+def make_manager(tmp_path, **values) -> ConfigManager:
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({"port": 8000, **values}))
+    return ConfigManager(config_file_path=str(path))
+
+
+def test_rejected_value_leaves_raw_config_and_snapshot(tmp_path):
+    manager = make_manager(tmp_path)
+    version = manager.version
+
+    manager.set("port", "not-a-port")
+    manager.set_temp("port", "still-not-a-port")
+
+    assert manager.raw_config["port"] == 8000
+    assert manager.get("port") == 8000
+    assert manager.version == version
+    assert "port" not in manager._env_config
+
+    manager.set_temp("port", 9000)
+    assert manager.raw_config["port"] == 9000
+    assert manager.get("port") == 9000
+
+
+def test_reload_keeps_concurrent_set_temp(tmp_path):
+    manager = make_manager(tmp_path)
+    path = tmp_path / "config.json"
+    stop = threading.Event()
+    errors = []
+
+    def reload_loop():
+        n = 0
+        while not stop.is_set():
+            n += 1
+            path.write_text(json.dumps({"port": 8000, "log_queue_size": n}))
+            try:
+                manager.reload_if_changed()
+            except RuntimeError as e:  # dict changed size during iteration
+                errors.append(e)
+
+    thread = threading.Thread(target=reload_loop)
+    thread.start()
+    try:
+        for i in range(2000):
+            manager.set_temp(f"extra_{i}", i)
+    finally:
+        stop.set()
+        thread.join()
+    manager._file_signature = (0, 0)
+    manager.reload_if_changed()
+
+    assert errors == []
+    assert all(manager.raw_config[f"extra_{i}"] == i for i in range(2000))
@@ -0,0 +1,111 @@
+import time
+
+import pytest
+
+from server.lexicalindex import (
+    BM25Index,
+    LexicalStore,
+    exact_terms,
+    reciprocal_rank_fusion,
+    tokenize,
+)
+
+DOCS = {
+    "insulation": "R402.1.2 Insulation and fenestration criteria for the "
+    "building thermal envelope. Ceiling insulation R-30.",
+    "ceiling-fans": "R404.2 Ceiling fans. A ceiling fan or rough-in shall be "
+    "provided for bedrooms and the largest space.",
+    "solar": "R403.5.5 Solar water heating. Solar water heating systems shall "
+    "be installed in new dwellings.",
+    "doors": "C403.2.3 Door switches. Opaque and glass doors opening to the "
+    "outdoors shall have switches.",
+}
+
+
+@pytest.fixture(scope="module")
+def index():
+    ids = list(DOCS)
+    return BM25Index(ids, DOCS.values(), [{"name": i} for i in ids])
+
+
+def test_tokenize_expands_sections_and_hyphens():
+    terms = tokenize("What is R602.10.1 for a rough-in?")
+    assert terms[:3] == ["r602.10.1", "r602.10", "r602"]
+    assert "rough-in" in terms and "rough" in terms
+    assert "what" not in terms and "is" not in terms
+
+
+def test_exact_terms_keeps_only_terms_with_digits():
+    assert exact_terms("Ceiling R-30 in R402.1?") == "r-30 r402.1"
+    assert exact_terms("ceiling insulation") == ""
+
+
+def test_bm25_ranks_the_matching_chunk_first(index):
+    results = index.search("solar water heating", 3)
+    assert results[0]["id"] == "solar"
+    assert results[0]["metadata"] == {"name": "solar"}
+    assert all(r["score"] > 0 for r in results)
+
+
+def test_bm25_section_prefix_matches_subsections(index):
+    assert index.search("R403", 2)[0]["id"] == "solar"
+    assert index.search("R402.1", 2)[0]["id"] == "insulation"
+
+
+def test_bm25_repeated_terms_score_higher(index):
+    results = index.search("ceiling", 4)
+    assert [r["id"] for r in results] == ["ceiling-fans", "insulation"]
+    assert results[0]["score"] > results[1]["score"]
+
+
+def test_bm25_top_k_and_no_match(index):
+    assert len(index.search("shall", 1)) == 1
+    assert index.search("skylight", 3) == []
+    assert BM25Index([], [], []).search("ceiling", 3) == []
+
+
+def test_rrf_prefers_documents_ranked_in_both_lists():
+    vector = [{"id": "a", "score": 0.9}, {"id": "b", "score": 0.8}]
+    lexical = [{"id": "b", "score": 12.0}, {"id": "c", "score": 3.0}]
+    fused = reciprocal_rank_fusion([vector, lexical], k=60)
+    assert [m["id"] for m in fused] == ["b", "a", "c"]
+    assert fused[0]["score"] == pytest.approx((1 / 62 + 1 / 61) / (2 / 61))
+
+
+def test_rrf_first_in_every_list_scores_one():
+    ranking = [{"id": "a", "score": 0.5}, {"id": "b", "score": 0.4}]
+    fused = reciprocal_rank_fusion([ranking, ranking])
+    assert fused[0]["id"] == "a"
+    assert fused[0]["score"] == pytest.approx(1.0)
+    assert ranking[0]["score"] == 0.5  # inputs aren't modified
+
+
+def wait_for_refresh(store: LexicalStore) -> None:
+    deadline = time.monotonic() + 5
+    while store._refreshing and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+
+def test_failed_rebuild_waits_for_the_retry_interval(tmp_path, monkeypatch):
+    writer = LexicalStore(str(tmp_path))
+    writer.upsert([("a", DOCS["solar"], {"filename": "a.pdf"})])
+    writer.save()
+
+    builds = []
+
+    def failing_build(records):
+        builds.append(len(records))
+        raise MemoryError("no room")
+
+    store = LexicalStore(str(tmp_path), retry_interval=0.2)
+    monkeypatch.setattr(LexicalStore, "_build_index", staticmethod(failing_build))
+    for _ in range(5):
+        assert store.search("solar", 3) == []
+        wait_for_refresh(store)
+    assert len(builds) == 1
+
+    monkeypatch.undo()
+    time.sleep(0.25)
+    store.search("solar", 3)  # past the interval: rebuilt
+    wait_for_refresh(store)
+    assert store.search("solar", 3)[0]["id"] == "a"
@@ -0,0 +1,115 @@
+import asyncio
+
+import httpx
+import pytest
+
+from server import openaiclient
+from server.configmanager import config
+from server.tracing import Span, Trace, use_span
+
+
+def run_traced(coro_fn):
+    """
+    Run `coro_fn()` inside a traced request; returns the result and its spans.
+    """
+    trace = Trace("a" * 32, "req-1")
+    root = Span(trace, "POST /api")
+
+    async def main():
+        with use_span(root):
+            try:
+                return await coro_fn()
+            except Exception as e:
+                return e
+
+    return asyncio.run(main()), trace.spans[1:]
+
+
+def traced_client(handler) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        transport=openaiclient.TracingTransport(httpx.MockTransport(handler)),
+        event_hooks={
+            "request": [openaiclient.trace_request],
+            "response": [openaiclient.trace_response],
+        },
+    )
+
+
+def test_client_uses_one_pooled_transport_without_sdk_retries():
+    client = openaiclient.build_openai_client(api_key="test")
+    http_client = client._client
+    pool = http_client._transport._transport._pool
+    assert client.max_retries == 0  # retrypolicy owns retries
+    assert pool._max_connections == config.get("openai_max_connections", 100)
+    assert pool._max_keepalive_connections == config.get("openai_max_keepalive", 20)
+    assert http_client.timeout.connect == config.get("openai_connect_timeout", 5.0)
+    asyncio.run(client.close())
+
+
+def test_shared_client_is_created_once_and_closed(monkeypatch):
+    build = openaiclient.build_openai_client
+    built = []
+
+    def build_once():
+        built.append(build(api_key="test"))
+        return built[-1]
+
+    monkeypatch.setattr(openaiclient, "build_openai_client", build_once)
+    monkeypatch.setattr(openaiclient, "_openai_client_instance", None)
+
+    first = openaiclient.get_openai_client()
+    assert openaiclient.get_openai_client() is first
+    assert len(built) == 1
+
+    asyncio.run(openaiclient.close_openai_client())
+    assert first.is_closed()
+    assert openaiclient._openai_client_instance is None
+
+
+def test_client_span_forwards_request_id_and_records_status():
+    seen = {}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.update(request.headers)
+        return httpx.Response(200, headers={"x-request-id": "upstream-1"})
+
+    async def call():
+        async with traced_client(handler) as client:
+            return await client.post("https://api.example.test/v1/embeddings")
+
+    response, spans = run_traced(call)
+    assert response.status_code == 200
+    [span] = spans
+    assert span.name == "POST api.example.test/v1/embeddings"
+    assert span.end_ns is not None and span.error is None
+    assert span.attributes["http.status_code"] == 200
+    assert span.attributes["openai.request_id"] == "upstream-1"
+    assert seen["x-request-id"] == "req-1"
+    assert seen["traceparent"] == span.traceparent()
+
+
+@pytest.mark.parametrize(
+    "error", [httpx.ConnectError("refused"), httpx.ReadTimeout("slow")]
+)
+def test_client_span_ends_when_the_call_fails_before_a_response(error):
+    def handler(request: httpx.Request) -> httpx.Response:
+        raise error
+
+    async def call():
+        async with traced_client(handler) as client:
+            return await client.post("https://api.example.test/v1/embeddings")
+
+    raised, spans = run_traced(call)
+    assert raised is error
+    [span] = spans
+    assert span.end_ns is not None
+    assert span.error == type(error).__name__
+
+
+def test_client_span_records_http_errors():
+    async def call():
+        async with traced_client(lambda request: httpx.Response(503)) as client:
+            return await client.post("https://api.example.test/v1/embeddings")
+
+    _, [span] = run_traced(call)
+    assert span.error == "HTTP 503"
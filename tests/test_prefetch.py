@@ -0,0 +1,105 @@
+import asyncio
+
+from server.prefetch import PrefetchCache
+
+
+async def pending_task() -> asyncio.Task:
+    task = asyncio.ensure_future(asyncio.sleep(10))
+    await asyncio.sleep(0)
+    return task
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_get_matches_normalized_text_only():
+    async def main():
+        cache = PrefetchCache()
+        task = await pending_task()
+        cache.put("s1", "What is  R402?", task)
+        assert cache.get("s1", "what is r402?") is task
+        assert cache.get("s1", "What is R403?") is None
+        assert cache.get("s2", "What is R402?") is None
+        task.cancel()
+        return cache.stats()
+
+    stats = run(main())
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+
+
+def test_replacing_an_unclaimed_prefetch_cancels_it():
+    async def main():
+        cache = PrefetchCache()
+        old, new = await pending_task(), await pending_task()
+        cache.put("s1", "draft", old)
+        cache.put("s1", "draft question", new)
+        await asyncio.sleep(0)
+        assert old.cancelled()
+        assert cache.get("s1", "draft question") is new
+        new.cancel()
+
+    run(main())
+
+
+def test_claimed_prefetch_survives_replacement_and_eviction():
+    async def main():
+        cache = PrefetchCache(max_sessions=1)
+        claimed = await pending_task()
+        cache.put("s1", "question", claimed)
+        assert cache.get("s1", "question") is claimed  # a request awaits it
+
+        cache.put("s1", "next draft", await pending_task())  # replaced
+        cache.put("s2", "other", await pending_task())  # s1 evicted
+        await asyncio.sleep(0)
+        assert not claimed.cancelled()
+        claimed.cancel()
+
+    run(main())
+
+
+def test_lru_session_eviction_cancels_unclaimed():
+    async def main():
+        cache = PrefetchCache(max_sessions=2)
+        tasks = [await pending_task() for _ in range(3)]
+        for i, task in enumerate(tasks):
+            cache.put(f"s{i}", "draft", task)
+        await asyncio.sleep(0)
+        assert tasks[0].cancelled()
+        assert cache.stats()["sessions"] == 2
+        for task in tasks[1:]:
+            task.cancel()
+
+    run(main())
+
+
+def test_expired_prefetch_is_cancelled_unless_claimed():
+    async def main():
+        cache = PrefetchCache(ttl=0.01)
+        expired, claimed = await pending_task(), await pending_task()
+        cache.put("s1", "draft", expired)
+        cache.put("s2", "draft", claimed)
+        assert cache.get("s2", "draft") is claimed
+        await asyncio.sleep(0.02)
+
+        assert cache.get("s1", "draft") is None
+        assert cache.get("s2", "draft") is None
+        await asyncio.sleep(0)
+        assert expired.cancelled()
+        assert not claimed.cancelled()
+        claimed.cancel()
+
+    run(main())
+
+
+def test_cancelled_prefetch_is_not_served():
+    async def main():
+        cache = PrefetchCache()
+        task = await pending_task()
+        cache.put("s1", "draft", task)
+        task.cancel()
+        await asyncio.sleep(0)
+        assert cache.get("s1", "draft") is None
+
+    run(main())
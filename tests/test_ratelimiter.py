@@ -0,0 +1,107 @@
+import asyncio
+
+import httpx
+import pytest
+
+from server.ratelimiter import RateLimiter, TokenBucket, parse_duration
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(TokenBucket, "_clock", staticmethod(fake))
+    return fake
+
+
+def test_bucket_starts_full_and_refills_at_capacity_per_window(clock):
+    bucket = TokenBucket(60, window=60.0)
+    assert bucket.time_until(60) == 0.0
+    bucket.take(60)
+    assert bucket.time_until(1) == pytest.approx(1.0)
+    clock.now += 30
+    assert bucket.level == pytest.approx(0.0)  # refilled lazily
+    assert bucket.time_until(30) == 0.0
+    clock.now += 1000
+    bucket.time_until(1)
+    assert bucket.level == 60  # never above capacity
+
+
+def test_bucket_debt_delays_later_callers(clock):
+    bucket = TokenBucket(10, window=10.0)
+    bucket.take(15)  # the request cost more than was reserved
+    assert bucket.level == pytest.approx(-5.0)
+    assert bucket.time_until(1) == pytest.approx(6.0)
+
+
+def test_oversize_cost_waits_for_a_full_bucket_only(clock):
+    bucket = TokenBucket(10, window=10.0)
+    bucket.take(10)
+    assert bucket.time_until(1000) == pytest.approx(10.0)
+
+
+def test_give_back_is_capped_at_capacity(clock):
+    bucket = TokenBucket(10)
+    bucket.take(4)
+    bucket.give_back(100)
+    assert bucket.level == 10
+
+
+def test_calibrate_adopts_server_quota_and_lower_remaining(clock):
+    bucket = TokenBucket(100, window=60.0)
+    bucket.calibrate(limit=50, remaining=20)
+    assert bucket.capacity == 50
+    assert bucket.rate == pytest.approx(50 / 60.0)
+    assert bucket.level == 20
+    bucket.calibrate(limit=None, remaining=40)  # higher than ours: ignored
+    assert bucket.level == 20
+
+
+def test_acquire_paces_requests_under_the_quota():
+    limiter = RateLimiter(limits={"openai_requests": 2}, window=0.2)
+
+    async def main():
+        waits = []
+        for _ in range(3):
+            waits.append(await limiter.acquire({"openai_requests": 1}))
+        return waits
+
+    waits = asyncio.run(main())
+    assert waits[0] == pytest.approx(0.0, abs=0.005)
+    assert waits[1] == pytest.approx(0.0, abs=0.005)
+    assert waits[2] == pytest.approx(0.1, abs=0.05)  # one unit refills in 0.1s
+    assert limiter.throttled == 1
+
+
+def test_settle_returns_unused_reservation(clock):
+    limiter = RateLimiter(limits={"openai_tokens": 1000})
+    asyncio.run(limiter.acquire({"openai_tokens": 800}))
+    limiter.settle("openai_tokens", reserved=800, actual=300)
+    assert limiter.buckets["openai_tokens"].level == pytest.approx(700)
+
+
+def test_acquire_rejects_unknown_services():
+    with pytest.raises(ValueError):
+        asyncio.run(RateLimiter().acquire({"nope": 1}))
+
+
+def test_limit_honours_retry_after():
+    limiter = RateLimiter()
+    response = httpx.Response(429, headers={"Retry-After": "30"})
+    asyncio.run(limiter.limit("openai_requests", response))
+    assert 28 <= asyncio.run(limiter.get_limit("openai_requests")) <= 30
+
+
+@pytest.mark.parametrize(
+    "value, seconds",
+    [("1s", 1.0), ("6m0s", 360.0), ("20ms", 0.02), ("1h2m3.5s", 3723.5), ("7", 7.0)],
+)
+def test_parse_duration(value, seconds):
+    assert parse_duration(value) == pytest.approx(seconds)
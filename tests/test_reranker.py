@@ -0,0 +1,71 @@
+import asyncio
+import threading
+
+import numpy as np
+
+from server.reranker import FeatureScorer, Reranker
+
+
+def candidate(id_: str, score: float, text: str, section: str = "") -> dict:
+    return {"id": id_, "score": score, "metadata": {"text": text, "section": section}}
+
+
+LONG = "The building thermal envelope shall meet the insulation requirements " * 3
+CANDIDATES = [
+    candidate("a", 0.80, LONG),
+    candidate("b", 0.78, "R402.1.2 ceiling insulation R-30 " + LONG, "R402.1.2"),
+    candidate("c", 0.10, "unrelated short heading"),
+]
+
+
+class SlowModel:
+    """
+    Scores by candidate order, after blocking until `release` is set.
+    """
+
+    name = "slow"
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = 0
+
+    def score(self, query, candidates):
+        self.calls += 1
+        self.release.wait(5)
+        return np.arange(len(candidates), 0, -1, dtype=np.float32)
+
+
+def test_feature_scorer_prefers_exact_term_matches():
+    scores = FeatureScorer().score("R402.1.2 ceiling insulation", CANDIDATES)
+    assert scores[1] > scores[0] > scores[2]
+
+
+def test_rerank_keeps_top_n_above_min_score():
+    reranker = Reranker(min_score=0.3)
+    kept = asyncio.run(reranker.rerank("R402.1.2 ceiling insulation", CANDIDATES, 3))
+    assert [c["id"] for c in kept] == ["b", "a"]
+    assert all("rerank_score" in c for c in kept)
+    assert reranker.dropped == 1
+
+
+def test_rerank_falls_back_without_queueing_behind_an_abandoned_call():
+    model = SlowModel()
+    reranker = Reranker(model, budget_ms=20)
+
+    async def main():
+        first = await reranker.rerank("insulation", CANDIDATES, 3)  # times out
+        second = await reranker.rerank("insulation", CANDIDATES, 3)  # model busy
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first == second  # both from the feature scorer
+    assert model.calls == 1  # the second request didn't submit
+    assert reranker.stats()["fallbacks"] == 2
+    assert reranker.stats()["busy"] == 1
+
+    model.release.set()
+    reranker._abandoned.result(timeout=5)
+    kept = asyncio.run(reranker.rerank("insulation", CANDIDATES, 3))
+    assert [c["id"] for c in kept] == ["a", "b", "c"]  # model scores again
+    assert model.calls == 2
+    reranker.close()
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from server.retrievalcache import RetrievalCache
+
+REFERENCES = [{"id": "R402.1", "score": 0.9}]
+
+
+def vector(seed: int, dim: int = 64) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+
+
+def nudge(v: np.ndarray, amount: float = 0.01) -> np.ndarray:
+    return v + amount * np.linalg.norm(v) * vector(99, len(v)) / np.sqrt(len(v))
+
+
+@pytest.fixture
+def cache():
+    return RetrievalCache(max_entries=8, ttl=60, min_similarity=0.95)
+
+
+def test_near_duplicate_vector_hits(cache):
+    v = vector(1)
+    cache.put(v, 3, 0.5, REFERENCES, "[1] R402.1")
+    hit = cache.get(nudge(v), 3, 0.5)
+    assert hit is not None
+    assert hit.references == REFERENCES
+    assert hit.references_block == "[1] R402.1"
+    assert hit.similarity >= 0.95
+
+
+def test_unrelated_vector_misses(cache):
+    cache.put(vector(1), 3, 0.5, REFERENCES, "[1]")
+    assert cache.get(vector(2), 3, 0.5) is None
+
+
+@pytest.mark.parametrize(
+    "top_k, min_score, variant, options",
+    [
+        (5, 0.5, "", ()),
+        (3, 0.6, "", ()),
+        (3, 0.5, "r402.1", ()),
+        (3, 0.5, "", (True, 20, False, None, 500, "https://example.test")),
+    ],
+)
+def test_key_covers_params_variant_and_options(
+    cache, top_k, min_score, variant, options
+):
+    v = vector(1)
+    cache.put(v, 3, 0.5, REFERENCES, "[1]")
+    assert cache.get(v, top_k, min_score, variant, options) is None
+    assert cache.get(v, 3, 0.5) is not None
+
+
+def test_same_options_hit(cache):
+    v = vector(1)
+    options = (False, None, True, (20, 60), 500, "https://example.test")
+    cache.put(v, 3, 0.5, REFERENCES, "[1]", "r402.1", options)
+    assert cache.get(v, 3, 0.5, "r402.1", options) is not None
+
+
+def test_index_version_change_clears(cache):
+    v = vector(1)
+    cache.sync_index_version("a")
+    cache.put(v, 3, 0.5, REFERENCES, "[1]")
+    cache.sync_index_version("a")
+    assert cache.get(v, 3, 0.5) is not None
+    cache.sync_index_version("b")
+    assert cache.get(v, 3, 0.5) is None
+
+
+def test_expired_entries_miss(cache):
+    cache.ttl = -1
+    v = vector(1)
+    cache.put(v, 3, 0.5, REFERENCES, "[1]")
+    assert cache.get(v, 3, 0.5) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_lru_eviction(cache):
+    vectors = [vector(i) for i in range(9)]
+    for v in vectors:
+        cache.put(v, 3, 0.5, REFERENCES, "[1]")
+    assert cache.get(vectors[0], 3, 0.5) is None
+    assert cache.get(vectors[8], 3, 0.5) is not None
+    assert cache.evictions == 1
@@ -0,0 +1,165 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from server.retrypolicy import (
+    CONNECTION,
+    FATAL,
+    RATE_LIMIT,
+    SERVER,
+    DeadlineExceeded,
+    Hedger,
+    RetryPolicy,
+    classify,
+)
+
+
+def status_error(cls, status: int, headers=None):
+    request = httpx.Request("POST", "https://api.example.test/v1/embeddings")
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    return cls("upstream error", response=response, body=None)
+
+
+class Flaky:
+    """
+    Raises the given errors in order, then returns "ok".
+    """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def test_classify():
+    assert classify(status_error(openai.RateLimitError, 429)) == RATE_LIMIT
+    assert classify(status_error(openai.InternalServerError, 503)) == SERVER
+    assert classify(status_error(openai.BadRequestError, 400)) == FATAL
+    assert classify(httpx.ConnectError("refused")) == CONNECTION
+    assert classify(ValueError("bug")) == FATAL
+
+
+def test_retries_retryable_errors_until_success():
+    policy = RetryPolicy("test", max_attempts=3, base_delay=0.001, max_delay=0.001)
+    call = Flaky(httpx.ConnectError("refused"), httpx.ReadTimeout("slow"))
+    assert asyncio.run(policy.run(call)) == "ok"
+    assert call.calls == 3
+    assert policy.retries == 2
+    assert policy.failures == {"connection": 1, "timeout": 1}
+
+
+def test_fatal_errors_are_not_retried():
+    policy = RetryPolicy("test", base_delay=0.001)
+    call = Flaky(status_error(openai.BadRequestError, 400))
+    with pytest.raises(openai.BadRequestError):
+        asyncio.run(policy.run(call))
+    assert call.calls == 1
+    assert policy.retries == 0
+
+
+def test_gives_up_after_max_attempts():
+    policy = RetryPolicy("test", max_attempts=2, base_delay=0.001, max_delay=0.001)
+    call = Flaky(*[httpx.ConnectError("refused")] * 3)
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(policy.run(call))
+    assert call.calls == 2
+
+
+def test_on_error_sees_every_failure():
+    seen = []
+
+    async def on_error(exc, kind, attempt):
+        seen.append((kind, attempt))
+
+    policy = RetryPolicy("test", base_delay=0.001, max_delay=0.001)
+    call = Flaky(status_error(openai.InternalServerError, 500))
+    asyncio.run(policy.run(call, on_error=on_error))
+    assert seen == [(SERVER, 0)]
+
+
+def test_retry_after_that_overruns_the_deadline_is_not_waited_for():
+    policy = RetryPolicy("test", base_delay=0.001, deadline=0.5)
+    call = Flaky(status_error(openai.RateLimitError, 429, {"Retry-After": "5"}))
+    with pytest.raises(openai.RateLimitError):
+        asyncio.run(policy.run(call))
+    assert call.calls == 1
+
+
+def test_slow_attempt_is_cut_off_at_the_deadline():
+    async def slow():
+        await asyncio.sleep(1)
+
+    policy = RetryPolicy("test", max_attempts=1, deadline=0.05)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(policy.run(slow))
+    assert policy.failures == {"timeout": 1}
+
+
+def test_deadline_exceeded_is_a_timeout():
+    assert issubclass(DeadlineExceeded, asyncio.TimeoutError)
+
+
+def test_hedger_waits_for_enough_samples():
+    hedger = Hedger("test", min_samples=3)
+
+    async def fast():
+        return "ok"
+
+    async def main():
+        for _ in range(2):
+            await hedger.run(fast)
+
+    asyncio.run(main())
+    assert hedger.threshold() is None
+    assert hedger.hedged == 0
+
+
+def test_hedger_sends_a_second_request_past_the_threshold():
+    hedger = Hedger("test", min_samples=3)
+    delays = [0.0, 0.0, 0.0, 0.5, 0.0]  # fourth call hangs, its hedge doesn't
+    cancelled = []
+
+    async def call():
+        delay = delays.pop(0)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(delay)
+            raise
+        return delay
+
+    async def main():
+        for _ in range(3):
+            await hedger.run(call)
+        return await hedger.run(call)
+
+    assert asyncio.run(main()) == 0.0
+    assert hedger.hedged == 1
+    assert hedger.hedge_wins == 1
+    assert cancelled == [0.5]  # the slow original is cancelled
+
+
+def test_hedger_raises_the_original_error_when_both_fail():
+    hedger = Hedger("test", min_samples=1)
+    errors = [None, ValueError("first"), KeyError("second")]
+
+    async def call():
+        error = errors.pop(0)
+        if error is None:
+            return "ok"
+        await asyncio.sleep(0.05)
+        raise error
+
+    async def main():
+        await hedger.run(call)
+        await hedger.run(call)
+
+    with pytest.raises(ValueError):
+        asyncio.run(main())
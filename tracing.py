@@ -0,0 +1,578 @@
+# tracing.py
+# Per-request tracing. Every request gets an ID (the caller's X-Request-ID or a
+# new one) held in a contextvar, spans time the stages run under it, and the
+# finished trace is written by a background thread as an OTLP/JSON line (and
+# optionally POSTed to an OTLP/HTTP collector). Requests slower than
+# trace_slow_ms also go to a slow-request log with their span breakdown.
+
+import functools
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from server.configmanager import config
+
+logger = logging.getLogger(__name__)
+
+# OTLP span kinds
+INTERNAL = 1
+SERVER = 2
+CLIENT = 3
+
+SERVICE_NAME = "maui-building-code"
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+_TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+def process_path(path: str, per_process: bool) -> str:
+    """
+    `path` with this process's pid before the extension when `per_process`
+    ("logs/traces.jsonl" -> "logs/traces.12345.jsonl"), so uvicorn workers
+    each append to and rotate their own file instead of racing on one.
+    """
+    if not path or not per_process:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{os.getpid()}{ext}"
+
+
+class Trace:
+    __slots__ = ("trace_id", "request_id", "spans", "closed")
+
+    def __init__(self, trace_id: str, request_id: str):
+        self.trace_id = trace_id
+        self.request_id = request_id
+        self.spans: List[Span] = []
+        self.closed = False
+
+
+# Parent of spans started outside a traced request; never exported
+_UNTRACED = Trace("0" * 32, "")
+_UNTRACED.closed = True
+
+
+class Span:
+    """
+    One timed operation. Spans started after their trace was exported (a
+    background task outliving its request) are timed but not recorded.
+    """
+
+    __slots__ = (
+        "trace",
+        "span_id",
+        "parent_id",
+        "name",
+        "kind",
+        "start_ns",
+        "end_ns",
+        "attributes",
+        "error",
+    )
+
+    def __init__(
+        self,
+        trace: Trace,
+        name: str,
+        parent_id: str = "",
+        kind: int = INTERNAL,
+        attributes: Optional[dict] = None,
+    ):
+        self.trace = trace
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes or {}
+        self.error: Optional[str] = None
+        if not trace.closed:
+            trace.spans.append(self)
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def end(self, error: Optional[str] = None) -> None:
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self.error = error
+
+    def child(self, name: str, kind: int = INTERNAL, **attributes) -> "Span":
+        return Span(self.trace, name, self.span_id, kind, attributes)
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace.trace_id}-{self.span_id}-01"
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+
+#####################
+# Instrumentation helpers (no-ops outside a traced request)
+#####################
+@contextmanager
+def span(name: str, kind: int = INTERNAL, **attributes) -> Iterator[Optional[Span]]:
+    """
+    `with span("rerank", candidates=10):` times the block as a child of the
+    current span; spans started inside it become its children.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    current = parent.child(name, kind, **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(error=type(e).__name__)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+def traced(name: str):
+    """
+    Decorator running an async function inside `span(name)`.
+    """
+
+    def decorate(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+@contextmanager
+def use_span(current: Span) -> Iterator[None]:
+    """
+    Make a span from start_span() current for a block, without ending it.
+    """
+    token = _current_span.set(current)
+    try:
+        yield
+    finally:
+        _current_span.reset(token)
+
+
+def start_span(name: str, kind: int = INTERNAL, **attributes) -> Span:
+    """
+    A child of the current span that the caller ends itself, without becoming
+    the current span (for async generators and httpx event hooks). Outside a
+    traced request the span is not recorded.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return Span(_UNTRACED, name, "", kind, attributes)
+    return parent.child(name, kind, **attributes)
+
+
+def annotate(**attributes) -> None:
+    """
+    Add attributes to the current span, if any.
+    """
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    Stamps records logged while handling a request with its request_id (a
+    field in JSON logs, `request_id=...` in text logs).
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        request_id = _request_id.get()
+        if request_id is not None and not hasattr(record, "request_id"):
+            record.request_id = request_id
+        return True
+
+
+#####################
+# Export
+#####################
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(s: Span, end_ns: int) -> dict:
+    return {
+        "traceId": s.trace.trace_id,
+        "spanId": s.span_id,
+        "parentSpanId": s.parent_id,
+        "name": s.name,
+        "kind": s.kind,
+        "startTimeUnixNano": str(s.start_ns),
+        "endTimeUnixNano": str(s.end_ns if s.end_ns is not None else end_ns),
+        "attributes": [
+            {"key": k, "value": _otlp_value(v)} for k, v in s.attributes.items()
+        ],
+        "status": _otlp_status(s),
+    }
+
+
+def _otlp_status(s: Span) -> dict:
+    if s.error:
+        return {"code": 2, "message": s.error}
+    if s.end_ns is None:
+        return {"code": 2, "message": "not finished"}
+    return {"code": 1}
+
+
+def otlp_payload(traces: Sequence[Tuple[Trace, List[Span]]]) -> dict:
+    """
+    An OTLP/JSON ExportTraceServiceRequest, as accepted at /v1/traces.
+    """
+    spans = []
+    for trace, trace_spans in traces:
+        end_ns = trace_spans[0].end_ns or time.time_ns()
+        spans.extend(_otlp_span(s, end_ns) for s in trace_spans)
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        {"key": "service.name", "value": {"stringValue": SERVICE_NAME}}
+                    ]
+                },
+                "scopeSpans": [{"scope": {"name": "server.tracing"}, "spans": spans}],
+            }
+        ]
+    }
+
+
+def slow_entry(trace: Trace, spans: List[Span]) -> dict:
+    """
+    Slow-request log line: the request, its total and each span's offset and
+    duration in milliseconds, in start order.
+    """
+    root = spans[0]
+    return {
+        "ts": round(root.start_ns / 1e9, 3),
+        "request_id": trace.request_id,
+        "trace_id": trace.trace_id,
+        "name": root.name,
+        "status": root.attributes.get("http.status_code"),
+        "duration_ms": round(root.duration_ms, 1),
+        "spans": [
+            {
+                "name": s.name,
+                "start_ms": round((s.start_ns - root.start_ns) / 1e6, 1),
+                "duration_ms": round(s.duration_ms, 1),
+                **({"error": s.error} if s.error else {}),
+                **({"attributes": s.attributes} if s.attributes else {}),
+            }
+            for s in sorted(spans[1:], key=lambda s: s.start_ns)
+        ],
+    }
+
+
+class TraceExporter:
+    """
+    Serializes and writes finished traces on a daemon thread so requests only
+    pay for a queue put. Files are appended one JSON object per line and
+    rotated to `<file>.1` past `max_bytes` (0 leaves rotation to an external
+    tool; each write reopens the file). The size check and rename aren't
+    coordinated across processes, so several workers need per-process file
+    names (`process_path`). With an `endpoint`, each batch of
+    traces is also POSTed there as OTLP/JSON. A full queue drops the trace.
+    """
+
+    def __init__(
+        self,
+        trace_file: str = "",
+        slow_log: str = "",
+        endpoint: str = "",
+        max_bytes: int = 50 * 1024 * 1024,
+        queue_size: int = 1000,
+    ):
+        self.trace_file = trace_file
+        self.slow_log = slow_log
+        self.endpoint = endpoint
+        self.max_bytes = max_bytes
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._http = None
+
+        self.exported = 0
+        self.dropped = 0
+        self.export_errors = 0
+
+    def submit(self, trace: Trace, spans: List[Span], slow: bool, keep: bool) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="trace-export", daemon=True
+            )
+            self._thread.start()
+        try:
+            self._queue.put_nowait((trace, spans, slow, keep))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout: float = 2.0) -> None:
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+        if self._http is not None:
+            self._http.close()
+            self._http = None
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 100:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            batch = [item for item in batch if item is not None]
+            try:
+                self._write(batch)
+            except Exception as e:
+                self.export_errors += 1
+                logger.warning(f"[tracing] Export failed: {e!r}")
+            if stop:
+                return
+
+    def _write(self, batch) -> None:
+        kept = [(trace, spans) for trace, spans, _, keep in batch if keep]
+        slow = [slow_entry(trace, spans) for trace, spans, slow, _ in batch if slow]
+        if self.slow_log and slow:
+            self._append(self.slow_log, [json.dumps(e, default=str) for e in slow])
+        if not kept:
+            return
+        if self.trace_file:
+            self._append(
+                self.trace_file,
+                [json.dumps(otlp_payload([t]), default=str) for t in kept],
+            )
+        if self.endpoint:
+            self._post(otlp_payload(kept))
+        self.exported += len(kept)
+
+    def _append(self, path: str, lines: List[str]) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        try:
+            if self.max_bytes > 0 and os.path.getsize(path) > self.max_bytes:
+                os.replace(path, f"{path}.1")
+        except FileNotFoundError:
+            pass
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def _post(self, payload: dict) -> None:
+        import httpx
+
+        if self._http is None:
+            self._http = httpx.Client(timeout=2.0)
+        response = self._http.post(self.endpoint, json=payload)
+        response.raise_for_status()
+
+
+class Tracer:
+    """
+    Starts and finishes request traces. Every trace is timed; which are
+    exported is decided when the request ends: slow (>= `slow_ms`) and failed
+    (5xx or an errored span) requests always, the rest at `sample_rate`.
+    """
+
+    def __init__(
+        self,
+        exporter: TraceExporter,
+        enabled: bool = True,
+        sample_rate: float = 0.1,
+        slow_ms: float = 2000.0,
+        exclude_paths: Sequence[str] = ("/metrics",),
+    ):
+        self.exporter = exporter
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.exclude_paths = frozenset(exclude_paths)
+
+        self.requests = 0
+        self.slow = 0
+        self.failed = 0
+        self.sampled_out = 0
+        self._slowest = deque(maxlen=20)
+
+    def start(
+        self,
+        name: str,
+        request_id: str,
+        traceparent: Optional[str] = None,
+        **attributes,
+    ) -> Span:
+        """
+        Root span for a request, continuing the caller's W3C trace if a valid
+        `traceparent` came in.
+        """
+        parent_id = ""
+        match = _TRACEPARENT_RE.match(traceparent or "")
+        if match:
+            trace_id, parent_id = match.groups()
+        else:
+            trace_id = _new_id(128)
+        attributes["request.id"] = request_id
+        return Span(Trace(trace_id, request_id), name, parent_id, SERVER, attributes)
+
+    def finish(self, root: Span) -> None:
+        root.end()
+        trace = root.trace
+        trace.closed = True
+        spans = list(trace.spans)
+        duration_ms = root.duration_ms
+        slow = duration_ms >= self.slow_ms
+        failed = root.attributes.get("http.status_code", 200) >= 500 or any(
+            s.error for s in spans
+        )
+
+        self.requests += 1
+        self.slow += slow
+        self.failed += failed
+        if slow:
+            self._slowest.append((round(duration_ms, 1), trace.request_id, root.name))
+            logger.warning(
+                f"[tracing] Slow request {root.name} took {duration_ms:.0f}ms "
+                f"(trace {trace.trace_id})"
+            )
+        keep = slow or failed or random.random() < self.sample_rate
+        if not keep:
+            self.sampled_out += 1
+        if keep or slow:
+            self.exporter.submit(trace, spans, slow, keep)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "requests": self.requests,
+            "slow": self.slow,
+            "failed": self.failed,
+            "sampled_out": self.sampled_out,
+            "exported": self.exporter.exported,
+            "dropped": self.exporter.dropped,
+            "export_errors": self.exporter.export_errors,
+            "slowest_recent": [
+                {"duration_ms": d, "request_id": r, "name": n}
+                for d, r, n in sorted(self._slowest, reverse=True)[:5]
+            ],
+        }
+
+    def close(self) -> None:
+        self.exporter.close()
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware that wraps each HTTP request in a trace, including the
+    body of streamed responses. The request ID comes from X-Request-ID when it
+    is a sane token (else a new one) and is echoed in the response headers.
+    """
+
+    def __init__(self, app, tracer: Optional[Tracer] = None):
+        self.app = app
+        self.tracer = tracer or get_tracer()
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or not self.tracer.enabled
+            or scope["path"] in self.tracer.exclude_paths
+        ):
+            return await self.app(scope, receive, send)
+
+        headers: Dict[bytes, bytes] = dict(scope["headers"])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")
+        if not _REQUEST_ID_RE.match(request_id):
+            request_id = uuid.uuid4().hex
+        root = self.tracer.start(
+            f"{scope['method']} {scope['path']}",
+            request_id,
+            headers.get(b"traceparent", b"").decode("latin-1"),
+            **{"http.method": scope["method"], "http.route": scope["path"]},
+        )
+        request_token = _request_id.set(request_id)
+        span_token = _current_span.set(root)
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                root.set(**{"http.status_code": message["status"]})
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-request-id", request_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        except BaseException as e:
+            root.end(error=type(e).__name__)
+            root.attributes.setdefault("http.status_code", 500)
+            raise
+        finally:
+            self.tracer.finish(root)
+            _current_span.reset(span_token)
+            _request_id.reset(request_token)
+
+
+_tracer_instance: Optional[Tracer] = None
+
+
+def get_tracer() -> Tracer:
+    global _tracer_instance
+    if _tracer_instance is None:
+        per_process = config.get("log_per_process", False)
+        _tracer_instance = Tracer(
+            TraceExporter(
+                trace_file=process_path(
+                    config.get("trace_file", "server/logs/traces.jsonl"), per_process
+                ),
+                slow_log=process_path(
+                    config.get("trace_slow_log", "server/logs/slow_requests.jsonl"),
+                    per_process,
+                ),
+                endpoint=config.get("trace_endpoint", ""),
+                max_bytes=config.get("trace_max_bytes", 50 * 1024 * 1024),
+            ),
+            enabled=config.get("tracing_enabled", True),
+            sample_rate=config.get("trace_sample_rate", 0.1),
+            slow_ms=config.get("trace_slow_ms", 2000.0),
+            exclude_paths=config.get("trace_exclude_paths", ["/metrics"]),
+        )
+    return _tracer_instance
@@ -0,0 +1,328 @@
+# vectorstore.py
+# Retrieval backends for reference lookup: hosted Pinecone or a local in-process index.
+
+import asyncio
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from server.configmanager import config
+
+logger = logging.getLogger(__name__)
+
+# (id, vector, metadata), the same tuples Pinecone's upsert takes
+VectorRecord = Tuple[str, Sequence[float], Dict[str, Any]]
+
+
+class VectorStore:
+    """
+    Interface shared by the retrieval backends.
+
+    query() is awaited on the request path and returns {"matches": [...]} in the
+    same shape as a Pinecone query response (id, score, metadata). upsert() and
+    delete() are synchronous and only used by ingestion.
+    """
+
+    async def query(self, vector: List[float], top_k: int) -> Any:
+        raise NotImplementedError
+
+    def upsert(self, records: List[VectorRecord]) -> None:
+        raise NotImplementedError
+
+    def delete(self, ids: List[str]) -> None:
+        raise NotImplementedError
+
+    def save(self) -> None:
+        """
+        Persist buffered writes (a no-op for hosted indexes).
+        """
+
+    def close(self) -> None:
+        pass
+
+
+class PineconeStore(VectorStore):
+    """
+    Runs the synchronous Pinecone client on a bounded thread pool so a query never
+    blocks the event loop. A semaphore caps in-flight queries (so a burst can't
+    queue unbounded work behind the pool) and each query has its own timeout.
+    """
+
+    def __init__(
+        self,
+        index: Any,
+        max_workers: int = 8,
+        max_concurrency: int = 8,
+        timeout: float = 10.0,
+    ):
+        self.index = index
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="pinecone"
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def query(self, vector: List[float], top_k: int) -> Any:
+        """
+        Query the index off the event loop. Raises asyncio.TimeoutError if the
+        query takes longer than `timeout` (the worker thread is left to finish).
+        """
+        loop = asyncio.get_running_loop()
+        call = partial(
+            self.index.query,
+            vector=vector,
+            top_k=top_k,
+            include_values=False,
+            include_metadata=True,
+        )
+        async with self._semaphore:
+            return await asyncio.wait_for(
+                loop.run_in_executor(self._executor, call), timeout=self.timeout
+            )
+
+    def upsert(self, records: List[VectorRecord]) -> None:
+        self.index.upsert(vectors=records)
+
+    def delete(self, ids: List[str]) -> None:
+        self.index.delete(ids=ids)
+
+    def close(self) -> None:
+        """
+        Stop accepting work and drop anything still queued.
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class LocalStore(VectorStore):
+    """
+    In-process cosine index for a corpus small enough to live in RAM.
+
+    Vectors are unit-normalized float32 rows in `<path>/vectors.npy`, memory-mapped
+    read-only, so several workers share one copy via the page cache. Ids and
+    metadata live alongside in `<path>/records.json`. A query is one matrix-vector
+    product plus argpartition for the top-k; for a few thousand chunks that is a
+    couple of milliseconds (memory-bandwidth bound), so it runs inline on the
+    event loop. Batching queries through search_batch() amortizes the scan.
+
+    Writes (ingestion only) are buffered in memory and published atomically by
+    save(); a serving process notices the new files and re-maps them.
+    """
+
+    VECTORS_FILE = "vectors.npy"
+    RECORDS_FILE = "records.json"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.timeout = 0.0  # queries don't leave the process
+        self._matrix: Optional[np.ndarray] = None
+        self._ids: List[str] = []
+        self._metadata: List[Dict[str, Any]] = []
+        self._loaded_mtime_ns = 0
+        self._dirty = False
+        self._load()
+
+    #####################
+    # Query path
+    #####################
+    async def query(self, vector: List[float], top_k: int) -> Dict[str, Any]:
+        self._maybe_reload()
+        return self.search_batch([vector], top_k)[0]
+
+    def search_batch(
+        self, vectors: Iterable[Sequence[float]], top_k: int
+    ) -> List[Dict[str, Any]]:
+        """
+        Score a batch of query vectors with one matrix product.
+        """
+        queries = np.asarray(list(vectors), dtype=np.float32)
+        if self._matrix is None or not len(self._ids) or not len(queries):
+            return [{"matches": []} for _ in range(len(queries))]
+
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        scores = (queries / norms) @ self._matrix.T  # (batch, n_docs)
+
+        k = min(top_k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+
+        results = []
+        for row, candidates in zip(scores, top):
+            ordered = candidates[np.argsort(-row[candidates])]
+            results.append(
+                {
+                    "matches": [
+                        {
+                            "id": self._ids[i],
+                            "score": float(row[i]),
+                            "metadata": self._metadata[i],
+                        }
+                        for i in ordered
+                    ]
+                }
+            )
+        return results
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    #####################
+    # Ingestion path
+    #####################
+    def upsert(self, records: List[VectorRecord]) -> None:
+        if not records:
+            return
+        self._materialize()
+        positions = {doc_id: i for i, doc_id in enumerate(self._ids)}
+        base = len(self._ids)  # rows already in the matrix
+
+        new_rows = []
+        for doc_id, vector, metadata in records:
+            v = np.asarray(vector, dtype=np.float32)
+            norm = np.linalg.norm(v)
+            if norm:
+                v = v / norm
+            pos = positions.get(doc_id)
+            if pos is None:
+                positions[doc_id] = len(self._ids)
+                new_rows.append(v)
+                self._ids.append(doc_id)
+                self._metadata.append(metadata)
+            else:
+                if pos < base:
+                    self._matrix[pos] = v
+                else:
+                    new_rows[pos - base] = v
+                self._metadata[pos] = metadata
+
+        if new_rows:
+            stacked = np.vstack(new_rows)
+            self._matrix = (
+                stacked
+                if self._matrix is None or not len(self._matrix)
+                else np.vstack([self._matrix, stacked])
+            )
+        self._dirty = True
+
+    def delete(self, ids: List[str]) -> None:
+        doomed = set(ids)
+        if not doomed:
+            return
+        self._materialize()
+        keep = [i for i, doc_id in enumerate(self._ids) if doc_id not in doomed]
+        self._ids = [self._ids[i] for i in keep]
+        self._metadata = [self._metadata[i] for i in keep]
+        if self._matrix is not None:
+            self._matrix = self._matrix[keep]
+        self._dirty = True
+
+    def save(self) -> None:
+        """
+        Atomically publish the current vectors and records.
+        """
+        if not self._dirty:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        vectors_path = os.path.join(self.path, self.VECTORS_FILE)
+        records_path = os.path.join(self.path, self.RECORDS_FILE)
+
+        matrix = self._matrix if self._matrix is not None else np.zeros((0, 0))
+        with open(f"{vectors_path}.tmp", "wb") as f:
+            np.save(f, matrix.astype(np.float32, copy=False))
+        with open(f"{records_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({"ids": self._ids, "metadata": self._metadata}, f)
+
+        # Vectors first: a reader keys its reload off the records file
+        os.replace(f"{vectors_path}.tmp", vectors_path)
+        os.replace(f"{records_path}.tmp", records_path)
+        self._dirty = False
+        logger.info(f"[LocalStore] Saved {len(self._ids)} vectors to {self.path}")
+
+    def close(self) -> None:
+        if self._dirty:
+            self.save()
+
+    #####################
+    # Loading
+    #####################
+    def _records_mtime_ns(self) -> int:
+        try:
+            return os.stat(os.path.join(self.path, self.RECORDS_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def _load(self) -> None:
+        mtime_ns = self._records_mtime_ns()
+        if not mtime_ns:
+            logger.warning(f"[LocalStore] No index found at {self.path}")
+            return
+        try:
+            with open(
+                os.path.join(self.path, self.RECORDS_FILE), "r", encoding="utf-8"
+            ) as f:
+                records = json.load(f)
+            matrix = np.load(
+                os.path.join(self.path, self.VECTORS_FILE), mmap_mode="r"
+            )
+        except Exception as e:
+            logger.error(f"[LocalStore] Failed to load index at {self.path}: {e}")
+            return
+        if matrix.shape[0] != len(records["ids"]):
+            logger.error(
+                f"[LocalStore] vectors/records mismatch at {self.path}, keeping old index"
+            )
+            return
+        self._matrix = matrix
+        self._ids = records["ids"]
+        self._metadata = records["metadata"]
+        self._loaded_mtime_ns = mtime_ns
+        logger.info(f"[LocalStore] Loaded {len(self._ids)} vectors from {self.path}")
+
+    def _maybe_reload(self) -> None:
+        if not self._dirty and self._records_mtime_ns() != self._loaded_mtime_ns:
+            self._load()
+
+    def _materialize(self) -> None:
+        """
+        Swap the read-only memory map for a writable in-memory copy.
+        """
+        if self._matrix is not None and not self._matrix.flags.writeable:
+            self._matrix = np.array(self._matrix)
+
+
+_vector_store_instance: Optional[VectorStore] = None
+
+
+def get_vector_store() -> VectorStore:
+    """
+    Returns the retrieval backend named by `vector_backend` ("pinecone" or "local").
+    """
+    global _vector_store_instance
+    if _vector_store_instance is not None:
+        return _vector_store_instance
+
+    backend = config.get("vector_backend", "pinecone")
+    if backend == "local":
+        _vector_store_instance = LocalStore(
+            config.get("local_index_path", "server/local_index")
+        )
+    elif backend == "pinecone":
+        from pinecone import Pinecone
+
+        pc = Pinecone(api_key=config.get_or_error("PINECONE_API_KEY"))
+        index = pc.Index(config.get("INDEX_NAME", "mauibuildingcode"))
+        _vector_store_instance = PineconeStore(
+            index,
+            max_workers=config.get("pinecone_max_workers", 8),
+            max_concurrency=config.get("pinecone_max_concurrency", 8),
+            timeout=config.get("pinecone_timeout", 10.0),
+        )
+    else:
+        raise ValueError(f"Unknown vector_backend '{backend}'")
+
+    logger.info(f"[vectorstore] Using '{backend}' retrieval backend")
+    return _vector_store_instance